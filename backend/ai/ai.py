@@ -1,13 +1,35 @@
 from __future__ import annotations
 
+from array import array
+import asyncio
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+import csv
 from dataclasses import dataclass, field
+from functools import lru_cache
+import heapq
+import itertools
 import json
+import mmap
+import os
+import secrets
+import struct
 import sys
-from typing import Any, Dict, Iterable, List, Optional, Tuple
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, Iterable, Iterator, List, Optional, Set, Tuple
 import unicodedata
 import math
+import multiprocessing
 from difflib import SequenceMatcher
 
+try:
+    import numpy as np
+except ImportError:  # numpy é opcional: sem ele usamos só os caminhos em Python puro
+    np = None
+
 @dataclass
 class Variable:
     name: str
@@ -24,19 +46,69 @@ class Constraint:
 
 
 class SimpleCSP:
+    """Backtracking sobre variáveis com domínios finitos.
+
+    Por omissão é o backtracking cronológico: variáveis pela ordem em que foram adicionadas e
+    valores pela ordem do domínio, por isso as soluções saem sempre pela mesma ordem.
+    Com propagar=True faz forward checking (e, opcionalmente, arc consistency nas constraints
+    binárias antes da pesquisa) e escolhe a próxima variável por MRV, desempatando pelo grau;
+    as soluções são as mesmas, mas podem sair por outra ordem.
+    """
+
     def __init__(self) -> None:
         self.variables: List[Variable] = []
         self.constraints: List[Constraint] = []
+        # variável -> constraints em que entra
+        self.por_variavel: Dict[str, List[Constraint]] = {}
+        # contadores da última pesquisa
+        self.nos = 0
+        self.verificacoes = 0
 
     def add_variable(self, variable: Variable) -> None:
         self.variables.append(variable)
+        self.por_variavel.setdefault(variable.name, [])
 
     def add_constraint(self, constraint: Constraint) -> None:
         self.constraints.append(constraint)
+        for nome in dict.fromkeys(constraint.variables):
+            self.por_variavel.setdefault(nome, []).append(constraint)
+
+    def _verificar(self, constraint: Constraint, assignment: Dict[str, Any]) -> bool:
+        self.verificacoes += 1
+        return constraint.func(assignment)
+
+    def solve(
+        self,
+        max_solutions: int = 10,
+        propagar: bool = False,
+        arco_consistencia: bool = False,
+        ordenar_valores: Optional[Callable[[str, List[Any], Dict[str, Any]], Iterable[Any]]] = None,
+    ) -> List[Dict[str, Any]]:
+        """Até `max_solutions` atribuições completas que cumprem todas as constraints.
+
+        `ordenar_valores(variavel, valores, atribuicao)` muda a ordem em que os valores são tentados.
+        Uma constraint sobre uma variável que não foi adicionada nunca é verificada.
+        """
+        self.nos = 0
+        self.verificacoes = 0
+        if propagar:
+            return self._solve_propagacao(max_solutions, arco_consistencia, ordenar_valores)
+        return self._solve_cronologico(max_solutions, ordenar_valores)
 
-    def solve(self, max_solutions: int = 10) -> List[Dict[str, Any]]:
+    def _solve_cronologico(
+        self, max_solutions: int, ordenar_valores: Optional[Callable[[str, List[Any], Dict[str, Any]], Iterable[Any]]]
+    ) -> List[Dict[str, Any]]:
         ordered_vars = self.variables
         solutions: List[Dict[str, Any]] = []
+        posicao = {v.name: i for i, v in enumerate(ordered_vars)}
+
+        # cada constraint é verificada uma vez, quando a última das suas variáveis é atribuída
+        verificar_em: List[List[Constraint]] = [[] for _ in ordered_vars]
+        for c in self.constraints:
+            if not all(v in posicao for v in c.variables):
+                continue
+            if ordered_vars:
+                verificar_em[max((posicao[v] for v in c.variables), default=0)].append(c)
 
         def backtrack(idx: int, assignment: Dict[str, Any]) -> None:
             if len(solutions) >= max_solutions:
@@ -46,20 +118,148 @@ class SimpleCSP:
                 return
 
             var = ordered_vars[idx]
-            for value in var.domain:
+            constraints = verificar_em[idx]
+            valores = var.domain if ordenar_valores is None else ordenar_valores(var.name, var.domain, assignment)
+            for value in valores:
+                self.nos += 1
                 assignment[var.name] = value
-                if all(
-                    c.func(assignment)
-                    for c in self.constraints
-                    if all(v in assignment for v in c.variables)
-                ):
+                if all(self._verificar(c, assignment) for c in constraints):
                     backtrack(idx + 1, assignment)
+                if len(solutions) >= max_solutions:
+                    break
             assignment.pop(var.name, None)
 
         backtrack(0, {})
         return solutions
 
+    def _arcos(self, dominios: Dict[str, List[Any]]) -> bool:
+        """AC-3 nas constraints binárias; devolve False se algum domínio ficar vazio."""
+        binarias: List[Tuple[Tuple[str, ...], Constraint]] = []
+        for c in self.constraints:
+            vs = tuple(dict.fromkeys(c.variables))
+            if len(vs) == 2 and all(v in dominios for v in vs):
+                binarias.append((vs, c))
+
+        fila = [(x, y, c) for (a, b), c in binarias for x, y in ((a, b), (b, a))]
+        assignment: Dict[str, Any] = {}
+        while fila:
+            x, y, c = fila.pop()
+            restantes = []
+            for vx in dominios[x]:
+                assignment[x] = vx
+                for vy in dominios[y]:
+                    assignment[y] = vy
+                    if self._verificar(c, assignment):
+                        restantes.append(vx)
+                        break
+            assignment.clear()
+            if len(restantes) == len(dominios[x]):
+                continue
+            if not restantes:
+                return False
+            dominios[x] = restantes
+            # os vizinhos de x podem ter perdido o apoio que tinham em x
+            fila.extend((z, x, c2) for vs, c2 in binarias if c2 is not c and x in vs for z in vs if z != x)
+        return True
+
+    def _solve_propagacao(
+        self,
+        max_solutions: int,
+        arco_consistencia: bool,
+        ordenar_valores: Optional[Callable[[str, List[Any], Dict[str, Any]], Iterable[Any]]],
+    ) -> List[Dict[str, Any]]:
+        nomes = [v.name for v in self.variables]
+        dominios: Dict[str, List[Any]] = {v.name: list(v.domain) for v in self.variables}
+        variaveis_de = {id(c): tuple(dict.fromkeys(c.variables)) for c in self.constraints}
+        ativas = [c for c in self.constraints if all(v in dominios for v in variaveis_de[id(c)])]
+        # por atribuir, por constraint; a constraint verifica-se quando chega a 0 e propaga quando chega a 1
+        faltam = {id(c): len(variaveis_de[id(c)]) for c in ativas}
+        assignment: Dict[str, Any] = {}
+
+        for c in ativas:
+            vs = variaveis_de[id(c)]
+            if not vs:
+                if not self._verificar(c, assignment):
+                    return []
+            elif len(vs) == 1:
+                # consistência de nó: as unárias filtram o domínio antes da pesquisa
+                (x,) = vs
+                dominios[x] = [v for v in dominios[x] if self._verificar(c, {x: v})]
+        if any(not dominios[n] for n in nomes):
+            return []
+        if arco_consistencia and not self._arcos(dominios):
+            return []
+
+        relevantes = {n: [c for c in self.por_variavel[n] if id(c) in faltam and len(variaveis_de[id(c)]) > 1] for n in nomes}
+        solutions: List[Dict[str, Any]] = []
+
+        def escolher() -> str:
+            # MRV: o menor domínio atual; empates pelo grau (constraints com outras variáveis por atribuir)
+            melhor = None
+            melhor_chave: Tuple[int, int] = (0, 0)
+            for nome in nomes:
+                if nome in assignment:
+                    continue
+                grau = sum(1 for c in relevantes[nome] if faltam[id(c)] > 1)
+                chave = (len(dominios[nome]), -grau)
+                if melhor is None or chave < melhor_chave:
+                    melhor, melhor_chave = nome, chave
+            return melhor  # type: ignore[return-value]
+
+        def forward_check(var: str) -> Optional[Dict[str, List[Any]]]:
+            """Filtra os domínios das variáveis que ficaram sozinhas numa constraint com `var`."""
+            podados: Dict[str, List[Any]] = {}
+            for c in relevantes[var]:
+                if faltam[id(c)] != 1:
+                    continue
+                y = next(v for v in variaveis_de[id(c)] if v not in assignment)
+                antes = dominios[y]
+                restantes = []
+                for valor in antes:
+                    assignment[y] = valor
+                    if self._verificar(c, assignment):
+                        restantes.append(valor)
+                del assignment[y]
+                if len(restantes) == len(antes):
+                    continue
+                podados.setdefault(y, antes)
+                dominios[y] = restantes
+                if not restantes:
+                    dominios.update(podados)
+                    return None
+            return podados
+
+        def backtrack() -> None:
+            if len(assignment) == len(nomes):
+                solutions.append(dict(assignment))
+                return
+            var = escolher()
+            valores = dominios[var]
+            if ordenar_valores is not None:
+                valores = list(ordenar_valores(var, valores, assignment))
+            for c in relevantes[var]:
+                faltam[id(c)] -= 1
+            for valor in valores:
+                self.nos += 1
+                assignment[var] = valor
+                # com forward checking, as constraints completas por esta atribuição já foram verificadas
+                # quando o domínio de `var` foi filtrado
+                podados = forward_check(var)
+                if podados is not None:
+                    backtrack()
+                    dominios.update(podados)
+                del assignment[var]
+                if len(solutions) >= max_solutions:
+                    break
+            for c in relevantes[var]:
+                faltam[id(c)] += 1
+
+        if max_solutions > 0:
+            backtrack()
+        return solutions
+
 
+@lru_cache(maxsize=1 << 14)
 def _normalize(text: str) -> str:
     nfkd = unicodedata.normalize("NFKD", text or "")
     cleaned = "".join(c for c in nfkd if not unicodedata.combining(c)).lower()
@@ -67,10 +267,221 @@ def _normalize(text: str) -> str:
     return " ".join(cleaned.split())
 
 
+# O vocabulário (instrumentos, localizações, características) é pequeno, por isso
+# quase todas as comparações se repetem: guardamos os pares já calculados (LRU).
+SIMILARIDADE_CACHE_MAX = 1 << 16
+
+
+@lru_cache(maxsize=SIMILARIDADE_CACHE_MAX)
+def _ratio_cache(a: str, b: str) -> float:
+    return SequenceMatcher(None, a, b).ratio()
+
+
+def _ratio_normalizado(a: str, b: str) -> float:
+    """Como _safe_ratio, mas para strings que já passaram por _normalize."""
+    if not a or not b:
+        return 0.0
+    return _ratio_cache(a, b)
+
+
+def similaridade_cache_info() -> Dict[str, Any]:
+    info = _ratio_cache.cache_info()
+    pedidos = info.hits + info.misses
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "tamanho": info.currsize,
+        "maximo": info.maxsize,
+        "taxa_acerto": round(info.hits / pedidos, 4) if pedidos else 0.0,
+    }
+
+
+def limpar_similaridade_cache() -> None:
+    _ratio_cache.cache_clear()
+
+
 def _safe_ratio(a: str, b: str) -> float:
     if not a or not b:
         return 0.0
-    return SequenceMatcher(None, _normalize(a), _normalize(b)).ratio()
+    return _ratio_normalizado(_normalize(a), _normalize(b))
+
+
+def _mascaras(a: str) -> Dict[str, int]:
+    """Para cada carácter de `a`, os bits das posições onde aparece."""
+    mascaras: Dict[str, int] = {}
+    for i, c in enumerate(a):
+        mascaras[c] = mascaras.get(c, 0) | (1 << i)
+    return mascaras
+
+
+def _contagem(a: str) -> Dict[str, int]:
+    """Quantas vezes aparece cada carácter de `a`."""
+    contagem: Dict[str, int] = {}
+    for c in a:
+        contagem[c] = contagem.get(c, 0) + 1
+    return contagem
+
+
+def _lcs(mascaras: Dict[str, int], n: int, b: str) -> int:
+    """Comprimento da maior subsequência comum entre `a` (com n = len(a) e as _mascaras(a)) e `b`.
+
+    Algoritmo bit-paralelo de Allison-Dix/Hyyrö: uma operação de inteiros por carácter de `b`.
+    """
+    todos = (1 << n) - 1
+    v = todos
+    for c in b:
+        u = v & mascaras.get(c, 0)
+        v = ((v + u) | (v - u)) & todos
+    return n - bin(v).count("1")
+
+
+def _indel_ratio(a: str, b: str) -> float:
+    """2·LCS / (|a| + |b|): a similaridade Indel (a do RapidFuzz) para strings já normalizadas."""
+    if not a or not b:
+        return 0.0
+    return 2.0 * _lcs(_mascaras(a), len(a), b) / (len(a) + len(b))
+
+
+# Nenhum predicado nem score olha para similaridades abaixo do menor limiar (0.75): os candidatos
+# que chegam a ser pontuados cumprem sempre as constraints relaxadas. Abaixo deste piso os motores
+# de similaridade podem devolver 0.0 em vez do valor exato.
+PISO_SIMILARIDADE = 0.75
+
+
+class SimilaridadeDifflib:
+    """Motor de referência: SequenceMatcher.ratio() de cada par, o mesmo valor que _safe_ratio."""
+
+    def vetor(self, termo: str, termos: List[str], de: bool) -> List[float]:
+        """[ratio(termo, t) for t in termos] com `de`, senão [ratio(t, termo) for t in termos]."""
+        if de:
+            return [_ratio_normalizado(termo, t) for t in termos]
+        return [_ratio_normalizado(t, termo) for t in termos]
+
+    def par(self, termo: str, t: str, de: bool) -> float:
+        """vetor(termo, [t], de)[0]: a entrada de um termo novo num vetor já calculado."""
+        return self.vetor(termo, [t], de)[0]
+
+
+class SimilaridadePrefiltro(SimilaridadeDifflib):
+    """Igual ao difflib a partir de PISO_SIMILARIDADE; os pares que não lá podem chegar ficam a 0.0.
+
+    Os blocos do SequenceMatcher formam uma subsequência comum, por isso ratio <= 2·LCS / (|a| + |b|)
+    e LCS <= caracteres em comum (contados com repetição). Os termos são primeiro filtrados pelos
+    caracteres em comum (vetorial, com numpy), depois pelo LCS bit-paralelo, e só os que sobram
+    passam pelo difflib. Nenhum filtro rejeita um par que o difflib aceitaria.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._termos: Optional[List[str]] = None
+        self._contagens: List[Dict[str, int]] = []
+        self._alfabeto: Dict[str, int] = {}
+        self._matriz: Any = None
+        self._comprimentos: Any = None
+        # linhas da matriz já preenchidas (a matriz tem folga para os termos seguintes)
+        self._feitas = 0
+
+    def _indexar(self, termos: List[str]) -> None:
+        # o Vocabulario só acrescenta termos ao fim da lista (ou troca a lista inteira em carregar):
+        # só as linhas dos termos novos são preenchidas
+        with self._lock:
+            if termos is not self._termos:
+                self._termos = termos
+                self._contagens = []
+                self._alfabeto = {}
+                self._matriz = None
+            self._contagens.extend(_contagem(t) for t in termos[len(self._contagens) :])
+            if np is None:
+                return
+            n = len(termos)
+            feitas = self._feitas if self._matriz is not None else 0
+            if feitas == n and self._matriz is not None:
+                return
+            for contagem in self._contagens[feitas:n]:
+                for c in contagem:
+                    self._alfabeto.setdefault(c, len(self._alfabeto))
+            linhas, colunas = self._matriz.shape if self._matriz is not None else (0, 0)
+            if self._matriz is None or n > linhas or len(self._alfabeto) > colunas:
+                # cresce para o dobro, para um termo novo de cada vez não copiar a matriz toda
+                matriz = np.zeros((max(n, 2 * linhas), max(1, len(self._alfabeto), 2 * colunas)), dtype=np.int32)
+                comprimentos = np.zeros(matriz.shape[0], dtype=np.int64)
+                if self._matriz is not None:
+                    matriz[:linhas, :colunas] = self._matriz
+                    comprimentos[:linhas] = self._comprimentos
+                self._matriz, self._comprimentos = matriz, comprimentos
+            for i in range(feitas, n):
+                for c, k in self._contagens[i].items():
+                    self._matriz[i, self._alfabeto[c]] = k
+                self._comprimentos[i] = len(termos[i])
+            self._feitas = n
+
+    def _possiveis(self, termo: str, termos: List[str]) -> List[int]:
+        """Índices dos termos cujos caracteres em comum com `termo` ainda permitem chegar ao piso."""
+        self._indexar(termos)
+        m = len(termos)
+        n = len(termo)
+        contagem = _contagem(termo)
+        # folga para o piso não cair entre dois floats iguais ao ratio do difflib
+        piso = PISO_SIMILARIDADE - 1e-9
+        if np is None:
+            possiveis = []
+            for i, t in enumerate(termos):
+                existentes = self._contagens[i]
+                comuns = sum(min(k, existentes.get(c, 0)) for c, k in contagem.items())
+                if 2 * comuns >= piso * (n + len(t)):
+                    possiveis.append(i)
+            return possiveis
+        comuns = np.zeros(m, dtype=np.int64)
+        for c, k in contagem.items():
+            coluna = self._alfabeto.get(c)
+            if coluna is not None:
+                comuns += np.minimum(self._matriz[:m, coluna], k)
+        return np.flatnonzero(2 * comuns >= piso * (self._comprimentos[:m] + n)).tolist()
+
+    def vetor(self, termo: str, termos: List[str], de: bool) -> List[float]:
+        vetor = [0.0] * len(termos)
+        if not termo:
+            return vetor
+        n = len(termo)
+        mascaras = _mascaras(termo)
+        piso = PISO_SIMILARIDADE - 1e-9
+        for i in self._possiveis(termo, termos):
+            t = termos[i]
+            if 2 * _lcs(mascaras, n, t) < piso * (n + len(t)):
+                continue
+            vetor[i] = _ratio_normalizado(termo, t) if de else _ratio_normalizado(t, termo)
+        return vetor
+
+    def par(self, termo: str, t: str, de: bool) -> float:
+        # o LCS já implica o filtro dos caracteres em comum, por isso basta ele para dar o valor de vetor()
+        piso = PISO_SIMILARIDADE - 1e-9
+        if not termo or 2 * _lcs(_mascaras(termo), len(termo), t) < piso * (len(termo) + len(t)):
+            return 0.0
+        return _ratio_normalizado(termo, t) if de else _ratio_normalizado(t, termo)
+
+
+class SimilaridadeIndel(SimilaridadeDifflib):
+    """Usa a similaridade Indel (2·LCS / (|a| + |b|)) em vez do SequenceMatcher.
+
+    É mais rápida mas não é o mesmo valor: nunca fica abaixo do ratio do difflib, por isso aceita
+    mais pares perto dos limiares. Só para quem escolher trocar de semântica.
+    """
+
+    def vetor(self, termo: str, termos: List[str], de: bool) -> List[float]:
+        if not termo:
+            return [0.0] * len(termos)
+        n = len(termo)
+        mascaras = _mascaras(termo)
+        return [2.0 * _lcs(mascaras, n, t) / (n + len(t)) if t else 0.0 for t in termos]
+
+
+MOTORES_SIMILARIDADE: Dict[str, Callable[[], SimilaridadeDifflib]] = {
+    "prefiltro": SimilaridadePrefiltro,
+    "difflib": SimilaridadeDifflib,
+    "indel": SimilaridadeIndel,
+}
+# motor dos vocabulários criados sem escolher outro (ver --similaridade no modo servidor)
+MOTOR_SIMILARIDADE = "prefiltro"
 
 
 INSTRUMENT_ALIASES = {
@@ -100,12 +511,23 @@ def _parse_int(value: Any) -> Optional[int]:
     except (TypeError, ValueError):
         return None
 
+
+def _parse_raio(value: Any) -> Optional[float]:
+    """Raio em km (> 0); qualquer outro valor desliga a pesquisa por distância."""
+    try:
+        raio = float(value)
+    except (TypeError, ValueError):
+        return None
+    return raio if 0 < raio < math.inf else None
+
 @dataclass
 class Preferencias:
     instrumento: Optional[str] = None
     anos_experiencia: Optional[int] = None
     localizacao: Optional[str] = None
     caracteristicas: List[str] = field(default_factory=list)
+    # com raio_km, a localização passa a ser a distância ao concelho alvo (ver GeoLocalizacoes)
+    raio_km: Optional[float] = None
 
     instrumentos_requeridos: List[str] = field(default_factory=list)
 
@@ -113,109 +535,991 @@ class Preferencias:
 
     politica_localizacao_banda: str = "todos_igual"
 
-class Matcher:
-    def __init__(self, musicos: Iterable[Dict[str, Any]]) -> None:
-        self.musicos = list(musicos)
+    # ids que nunca entram nos resultados (p.ex. o próprio utilizador que pesquisa)
+    excluir_ids: List[Any] = field(default_factory=list)
+
+@dataclass
+class Orcamento:
+    """Limites de uma pesquisa de banda (tempo e/ou nós); no fim guarda os contadores da pesquisa.
+
+    As pesquisas de 1 músico só consultam o `cancelado` (ver interrompido).
+    """
+
+    prazo_s: Optional[float] = None
+    max_nos: Optional[int] = None
+
+    nos: int = 0
+    podas: int = 0
+    completo: bool = True
+    limite: Optional[float] = field(default=None, repr=False)
+    # na pesquisa paralela os nós de todos os processos contam para o mesmo max_nos
+    partilhado: Any = field(default=None, repr=False)
+    # threading.Event do servidor: quando o cliente desiste, a pesquisa pára como se acabasse o prazo
+    cancelado: Any = field(default=None, repr=False)
+
+    def iniciar(self) -> None:
+        self.limite = (time.monotonic() + self.prazo_s) if self.prazo_s is not None else None
+
+    @property
+    def limitado(self) -> bool:
+        """Se o pedido trouxe prazo ou max_nos (um orçamento só com `cancelado` não é reportado)."""
+        return self.prazo_s is not None or self.max_nos is not None
+
+    def esgotado(self, nos: int) -> bool:
+        if self.partilhado is None and self.max_nos is not None and nos > self.max_nos:
+            return True
+        # o relógio e o contador partilhado só são consultados a cada 64 nós
+        if nos & 63:
+            return False
+        if self.cancelado is not None and self.cancelado.is_set():
+            return True
+        if self.partilhado is not None:
+            total = self.partilhado.somar(64)
+            if self.max_nos is not None and total > self.max_nos:
+                return True
+        return self.limite is not None and time.monotonic() > self.limite
+
+    def interrompido(self, i: int = 0) -> bool:
+        """Se o cliente desistiu, verificado a cada 64 passos; marca a pesquisa como incompleta."""
+        if i & 63 or self.cancelado is None or not self.cancelado.is_set():
+            return False
+        self.completo = False
+        return True
+
+    def resumo(self) -> Dict[str, Any]:
+        return {"completo": self.completo, "nos": self.nos, "podas": self.podas}
+
+
+@dataclass
+class Estatisticas:
+    """Onde foi gasto o tempo de um pedido; só é recolhido quando passado a resolver().
+
+    As fases somam-se por nome ("exato.dominios", "relaxado.pesquisa", ...). Os contadores de
+    similaridade são diferenças da cache global, por isso incluem pedidos concorrentes.
+    """
+
+    modo: str = ""
+    fases_ms: Dict[str, float] = field(default_factory=dict)
+    # regime -> papel (ou "musico") -> candidatos que cumprem as constraints
+    dominios: Dict[str, Dict[str, int]] = field(default_factory=dict)
+    nos: int = 0
+    podas: int = 0
+    limites: int = 0
+    relaxamento: bool = False
+    similaridade: Dict[str, int] = field(default_factory=dict)
+    total_ms: float = 0.0
+    _inicio: Tuple[float, int, int, int] = field(default=(0.0, 0, 0, 0), repr=False)
+
+    @contextmanager
+    def fase(self, nome: str) -> Iterator[None]:
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.fases_ms[nome] = self.fases_ms.get(nome, 0.0) + (time.perf_counter() - inicio) * 1000.0
+
+    def dominio(self, regime: str, nome: str, tamanho: int) -> None:
+        self.dominios.setdefault(regime, {})[nome] = tamanho
+
+    def iniciar(self, vocab: "VocabularioMatcher") -> None:
+        info = _ratio_cache.cache_info()
+        self._inicio = (time.perf_counter(), info.hits, info.misses, vocab.vetores_calculados())
+
+    def terminar(self, vocab: "VocabularioMatcher") -> None:
+        inicio, hits, misses, vetores = self._inicio
+        info = _ratio_cache.cache_info()
+        self.total_ms = (time.perf_counter() - inicio) * 1000.0
+        self.similaridade = {
+            "ratios_calculados": info.misses - misses,
+            "ratios_em_cache": info.hits - hits,
+            "vetores_calculados": vocab.vetores_calculados() - vetores,
+        }
+
+    def resumo(self) -> Dict[str, Any]:
+        return {
+            "modo": self.modo,
+            "total_ms": round(self.total_ms, 3),
+            "fases_ms": {nome: round(ms, 3) for nome, ms in self.fases_ms.items()},
+            "dominios": self.dominios,
+            "nos": self.nos,
+            "podas": self.podas,
+            "limites": self.limites,
+            "relaxamento": self.relaxamento,
+            "similaridade": self.similaridade,
+        }
+
+
+def _fase(estatisticas: Optional[Estatisticas], nome: str) -> Any:
+    return estatisticas.fase(nome) if estatisticas is not None else nullcontext()
+
+
+class Vocabulario:
+    """Interna termos normalizados em IDs inteiros e guarda a similaridade entre eles.
+
+    As linhas/colunas de similaridade são calculadas uma vez por termo (pelo motor escolhido em
+    MOTORES_SIMILARIDADE) e ficam em listas, por isso os predicados passam a fazer apenas lookups por ID.
+    """
+
+    MAX_VETORES = 4096
+
+    def __init__(self, motor: Optional[str] = None) -> None:
+        self.motor = MOTORES_SIMILARIDADE[motor or MOTOR_SIMILARIDADE]()
+        self.termos: List[str] = []
+        self.ids: Dict[str, int] = {}
+        self._de: Dict[str, List[float]] = {}
+        self._para: Dict[str, List[float]] = {}
+        self._expansoes: Dict[Tuple[str, ...], Tuple[List[Tuple[int, int]], int]] = {}
+        self._matriz: Any = None
+        self._lock = threading.Lock()
+        # só conta os vetores calculados (os lookups em cache ficam sem custo extra)
+        self.calculados = 0
+
+    def __len__(self) -> int:
+        return len(self.termos)
+
+    def carregar(self, termos: List[str]) -> None:
+        self.termos = list(termos)
+        self.ids = {t: i for i, t in enumerate(self.termos)}
+        self._de = {}
+        self._para = {}
+        self._expansoes = {}
+        self._matriz = None
+
+    def internar(self, termo: str) -> int:
+        if not termo:
+            return -1
+        idx = self.ids.get(termo)
+        if idx is not None:
+            return idx
+        with self._lock:
+            idx = self.ids.get(termo)
+            if idx is None:
+                idx = len(self.termos)
+                self.termos.append(termo)
+                self.ids[termo] = idx
+                # os vetores já calculados só ganham a entrada do termo novo; as expansões dependem
+                # de todos os termos e voltam a ser calculadas
+                for alvo, vetor in self._de.items():
+                    vetor.append(self.motor.par(alvo, termo, de=True))
+                for alvo, vetor in self._para.items():
+                    vetor.append(self.motor.par(alvo, termo, de=False))
+                self._expansoes = {}
+        return idx
+
+    def _guardar(self, cache: Dict[str, List[float]], termo: str, vetor: List[float]) -> List[float]:
+        if len(cache) >= self.MAX_VETORES:
+            cache.clear()
+        cache[termo] = vetor
+        return vetor
+
+    def similaridades_de(self, termo: str) -> List[float]:
+        """[ratio(termo, t) for t in termos]; abaixo de PISO_SIMILARIDADE o motor pode dar 0.0."""
+        vetor = self._de.get(termo)
+        if vetor is None:
+            self.calculados += 1
+            vetor = self._guardar(self._de, termo, self.motor.vetor(termo, self.termos, de=True))
+        return vetor
+
+    def similaridades_para(self, termo: str) -> List[float]:
+        """[ratio(t, termo) for t in termos]; abaixo de PISO_SIMILARIDADE o motor pode dar 0.0."""
+        vetor = self._para.get(termo)
+        if vetor is None:
+            self.calculados += 1
+            vetor = self._guardar(self._para, termo, self.motor.vetor(termo, self.termos, de=False))
+        return vetor
+
+    def expandir(self, desejados: Tuple[str, ...]) -> Tuple[List[Tuple[int, int]], int]:
+        """Para cada termo desejado, o bitset dos IDs com ratio(desejado, t) >= 0.85 e o dos >= 0.75;
+        e o bitset dos IDs que servem (>= 0.75) a mais do que um desejado.
 
-    def _anos_por_instrumento(self, musico: Dict[str, Any], instrumento: str) -> Optional[int]:
-        alvo = _instrument_key(instrumento)
+        Calculado uma vez por conjunto de desejados; um perfil (ver PerfilMusico.carac_bits) tem um
+        match com um desejado sse o AND com o bitset dele não for zero.
+        """
+        expansao = self._expansoes.get(desejados)
+        if expansao is None:
+            mascaras = []
+            vistos = partilhados = 0
+            for termo in desejados:
+                exata = relaxada = 0
+                for i, r in enumerate(self.similaridades_de(termo)):
+                    if r >= 0.75:
+                        relaxada |= 1 << i
+                        if r >= 0.85:
+                            exata |= 1 << i
+                mascaras.append((exata, relaxada))
+                partilhados |= vistos & relaxada
+                vistos |= relaxada
+            if len(self._expansoes) >= self.MAX_VETORES:
+                self._expansoes.clear()
+            expansao = self._expansoes[desejados] = (mascaras, partilhados)
+        return expansao
+
+    def vizinhos(self, termo: str, limiar: float) -> List[int]:
+        """IDs dos termos t com ratio(t, termo) >= limiar (limiar >= PISO_SIMILARIDADE)."""
+        return [i for i, r in enumerate(self.similaridades_para(termo)) if r >= limiar]
+
+    def similaridade(self, i: int, j: int) -> float:
+        """ratio(termos[i], termos[j]); IDs negativos representam a string vazia."""
+        if i < 0 or j < 0:
+            return 0.0
+        return self.similaridades_para(self.termos[j])[i]
+
+    def matriz(self) -> Any:
+        """Matriz densa M[i, j] = ratio(termos[i], termos[j]) (numpy se disponível)."""
+        if self._matriz is None or len(self._matriz) != len(self.termos):
+            linhas = [self.similaridades_de(t) for t in self.termos]
+            self._matriz = np.array(linhas, dtype=np.float64).reshape(len(linhas), len(linhas)) if np is not None else linhas
+        return self._matriz
+
+
+def _chave_id(valor: Any) -> Optional[str]:
+    """Chave de um id de músico: 7 e "7" são o mesmo músico."""
+    return None if valor is None else str(valor)
+
+
+def _anos_validos(valor: Any) -> Tuple[bool, Optional[int]]:
+    """(decidido, anos): decidido=False quando o valor não é utilizável e deve ser ignorado."""
+    if valor is None:
+        return False, None
+    try:
+        v = int(valor)
+    except (TypeError, ValueError):
+        return False, None
+    return True, (v if v >= 0 else None)
+
+
+class PerfilMusico:
+    """Representação pré-normalizada de um músico, calculada uma única vez por perfil."""
+
+    __slots__ = (
+        "dados",
+        "id",
+        "inst_keys",
+        "inst_ids",
+        "anos_por_inst",
+        "anos_globais",
+        "localizacao",
+        "loc_id",
+        "caracteristicas",
+        "carac_ids",
+        "carac_bits",
+    )
+
+    def __init__(self, musico: Dict[str, Any], vocab: "VocabularioMatcher") -> None:
+        self.dados = musico
+        self.id = musico.get("id")
+
+        keys: List[str] = []
+        anos_por_inst: Dict[str, Optional[int]] = {}
         for entrada in musico.get("instrumentos", []) or []:
-            if _instrument_key(entrada.get("nome", "")) == alvo:
-                anos = entrada.get("anos_experiencia")
-                if anos is None:
-                    continue
-                try:
-                    v = int(anos)
-                    return v if v >= 0 else None
-                except (TypeError, ValueError):
-                    continue
-        return None
+            key = _instrument_key(entrada.get("nome", ""))
+            keys.append(key)
+            if key in anos_por_inst:
+                continue
+            decidido, anos = _anos_validos(entrada.get("anos_experiencia"))
+            if decidido:
+                anos_por_inst[key] = anos
+        self.inst_keys: Tuple[str, ...] = tuple(keys)
+        self.inst_ids: Tuple[int, ...] = tuple(vocab.instrumentos.internar(k) for k in keys)
+        self.anos_por_inst = anos_por_inst
+
+        decidido, anos = _anos_validos(musico.get("anos_experiencia"))
+        self.anos_globais: Optional[int] = anos if decidido else None
+
+        self.localizacao = _normalize(musico.get("localizacao") or "")
+        self.loc_id = vocab.localizacoes.internar(self.localizacao)
+
+        caracs = musico.get("caracteristicas") or []
+        self.caracteristicas: Tuple[str, ...] = tuple(_normalize(c) for c in caracs if c is not None)
+        self.carac_ids: Tuple[int, ...] = tuple(vocab.caracteristicas.internar(c) for c in self.caracteristicas)
+        self.carac_bits = _bits(self.carac_ids)
+
+    @classmethod
+    def de_campos(cls, **campos: Any) -> "PerfilMusico":
+        """Monta um perfil já normalizado (p.ex. lido de um snapshot) sem voltar a normalizar."""
+        perfil = cls.__new__(cls)
+        perfil.id = campos["dados"].get("id")
+        for nome, valor in campos.items():
+            setattr(perfil, nome, valor)
+        if "carac_bits" not in campos:
+            perfil.carac_bits = _bits(perfil.carac_ids)
+        return perfil
+
+
+def _bits(ids: Iterable[int]) -> int:
+    """Bitset (um int) com os IDs de vocabulário dados; os IDs negativos (string vazia) ficam de fora."""
+    bits = 0
+    for i in ids:
+        if i >= 0:
+            bits |= 1 << i
+    return bits
+
+
+def _distancia_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Distância em km sobre a esfera (haversine)."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dlat = p2 - p1
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dlon / 2) ** 2
+    return 2 * 6371.0 * math.asin(min(1.0, math.sqrt(a)))
+
+
+class Gazetteer:
+    """Concelhos portugueses com distrito (a região) e coordenadas, lidos de concelhos.csv.
+
+    Os pontos ficam numa grelha de células de CELULA_GRAUS graus, por isso "a menos de N km"
+    só olha para as células que o círculo toca.
+    """
+
+    CELULA_GRAUS = 0.5
+    CAMINHO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "concelhos.csv")
 
-    def _anos_globais(self, musico: Dict[str, Any]) -> Optional[int]:
-        anos = musico.get("anos_experiencia")
+    def __init__(self, linhas: Iterable[Tuple[str, str, float, float]]) -> None:
+        self.nomes: List[str] = []
+        self.regioes: List[int] = []
+        self.coordenadas: List[Tuple[float, float]] = []
+        self.nomes_regioes: List[str] = []
+        ids_regioes: Dict[str, int] = {}
+        self.ids: Dict[str, int] = {}
+        self._ids_regioes: Dict[str, int] = {}
+        self._grelha: Dict[Tuple[int, int], List[int]] = {}
+        for nome, regiao, lat, lon in linhas:
+            chave = _normalize(nome)
+            # há nomes repetidos entre distritos (Lagoa, Calheta): o nome sozinho fica com o
+            # primeiro, "concelho, distrito" distingue-os
+            completa = f"{chave}, {_normalize(regiao)}"
+            if not chave or completa in self.ids:
+                continue
+            if regiao not in ids_regioes:
+                ids_regioes[regiao] = len(self.nomes_regioes)
+                self._ids_regioes[_normalize(regiao)] = len(self.nomes_regioes)
+                self.nomes_regioes.append(regiao)
+            i = len(self.nomes)
+            self.ids.setdefault(chave, i)
+            self.ids[completa] = i
+            self.nomes.append(chave)
+            self.regioes.append(ids_regioes[regiao])
+            self.coordenadas.append((lat, lon))
+            self._grelha.setdefault(self._celula(lat, lon), []).append(i)
+        self._motor = MOTORES_SIMILARIDADE[MOTOR_SIMILARIDADE]()
+        self._resolvidos: Dict[str, int] = {}
+
+    @classmethod
+    def ler(cls, caminho: Optional[str] = None) -> Optional["Gazetteer"]:
+        """O gazetteer do ficheiro CSV (concelho,distrito,latitude,longitude), ou None se não existir."""
         try:
-            v = int(anos)
-            return v if v >= 0 else None
-        except (TypeError, ValueError):
+            with open(caminho or cls.CAMINHO, encoding="utf-8", newline="") as f:
+                linhas = [
+                    (linha["concelho"], linha["distrito"], float(linha["latitude"]), float(linha["longitude"]))
+                    for linha in csv.DictReader(f)
+                ]
+        except OSError:
             return None
+        return cls(linhas)
 
-    def _caracteristicas_normalizadas(self, musico: Dict[str, Any]) -> List[str]:
-        caracs = musico.get("caracteristicas") or []
-        return [_normalize(c) for c in caracs if c is not None]
+    def _celula(self, lat: float, lon: float) -> Tuple[int, int]:
+        return (math.floor(lat / self.CELULA_GRAUS), math.floor(lon / self.CELULA_GRAUS))
+
+    def resolver(self, termo: str) -> int:
+        """Concelho de uma localização já normalizada ("amadora", "amadora, lisboa", "Amadorra"), ou -1."""
+        c = self._resolvidos.get(termo)
+        if c is None:
+            if len(self._resolvidos) >= Vocabulario.MAX_VETORES:
+                self._resolvidos.clear()
+            c = self._resolvidos[termo] = self._resolver(termo)
+        return c
+
+    def _resolver(self, termo: str) -> int:
+        partes = [p.strip() for p in termo.split(",")]
+        i = self.ids.get(", ".join(partes))
+        if i is not None:
+            return i
+        regiao = self._ids_regioes.get(partes[-1]) if len(partes) > 1 else None
+        if regiao is not None:
+            # "concelho, distrito" com gralha no concelho: só os concelhos desse distrito
+            sims = self._motor.vetor(partes[0], self.nomes, de=True)
+            nesta = [j for j in range(len(sims)) if self.regioes[j] == regiao]
+            melhor = max(nesta, key=sims.__getitem__, default=-1)
+            if melhor >= 0 and sims[melhor] >= 0.85:
+                return melhor
+        for parte in dict.fromkeys([termo] + partes):
+            if not parte:
+                continue
+            i = self.ids.get(parte)
+            if i is not None:
+                return i
+            sims = self._motor.vetor(parte, self.nomes, de=True)
+            melhor = max(range(len(sims)), key=sims.__getitem__, default=-1)
+            if melhor >= 0 and sims[melhor] >= 0.85:
+                return melhor
+        return -1
+
+    def perto(self, i: int, raio_km: float) -> List[Tuple[int, float]]:
+        """(concelho, distância em km) dos concelhos a menos de raio_km do concelho i, pela grelha."""
+        lat, lon = self.coordenadas[i]
+        dlat = raio_km / 111.2
+        dlon = raio_km / (111.2 * max(0.01, math.cos(math.radians(lat))))
+        lat0, lon0 = self._celula(lat - dlat, lon - dlon)
+        lat1, lon1 = self._celula(lat + dlat, lon + dlon)
+        out = []
+        for cl in range(lat0, lat1 + 1):
+            for cn in range(lon0, lon1 + 1):
+                for j in self._grelha.get((cl, cn), ()):
+                    d = _distancia_km(lat, lon, *self.coordenadas[j])
+                    if d <= raio_km:
+                        out.append((j, d))
+        return out
+
+
+_GAZETTEER: List[Optional[Gazetteer]] = []
+
+
+def _gazetteer() -> Optional[Gazetteer]:
+    # lido uma vez por processo, só quando alguma pesquisa precisa dele
+    if not _GAZETTEER:
+        _GAZETTEER.append(Gazetteer.ler())
+    return _GAZETTEER[0]
+
+
+class GeoLocalizacoes:
+    """Concelho e região de cada termo do vocabulário de localizações, resolvidos uma vez por termo.
+
+    Com `raio_km`, a proximidade a um alvo substitui o ratio de texto: 1.0 no mesmo concelho e
+    1 - 0.15 * distância / raio_km fora dele, por isso os limiares de sempre (0.85 exato, 0.75
+    relaxado) dão "dentro do raio" e "até 5/3 do raio". Os termos que o gazetteer não conhece
+    ficam com o ratio de texto.
+    """
+
+    def __init__(self, vocab: Vocabulario, gazetteer: Optional[Gazetteer] = None) -> None:
+        self.vocab = vocab
+        self._gazetteer = gazetteer
+        self._lock = threading.Lock()
+        self._termos: Optional[List[str]] = None
+        self.concelhos: List[int] = []
+        self._por_concelho: Dict[int, List[int]] = {}
+        self._proximidades: Dict[Tuple[str, float], Tuple[int, List[float]]] = {}
+
+    @property
+    def gazetteer(self) -> Optional[Gazetteer]:
+        return self._gazetteer if self._gazetteer is not None else _gazetteer()
+
+    def _resolver_termos(self) -> None:
+        termos = self.vocab.termos
+        with self._lock:
+            if termos is not self._termos:
+                self._termos = termos
+                self.concelhos = []
+                self._por_concelho = {}
+                self._proximidades = {}
+            for loc_id in range(len(self.concelhos), len(termos)):
+                c = self.gazetteer.resolver(termos[loc_id]) if self.gazetteer is not None else -1
+                self.concelhos.append(c)
+                if c >= 0:
+                    self._por_concelho.setdefault(c, []).append(loc_id)
+
+    def concelho(self, loc_id: int) -> int:
+        if loc_id < 0 or self.gazetteer is None:
+            return -1
+        if loc_id >= len(self.concelhos) or self.vocab.termos is not self._termos:
+            self._resolver_termos()
+        return self.concelhos[loc_id]
+
+    def regiao(self, loc_id: int) -> int:
+        """ID da região (distrito) da localização, ou -1 se não for conhecida."""
+        c = self.concelho(loc_id)
+        return self.gazetteer.regioes[c] if c >= 0 else -1
+
+    def regiao_de(self, localizacao: str) -> int:
+        if self.gazetteer is None or not localizacao:
+            return -1
+        c = self.gazetteer.resolver(_normalize(localizacao))
+        return self.gazetteer.regioes[c] if c >= 0 else -1
+
+    def proximidades(self, alvo: str, raio_km: float) -> Optional[List[float]]:
+        """Por ID de localização, a proximidade ao alvo (já normalizado); None se o alvo não for conhecido."""
+        if self.gazetteer is None:
+            return None
+        centro = self.gazetteer.resolver(alvo)
+        if centro < 0:
+            return None
+        self._resolver_termos()
+        n = len(self.vocab.termos)
+        guardado = self._proximidades.get((alvo, raio_km))
+        if guardado is not None and guardado[0] == n:
+            return guardado[1]
+
+        vetor = list(self.vocab.similaridades_para(alvo))
+        for loc_id, c in enumerate(self.concelhos[:n]):
+            if c >= 0:
+                vetor[loc_id] = 0.0
+        # só os concelhos com proximidade >= PISO_SIMILARIDADE interessam aos predicados e scores
+        for c, d in self.gazetteer.perto(centro, raio_km * (1 - PISO_SIMILARIDADE) / 0.15):
+            p = 1.0 if c == centro else max(0.0, 1 - 0.15 * d / raio_km)
+            for loc_id in self._por_concelho.get(c, ()):
+                if loc_id < n:
+                    vetor[loc_id] = p
+        if len(self._proximidades) >= Vocabulario.MAX_VETORES:
+            self._proximidades.clear()
+        self._proximidades[(alvo, raio_km)] = (n, vetor)
+        return vetor
+
+
+class VocabularioMatcher:
+    """Os três vocabulários fechados do corpus: instrumentos, localizações e características."""
+
+    def __init__(self) -> None:
+        self.instrumentos = Vocabulario()
+        self.localizacoes = Vocabulario()
+        self.caracteristicas = Vocabulario()
+        self.geo = GeoLocalizacoes(self.localizacoes)
+
+    def vetores_calculados(self) -> int:
+        return self.instrumentos.calculados + self.localizacoes.calculados + self.caracteristicas.calculados
+
+
+class IndiceInvertido:
+    """Listas de músicos (índices em Matcher.perfis, por ordem) por chave de instrumento e por localização."""
+
+    def __init__(self, perfis: List[Optional[PerfilMusico]]) -> None:
+        self.por_instrumento: Dict[int, List[int]] = {}
+        self.por_localizacao: Dict[int, List[int]] = {}
+        for i, perfil in enumerate(perfis):
+            if perfil is None:
+                continue
+            for inst_id in set(perfil.inst_ids):
+                if inst_id >= 0:
+                    self.por_instrumento.setdefault(inst_id, []).append(i)
+            if perfil.loc_id >= 0:
+                self.por_localizacao.setdefault(perfil.loc_id, []).append(i)
+
+    @classmethod
+    def de_listas(cls, por_instrumento: Dict[int, Any], por_localizacao: Dict[int, Any]) -> "IndiceInvertido":
+        """Índice sobre listas já ordenadas (p.ex. vistas de um snapshot), copiadas só quando alteradas."""
+        indice = cls.__new__(cls)
+        indice.por_instrumento = por_instrumento
+        indice.por_localizacao = por_localizacao
+        return indice
+
+    @staticmethod
+    def _lista(listas: Dict[int, Any], chave: int) -> List[int]:
+        lista = listas.get(chave)
+        if not isinstance(lista, list):
+            lista = listas[chave] = list(lista or ())
+        return lista
+
+    def adicionar(self, pos: int, perfil: PerfilMusico) -> None:
+        for inst_id in set(perfil.inst_ids):
+            if inst_id >= 0:
+                insort(self._lista(self.por_instrumento, inst_id), pos)
+        if perfil.loc_id >= 0:
+            insort(self._lista(self.por_localizacao, perfil.loc_id), pos)
+
+    def retirar(self, pos: int, perfil: PerfilMusico) -> None:
+        for inst_id in set(perfil.inst_ids):
+            if inst_id >= 0:
+                self._retirar(self.por_instrumento, inst_id, pos)
+        if perfil.loc_id >= 0:
+            self._retirar(self.por_localizacao, perfil.loc_id, pos)
+
+    @classmethod
+    def _retirar(cls, listas: Dict[int, Any], chave: int, pos: int) -> None:
+        lista = cls._lista(listas, chave)
+        del lista[bisect_left(lista, pos)]
+        if not lista:
+            del listas[chave]
+
+    @staticmethod
+    def _uniao(listas: List[List[int]]) -> List[int]:
+        if len(listas) == 1:
+            return listas[0]
+        return sorted(set().union(*listas))
+
+    def por_instrumento_similar(self, vocab: Vocabulario, alvo: str, limiar: float) -> List[int]:
+        return self._uniao([self.por_instrumento[k] for k in vocab.vizinhos(alvo, limiar) if k in self.por_instrumento])
+
+    def por_localizacoes(self, loc_ids: Iterable[int]) -> List[int]:
+        return self._uniao([self.por_localizacao[k] for k in loc_ids if k in self.por_localizacao])
+
+
+def _valor(vetor: List[float], idx: int) -> float:
+    return vetor[idx] if idx >= 0 else 0.0
+
+
+# cada estado do corpus tem uma versão única (entre matchers); serve de época à CacheResultados
+_VERSOES = itertools.count(1)
+
+
+class Matcher:
+    """Corpus de músicos indexado por posição em `perfis`.
+
+    atualizar()/remover() mantêm o índice por id: só os perfis alterados são normalizados e
+    reindexados. Um músico removido deixa a sua posição a None até à próxima compactação.
+    """
+
+    # compacta quando mais de metade das posições estão vazias
+    FRACAO_COMPACTAR = 0.5
+    MIN_COMPACTAR = 1024
+
+    def __init__(self, musicos: Iterable[Dict[str, Any]]) -> None:
+        self.vocab = VocabularioMatcher()
+        self.perfis: List[Optional[PerfilMusico]] = [PerfilMusico(m, self.vocab) for m in musicos]
+        self._lock_colunas = threading.Lock()
+        self._reindexar()
+
+    def _reindexar(self) -> None:
+        self.versao = next(_VERSOES)
+        self._posicoes: Optional[Dict[str, int]] = None
+        self.vazias = 0
+        self.indice = IndiceInvertido(self.perfis)
+        self._colunas: Optional["ColunasMusicos"] = None
+        self._alteradas: Set[int] = set()
+
+    @classmethod
+    def de_fluxo(
+        cls, musicos: Iterable[Dict[str, Any]], manter: Optional[Callable[["Matcher", PerfilMusico], bool]] = None
+    ) -> "Matcher":
+        """Constrói o matcher perfil a perfil; `manter` descarta logo os que não interessam.
+
+        Só os perfis mantidos ficam em memória, por isso `musicos` pode ser um gerador.
+        """
+        matcher = cls([])
+        for musico in musicos:
+            perfil = PerfilMusico(musico, matcher.vocab)
+            if manter is None or manter(matcher, perfil):
+                matcher.perfis.append(perfil)
+        matcher._reindexar()
+        return matcher
+
+    @classmethod
+    def de_snapshot(cls, caminho: str) -> "Matcher":
+        """Abre um snapshot escrito por guardar_snapshot() sem ler nem normalizar os perfis."""
+        snap = Snapshot(caminho)
+        matcher = cls.__new__(cls)
+        matcher.snapshot = snap
+        matcher.vocab = snap.vocabulario()
+        matcher.perfis = _PerfisSnapshot(snap, matcher.vocab)
+        matcher._lock_colunas = threading.Lock()
+        matcher._posicoes = None
+        matcher.vazias = 0
+        matcher.indice = snap.indice()
+        matcher._colunas = snap.colunas(matcher.perfis) if np is not None else None
+        matcher._alteradas = set()
+        matcher.versao = next(_VERSOES)
+        return matcher
+
+    @property
+    def posicoes(self) -> Dict[str, int]:
+        """id -> posição em perfis, construído no primeiro uso."""
+        if self._posicoes is None:
+            if isinstance(self.perfis, _PerfisSnapshot):
+                chaves: Iterable[Optional[str]] = self.perfis.chaves()
+            else:
+                chaves = (_chave_id(p.id) if p is not None else None for p in self.perfis)
+            self._posicoes = {chave: i for i, chave in enumerate(chaves) if chave is not None}
+        return self._posicoes
+
+    def __len__(self) -> int:
+        return len(self.perfis) - self.vazias
+
+    def ativos(self) -> Iterator[PerfilMusico]:
+        return (p for p in self.perfis if p is not None)
+
+    def atualizar(self, musicos: Iterable[Dict[str, Any]]) -> int:
+        """Insere ou substitui músicos pelo id; devolve quantos perfis mudaram."""
+        alterados = 0
+        for musico in musicos:
+            chave = _chave_id(musico.get("id"))
+            if chave is None:
+                raise ValueError("cada músico tem de ter id")
+            pos = self.posicoes.get(chave)
+            antigo = self.perfis[pos] if pos is not None else None
+            if antigo is not None and antigo.dados == musico:
+                continue
+
+            perfil = PerfilMusico(musico, self.vocab)
+            if pos is None:
+                pos = len(self.perfis)
+                self.perfis.append(perfil)
+                self.posicoes[chave] = pos
+            else:
+                self.indice.retirar(pos, antigo)
+                self.perfis[pos] = perfil
+            self.indice.adicionar(pos, perfil)
+            self._alteradas.add(pos)
+            alterados += 1
+        if alterados:
+            self.versao = next(_VERSOES)
+        return alterados
+
+    def remover(self, ids: Iterable[Any]) -> int:
+        removidos = 0
+        for valor in ids:
+            pos = self.posicoes.pop(_chave_id(valor), None)
+            if pos is None:
+                continue
+            self.indice.retirar(pos, self.perfis[pos])
+            self.perfis[pos] = None
+            self.vazias += 1
+            self._alteradas.add(pos)
+            removidos += 1
+        if removidos:
+            self.versao = next(_VERSOES)
+
+        if self.vazias >= self.MIN_COMPACTAR and self.vazias > self.FRACAO_COMPACTAR * len(self.perfis):
+            # as posições mudam, mas os perfis (e o vocabulário) são reaproveitados tal como estão
+            self.perfis = list(self.ativos())
+            self._reindexar()
+        return removidos
+
+    def colunas(self) -> "ColunasMusicos":
+        """Vista colunar (numpy) dos perfis, construída na primeira pesquisa vetorial.
+
+        As alterações feitas desde a última pesquisa são aplicadas aqui, só nas posições alteradas.
+        """
+        with self._lock_colunas:
+            if self._colunas is None:
+                self._colunas = ColunasMusicos(self.perfis)
+            elif self._alteradas:
+                self._colunas.aplicar(self._alteradas)
+            self._alteradas = set()
+            return self._colunas
+
+    def _posicoes_excluidas(self, prefs: Preferencias) -> List[int]:
+        chaves = (_chave_id(v) for v in prefs.excluir_ids or [])
+        return [self.posicoes[c] for c in chaves if c in self.posicoes]
+
+    def _perfil(self, musico: Any) -> PerfilMusico:
+        if isinstance(musico, PerfilMusico):
+            return musico
+        return PerfilMusico(musico, self.vocab)
+
+    def _anos_por_instrumento(self, musico: PerfilMusico, instrumento: str) -> Optional[int]:
+        return self._perfil(musico).anos_por_inst.get(_instrument_key(instrumento))
+
+    def _anos_globais(self, musico: PerfilMusico) -> Optional[int]:
+        return self._perfil(musico).anos_globais
+
+    def _caracteristicas_normalizadas(self, musico: PerfilMusico) -> List[str]:
+        return list(self._perfil(musico).caracteristicas)
 
     def _caracteristicas_match(
-        self, musico: Dict[str, Any], desejadas: List[str], relax: bool
+        self, musico: PerfilMusico, desejadas: List[str], relax: bool
     ) -> Tuple[int, int, float]:
         desejadas_norm = [_normalize(c) for c in desejadas if c]
         if not desejadas_norm:
             return (0, 0, 0.0)
 
-        existentes = self._caracteristicas_normalizadas(musico)
+        perfil = self._perfil(musico)
+        mascaras, partilhados = self.vocab.caracteristicas.expandir(tuple(desejadas_norm))
+        if not perfil.carac_bits & partilhados:
+            # nenhuma existente serve a duas desejadas: o guloso reduz-se a contar as desejadas com match
+            match_count = sum(1 for m in mascaras if perfil.carac_bits & m[relax])
+            total = len(desejadas_norm)
+            return (match_count, total, match_count / total)
+
+        existentes = perfil.carac_ids
+        limiar = 0.75 if relax else 0.85
         usados = set()
         match_count = 0
 
+        # guloso: cada característica desejada fica com a melhor existente ainda livre
         for wanted in desejadas_norm:
+            sims = self.vocab.caracteristicas.similaridades_de(wanted)
             best = 0.0
             best_idx = None
             for idx, exist in enumerate(existentes):
                 if idx in usados:
                     continue
-                r = _safe_ratio(wanted, exist)
+                r = _valor(sims, exist)
                 if r > best:
                     best = r
                     best_idx = idx
-            if best_idx is not None and (best >= (0.75 if relax else 0.85)):
+            if best_idx is not None and best >= limiar:
                 match_count += 1
                 usados.add(best_idx)
 
         total = len(desejadas_norm)
         return (match_count, total, (match_count / total if total else 0.0))
 
-    def _instrumento_match(self, musico: Dict[str, Any], instrumento: str, relax: bool) -> bool:
-        alvo = _instrument_key(instrumento)
-        for entrada in musico.get("instrumentos", []) or []:
-            inst_key = _instrument_key(entrada.get("nome", ""))
-            ratio = _safe_ratio(inst_key, alvo)
-            if ratio >= (0.95 if not relax else 0.78):
+    def _contagens_caracteristicas(self, musico: PerfilMusico, desejadas: List[str]) -> Tuple[int, int, int]:
+        """(matches exatos, matches relaxados, total): os dois gulosos de _caracteristicas_match num só percurso."""
+        desejadas_norm = [_normalize(c) for c in desejadas if c]
+        perfil = self._perfil(musico)
+        mascaras, partilhados = self.vocab.caracteristicas.expandir(tuple(desejadas_norm))
+        bits = perfil.carac_bits
+        if not bits & partilhados:
+            exatas = sum(1 for exata, _ in mascaras if bits & exata)
+            relaxadas = sum(1 for _, relaxada in mascaras if bits & relaxada)
+            return exatas, relaxadas, len(desejadas_norm)
+
+        existentes = perfil.carac_ids
+        usados_exato: Set[int] = set()
+        usados_relax: Set[int] = set()
+
+        def melhor(sims: List[float], usados: Set[int]) -> Tuple[float, Optional[int]]:
+            best = 0.0
+            best_idx = None
+            for idx, exist in enumerate(existentes):
+                if idx in usados:
+                    continue
+                r = _valor(sims, exist)
+                if r > best:
+                    best = r
+                    best_idx = idx
+            return best, best_idx
+
+        # enquanto os usados são iguais, os dois gulosos escolhem a mesma existente; só divergem
+        # quando uma fica usada no relaxado (>= 0.75) e não no exato (< 0.85)
+        iguais = True
+        for wanted in desejadas_norm:
+            sims = self.vocab.caracteristicas.similaridades_de(wanted)
+            if iguais:
+                best, best_idx = melhor(sims, usados_exato)
+                if best_idx is None or best < 0.75:
+                    continue
+                usados_relax.add(best_idx)
+                if best >= 0.85:
+                    usados_exato.add(best_idx)
+                else:
+                    iguais = False
+                continue
+            for usados, limiar in ((usados_exato, 0.85), (usados_relax, 0.75)):
+                best, best_idx = melhor(sims, usados)
+                if best_idx is not None and best >= limiar:
+                    usados.add(best_idx)
+
+        return len(usados_exato), len(usados_relax), len(desejadas_norm)
+
+    def _instrumento_match(self, musico: PerfilMusico, instrumento: str, relax: bool) -> bool:
+        sims = self.vocab.instrumentos.similaridades_para(_instrument_key(instrumento))
+        limiar = 0.95 if not relax else 0.78
+        for inst_id in self._perfil(musico).inst_ids:
+            if _valor(sims, inst_id) >= limiar:
                 return True
         return False
 
-    def _instrumento_score(self, musico: Dict[str, Any], instrumento: str) -> float:
-        alvo = _instrument_key(instrumento)
+    def _instrumento_score(self, musico: PerfilMusico, instrumento: str) -> float:
+        sims = self.vocab.instrumentos.similaridades_para(_instrument_key(instrumento))
         best = 0.0
-        for entrada in musico.get("instrumentos", []) or []:
-            inst_key = _instrument_key(entrada.get("nome", ""))
-            best = max(best, _safe_ratio(inst_key, alvo))
+        for inst_id in self._perfil(musico).inst_ids:
+            best = max(best, _valor(sims, inst_id))
         return best
 
     def _melhor_instrumento(
-        self, musico: Dict[str, Any], instrumento: Optional[str]
+        self, musico: PerfilMusico, instrumento: Optional[str]
     ) -> Tuple[Optional[str], Optional[int], float]:
+        perfil = self._perfil(musico)
+        entradas = perfil.dados.get("instrumentos") or []
         if not instrumento:
-            entrada = (musico.get("instrumentos") or [None])[0] or {}
+            entrada = (entradas or [None])[0] or {}
             return entrada.get("nome"), entrada.get("anos_experiencia"), 0.0
 
-        alvo_norm = _instrument_key(instrumento)
-        for entrada in musico.get("instrumentos", []) or []:
-            inst_key = _instrument_key(entrada.get("nome", ""))
-            ratio = _safe_ratio(inst_key, alvo_norm)
+        sims = self.vocab.instrumentos.similaridades_para(_instrument_key(instrumento))
+        for entrada, inst_id in zip(entradas, perfil.inst_ids):
+            ratio = _valor(sims, inst_id)
             if ratio >= 0.78:
                 return entrada.get("nome"), entrada.get("anos_experiencia"), ratio
 
         return (None, None, 0.0)
 
-    def _localizacao_match(self, musico: Dict[str, Any], localizacao: str, relax: bool) -> bool:
-        ratio = _safe_ratio(musico.get("localizacao", ""), localizacao)
-        return ratio >= (0.75 if relax else 0.85)
+    def _sims_localizacao(self, localizacao: str, raio_km: Optional[float] = None) -> List[float]:
+        """Por ID de localização: o ratio com `localizacao` ou, com raio_km, a proximidade geográfica."""
+        alvo = _normalize(localizacao)
+        if raio_km is not None:
+            proximidades = self.vocab.geo.proximidades(alvo, raio_km)
+            if proximidades is not None:
+                return proximidades
+        return self.vocab.localizacoes.similaridades_para(alvo)
 
-    def _satisfaz_constraints_1(self, musico: Dict[str, Any], prefs: Preferencias, relax: bool) -> bool:
-        if prefs.instrumento and not self._instrumento_match(musico, prefs.instrumento, relax):
-            return False
+    def _localizacao_ratio(self, musico: PerfilMusico, localizacao: str, raio_km: Optional[float] = None) -> float:
+        return _valor(self._sims_localizacao(localizacao, raio_km), self._perfil(musico).loc_id)
 
-        if prefs.localizacao and not self._localizacao_match(musico, prefs.localizacao, relax):
-            return False
+    def _localizacao_match(
+        self, musico: PerfilMusico, localizacao: str, relax: bool, raio_km: Optional[float] = None
+    ) -> bool:
+        ratio = self._localizacao_ratio(musico, localizacao, raio_km)
+        return ratio >= (0.75 if relax else 0.85)
 
-        if prefs.caracteristicas:
+    def _candidatos(self, prefs: Preferencias, relax: bool) -> List[PerfilMusico]:
+        """Perfis que podem cumprir as constraints de instrumento/localização, pelos índices invertidos.
+
+        É um superconjunto exato: os restantes predicados continuam a ser verificados pelo chamador.
+        """
+        listas: List[List[int]] = []
+        if prefs.instrumento:
+            listas.append(
+                self.indice.por_instrumento_similar(
+                    self.vocab.instrumentos, _instrument_key(prefs.instrumento), 0.78 if relax else 0.95
+                )
+            )
+        if prefs.localizacao:
+            limiar = 0.75 if relax else 0.85
+            sims = self._sims_localizacao(prefs.localizacao, prefs.raio_km)
+            listas.append(self.indice.por_localizacoes(i for i, r in enumerate(sims) if r >= limiar))
+
+        excluidas = self._posicoes_excluidas(prefs)
+        if not listas:
+            if not excluidas:
+                return list(self.ativos()) if self.vazias else self.perfis
+            fora = set(excluidas)
+            return [p for i, p in enumerate(self.perfis) if p is not None and i not in fora]
+        if len(listas) == 1:
+            posicoes: Iterable[int] = listas[0]
+        else:
+            menor, maior = sorted(listas, key=len)
+            dentro = set(maior)
+            posicoes = [i for i in menor if i in dentro]
+        if excluidas:
+            fora = set(excluidas)
+            posicoes = [i for i in posicoes if i not in fora]
+        return [self.perfis[i] for i in posicoes]
+
+    def _classificar_1(self, musico: PerfilMusico, prefs: Preferencias) -> Tuple[bool, bool]:
+        """(cumpre as constraints exatas, cumpre as relaxadas), calculando cada ratio uma só vez.
+
+        Equivale a _satisfaz_constraints_1 com relax=False e relax=True.
+        """
+        exato = relax = True
+        if prefs.instrumento:
+            r = self._instrumento_score(musico, prefs.instrumento)
+            exato, relax = r >= 0.95, r >= 0.78
+            if not relax:
+                return False, False
+
+        if prefs.localizacao:
+            r = self._localizacao_ratio(musico, prefs.localizacao, prefs.raio_km)
+            exato, relax = exato and r >= 0.85, relax and r >= 0.75
+            if not relax:
+                return False, False
+
+        if prefs.caracteristicas:
+            exatas, relaxadas, total = self._contagens_caracteristicas(musico, prefs.caracteristicas)
+            exato = exato and exatas >= max(1, math.ceil(total * 0.8))
+            relax = relax and relaxadas >= max(1, math.ceil(total * 0.6))
+            if not (exato or relax):
+                return False, False
+
+        if prefs.anos_experiencia is not None:
+            anos = (
+                self._anos_por_instrumento(musico, prefs.instrumento)
+                if prefs.instrumento
+                else self._anos_globais(musico)
+            )
+            if anos is None:
+                return False, False
+            diff = abs(anos - prefs.anos_experiencia)
+            exato, relax = exato and diff == 0, relax and diff <= 4
+
+        return exato, relax
+
+    def _satisfaz_constraints_1(self, musico: PerfilMusico, prefs: Preferencias, relax: bool) -> bool:
+        if prefs.instrumento and not self._instrumento_match(musico, prefs.instrumento, relax):
+            return False
+
+        if prefs.localizacao and not self._localizacao_match(musico, prefs.localizacao, relax, prefs.raio_km):
+            return False
+
+        if prefs.caracteristicas:
             match_count, total, _ = self._caracteristicas_match(musico, prefs.caracteristicas, relax)
             minimo_exato = max(1, math.ceil(total * 0.8))
             minimo_relax = max(1, math.ceil(total * 0.6))
@@ -236,7 +1540,7 @@ class Matcher:
 
         return True
 
-    def _pontuacao_1(self, musico: Dict[str, Any], prefs: Preferencias) -> Dict[str, float]:
+    def _pontuacao_1(self, musico: PerfilMusico, prefs: Preferencias) -> Dict[str, float]:
         score = 0.0
         detalhes: Dict[str, float] = {}
 
@@ -260,7 +1564,7 @@ class Matcher:
                 score += 0.5 * detalhes["anos_experiencia"]
 
         if prefs.localizacao:
-            r = _safe_ratio(musico.get("localizacao", ""), prefs.localizacao)
+            r = self._localizacao_ratio(musico, prefs.localizacao, prefs.raio_km)
             detalhes["localizacao"] = round(r, 3)
             score += 2.5 * r
 
@@ -277,138 +1581,1466 @@ class Matcher:
         detalhes["score_total"] = round(score, 3)
         return detalhes
 
+def _vetor(valores: List[float]) -> Any:
+    """Vetor numpy com um 0.0 extra no fim, para que o ID -1 (string vazia) dê similaridade 0."""
+    return np.append(np.asarray(valores, dtype=np.float64), 0.0)
+
+
+class ColunasMusicos:
+    """Perfis em colunas numpy; instrumentos e características ficam em pares (dono, id) por entrada.
+
+    Posições vazias têm ativo=False. aplicar() reescreve as colunas das posições alteradas e
+    marca as entradas antigas com o id -1, que tem similaridade 0 em todos os vetores de _vetor().
+    """
+
+    def __init__(self, perfis: List[Optional[PerfilMusico]]) -> None:
+        self.perfis = perfis
+        self.n = n = len(perfis)
+        self.ativo = np.fromiter((p is not None for p in perfis), dtype=bool, count=n)
+        self.loc_id = np.fromiter((p.loc_id if p is not None else -1 for p in perfis), dtype=np.int64, count=n)
+        self.anos_globais_ok = np.fromiter(
+            (p is not None and p.anos_globais is not None for p in perfis), dtype=bool, count=n
+        )
+        self.anos_globais = np.fromiter(((p.anos_globais or 0) if p is not None else 0 for p in perfis), dtype=np.int64, count=n)
+        self.inst_dono, self.inst_ids = self._entradas([p.inst_ids if p is not None else () for p in perfis])
+        self.inst_anos_ok, self.inst_anos = self._anos_entradas(perfis)
+        self.carac_dono, self.carac_ids = self._entradas([p.carac_ids if p is not None else () for p in perfis])
+        self._anos_por_inst: Dict[int, Tuple[Any, Any]] = {}
+
+    @staticmethod
+    def _entradas(listas: List[Tuple[int, ...]], donos: Any = None) -> Tuple[Any, Any]:
+        if donos is None:
+            donos = np.arange(len(listas), dtype=np.int64)
+        donos = np.repeat(donos, [len(ids) for ids in listas])
+        ids = np.fromiter((i for ids in listas for i in ids), dtype=np.int64, count=len(donos))
+        return donos, ids
+
+    @staticmethod
+    def anos_por_entrada(perfil: Optional[PerfilMusico]) -> List[Optional[int]]:
+        """Anos de cada entrada de instrumento: só a 1.ª entrada de cada chave leva o valor de anos_por_inst."""
+        if perfil is None:
+            return []
+        vistas: Set[str] = set()
+        anos: List[Optional[int]] = []
+        for key in perfil.inst_keys:
+            anos.append(None if key in vistas else perfil.anos_por_inst.get(key))
+            vistas.add(key)
+        return anos
+
+    def _anos_entradas(self, perfis: List[Optional[PerfilMusico]]) -> Tuple[Any, Any]:
+        anos = [a for p in perfis for a in self.anos_por_entrada(p)]
+        ok = np.fromiter((a is not None for a in anos), dtype=bool, count=len(anos))
+        valores = np.fromiter((a or 0 for a in anos), dtype=np.int64, count=len(anos))
+        return ok, valores
+
+    def anos_instrumento(self, inst_id: int) -> Tuple[Any, Any]:
+        """(tem_anos, anos) por músico para o id de instrumento, como em _anos_por_instrumento."""
+        cached = self._anos_por_inst.get(inst_id)
+        if cached is None:
+            entradas = self.inst_anos_ok & (self.inst_ids == inst_id)
+            donos = self.inst_dono[entradas]
+            ok = np.zeros(self.n, dtype=bool)
+            ok[donos] = True
+            valores = np.zeros(self.n, dtype=np.int64)
+            valores[donos] = self.inst_anos[entradas]
+            cached = self._anos_por_inst[inst_id] = (ok, valores)
+        return cached
+
+    def aplicar(self, posicoes: Iterable[int]) -> None:
+        """Atualiza as colunas nas posições dadas a partir de self.perfis (que pode ter crescido)."""
+        posicoes = sorted(posicoes)
+        extra = len(self.perfis) - self.n
+        if extra > 0:
+            self.ativo = np.concatenate([self.ativo, np.zeros(extra, dtype=bool)])
+            self.loc_id = np.concatenate([self.loc_id, np.full(extra, -1, dtype=np.int64)])
+            self.anos_globais_ok = np.concatenate([self.anos_globais_ok, np.zeros(extra, dtype=bool)])
+            self.anos_globais = np.concatenate([self.anos_globais, np.zeros(extra, dtype=np.int64)])
+            self.n = len(self.perfis)
+        self._anos_por_inst = {}
+
+        idx = np.asarray(posicoes, dtype=np.int64)
+        mortas = np.isin(self.inst_dono, idx)
+        self.inst_ids[mortas] = -1
+        self.inst_anos_ok[mortas] = False
+        self.carac_ids[np.isin(self.carac_dono, idx)] = -1
+
+        perfis = [self.perfis[i] for i in posicoes]
+        for i, p in zip(posicoes, perfis):
+            self.ativo[i] = p is not None
+            self.loc_id[i] = p.loc_id if p is not None else -1
+            self.anos_globais_ok[i] = p is not None and p.anos_globais is not None
+            self.anos_globais[i] = (p.anos_globais or 0) if p is not None else 0
+
+        anos_ok, anos = self._anos_entradas(perfis)
+        self.inst_anos_ok = np.concatenate([self.inst_anos_ok, anos_ok])
+        self.inst_anos = np.concatenate([self.inst_anos, anos])
+        for nome in ("inst", "carac"):
+            donos, ids = self._entradas([getattr(p, nome + "_ids") if p is not None else () for p in perfis], idx)
+            setattr(self, nome + "_dono", np.concatenate([getattr(self, nome + "_dono"), donos]))
+            setattr(self, nome + "_ids", np.concatenate([getattr(self, nome + "_ids"), ids]))
+
+    def max_por_musico(self, donos: Any, valores: Any) -> Any:
+        out = np.zeros(self.n, dtype=np.float64)
+        np.maximum.at(out, donos, valores)
+        return out
+
+
+# --- snapshot binário do corpus ---------------------------------------------------------
+#
+# Formato (ordem de bytes nativa, registada no cabeçalho):
+#   8 bytes  SNAPSHOT_MAGIC
+#   8 bytes  tamanho do cabeçalho JSON (little-endian)
+#   cabeçalho JSON: {"versao", "ordem", "n", "secoes": {nome: [formato, offset, contagem]}}
+#   secções alinhadas a 8 bytes, com os offsets contados a partir do fim do cabeçalho.
+#
+# Tabelas de strings são um blob UTF-8 (<nome>_texto) mais offsets (<nome>_off, n+1 entradas).
+# Offsets são int64; ids, posições e anos são int32.
+# Instrumentos e características de cada músico vão em pares (dono, id) como em ColunasMusicos,
+# com offsets por músico; os índices invertidos vão em CSR (offsets por id + posições).
+
+SNAPSHOT_MAGIC = b"SCSNAP01"
+SNAPSHOT_VERSAO = 1
+
+# secções que o leitor usa, pela ordem em que guardar_snapshot() as escreve
+_SECOES_SNAPSHOT = tuple(
+    [f"vocab_{nome}_{parte}" for nome in ("instrumentos", "localizacoes", "caracteristicas") for parte in ("texto", "off")]
+    + [f"{nome}_{parte}" for nome in ("ids", "dados") for parte in ("texto", "off")]
+    + ["loc_id", "anos_globais_ok", "anos_globais", "inst_off", "inst_dono", "inst_ids", "inst_anos_ok", "inst_anos"]
+    + ["carac_off", "carac_dono", "carac_ids", "idx_inst_off", "idx_inst_pos", "idx_loc_off", "idx_loc_pos"]
+)
+
+
+def _alinhar(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def guardar_snapshot(matcher: "Matcher", caminho: str) -> int:
+    """Escreve os perfis ativos do matcher num snapshot; devolve o número de músicos."""
+    perfis = list(matcher.ativos())
+    vocab = matcher.vocab
+    secoes: List[Tuple[str, str, bytes, int]] = []
+
+    # posições no matcher (que pode ter vazias) -> posições no snapshot
+    novas: Dict[int, int] = {}
+    for i, p in enumerate(matcher.perfis):
+        if p is not None:
+            novas[i] = len(novas)
+
+    def coluna(nome: str, formato: str, valores: Iterable[int]) -> None:
+        dados = array(formato, valores)
+        secoes.append((nome, formato, dados.tobytes(), len(dados)))
+
+    def offsets(nome: str, tamanhos: Iterable[int]) -> None:
+        off = array("q", [0])
+        for tamanho in tamanhos:
+            off.append(off[-1] + tamanho)
+        secoes.append((nome, "q", off.tobytes(), len(off)))
+
+    def textos(nome: str, valores: List[str]) -> None:
+        blobs = [v.encode("utf-8") for v in valores]
+        secoes.append((nome + "_texto", "B", b"".join(blobs), sum(len(b) for b in blobs)))
+        offsets(nome + "_off", (len(b) for b in blobs))
+
+    def csr(nome: str, listas: Dict[int, Any], n_ids: int) -> None:
+        ordenadas = [list(listas.get(i, ())) for i in range(n_ids)]
+        offsets(nome + "_off", (len(l) for l in ordenadas))
+        coluna(nome + "_pos", "i", (novas[p] for l in ordenadas for p in l))
+
+    for nome in ("instrumentos", "localizacoes", "caracteristicas"):
+        textos("vocab_" + nome, getattr(vocab, nome).termos)
+
+    textos("ids", [_chave_id(p.id) or "" for p in perfis])
+    textos("dados", [json.dumps(p.dados, ensure_ascii=False) for p in perfis])
+
+    coluna("loc_id", "i", (p.loc_id for p in perfis))
+    coluna("anos_globais_ok", "B", (p.anos_globais is not None for p in perfis))
+    coluna("anos_globais", "i", (p.anos_globais or 0 for p in perfis))
+
+    offsets("inst_off", (len(p.inst_ids) for p in perfis))
+    coluna("inst_dono", "i", (i for i, p in enumerate(perfis) for _ in p.inst_ids))
+    coluna("inst_ids", "i", (k for p in perfis for k in p.inst_ids))
+    anos = [a for p in perfis for a in ColunasMusicos.anos_por_entrada(p)]
+    coluna("inst_anos_ok", "B", (a is not None for a in anos))
+    coluna("inst_anos", "i", (a or 0 for a in anos))
+
+    offsets("carac_off", (len(p.carac_ids) for p in perfis))
+    coluna("carac_dono", "i", (i for i, p in enumerate(perfis) for _ in p.carac_ids))
+    coluna("carac_ids", "i", (k for p in perfis for k in p.carac_ids))
+
+    csr("idx_inst", matcher.indice.por_instrumento, len(vocab.instrumentos))
+    csr("idx_loc", matcher.indice.por_localizacao, len(vocab.localizacoes))
+
+    indice: Dict[str, List[Any]] = {}
+    offset = 0
+    for nome, formato, dados, contagem in secoes:
+        indice[nome] = [formato, offset, contagem]
+        offset = _alinhar(offset + len(dados))
+    cabecalho = json.dumps(
+        {"versao": SNAPSHOT_VERSAO, "ordem": sys.byteorder, "n": len(perfis), "secoes": indice}
+    ).encode("utf-8")
+
+    tmp = caminho + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(struct.pack("<Q", len(cabecalho)))
+        f.write(cabecalho)
+        f.write(b"\0" * (_alinhar(f.tell()) - f.tell()))
+        for _nome, _formato, dados, _contagem in secoes:
+            f.write(dados)
+            f.write(b"\0" * (_alinhar(len(dados)) - len(dados)))
+    os.replace(tmp, caminho)
+    return len(perfis)
+
+
+class Snapshot:
+    """Snapshot aberto com mmap; as secções são vistas (memoryview/numpy) sobre as páginas do ficheiro.
+
+    O mapeamento é copy-on-write: vários processos partilham as páginas e as alterações feitas
+    depois (atualizar/remover) ficam privadas de cada processo.
+    """
+
+    def __init__(self, caminho: str) -> None:
+        with open(caminho, "rb") as f:
+            # um ficheiro vazio não se pode mapear
+            if not os.fstat(f.fileno()).st_size:
+                raise ValueError(f"{caminho} não é um snapshot do matcher")
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        inicio = len(SNAPSHOT_MAGIC) + 8
+        if len(self._mm) < inicio or self._mm[: len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError(f"{caminho} não é um snapshot do matcher")
+        (tamanho,) = struct.unpack_from("<Q", self._mm, len(SNAPSHOT_MAGIC))
+        try:
+            if inicio + tamanho > len(self._mm):
+                raise ValueError("truncado")
+            self.cabecalho = json.loads(self._mm[inicio : inicio + tamanho])
+            if not isinstance(self.cabecalho, dict):
+                raise ValueError("não é um objeto")
+        except ValueError as exc:
+            raise ValueError(f"{caminho}: cabeçalho do snapshot ilegível ({exc})") from None
+        if self.cabecalho.get("versao") != SNAPSHOT_VERSAO or self.cabecalho.get("ordem") != sys.byteorder:
+            raise ValueError(f"{caminho}: versão ou ordem de bytes incompatível")
+        self._base = _alinhar(inicio + tamanho)
+        self._validar(caminho)
+        self.n: int = self.cabecalho["n"]
+        self._vista = memoryview(self._mm)
+
+    def _validar(self, caminho: str) -> None:
+        """Confirma que o cabeçalho descreve secções que existem e cabem no ficheiro.
+
+        Um ficheiro cortado a meio (p.ex. disco cheio ao copiar) falha aqui, e não com vistas
+        mais curtas do que o esperado na primeira pesquisa.
+        """
+        n, secoes = self.cabecalho.get("n"), self.cabecalho.get("secoes")
+        if not isinstance(n, int) or n < 0 or not isinstance(secoes, dict):
+            raise ValueError(f"{caminho}: cabeçalho do snapshot incompleto")
+        for nome in _SECOES_SNAPSHOT:
+            limites = secoes.get(nome)
+            try:
+                formato, offset, contagem = limites
+                fim = self._base + offset + contagem * array(formato).itemsize
+            except (TypeError, ValueError):
+                raise ValueError(f"{caminho}: secção {nome!r} em falta ou inválida") from None
+            if offset < 0 or contagem < 0 or fim > len(self._mm):
+                raise ValueError(f"{caminho}: snapshot truncado (secção {nome!r})")
+
+    def _limites(self, nome: str) -> Tuple[str, int, int]:
+        formato, offset, contagem = self.cabecalho["secoes"][nome]
+        return formato, self._base + offset, contagem
+
+    def secao(self, nome: str) -> memoryview:
+        formato, inicio, contagem = self._limites(nome)
+        vista = self._vista[inicio : inicio + contagem * array(formato).itemsize]
+        return vista if formato == "B" else vista.cast(formato)
+
+    def coluna(self, nome: str, dtype: Any) -> Any:
+        """Vista numpy (sem cópia) de uma secção."""
+        _formato, inicio, contagem = self._limites(nome)
+        return np.frombuffer(self._mm, dtype=dtype, count=contagem, offset=inicio)
+
+    def textos(self, nome: str) -> List[str]:
+        blob = self.secao(nome + "_texto")
+        off = self.secao(nome + "_off")
+        return [bytes(blob[off[i] : off[i + 1]]).decode("utf-8") for i in range(len(off) - 1)]
+
+    def texto(self, nome: str, i: int) -> str:
+        off = self.secao(nome + "_off")
+        return bytes(self.secao(nome + "_texto")[off[i] : off[i + 1]]).decode("utf-8")
+
+    def vocabulario(self) -> VocabularioMatcher:
+        vocab = VocabularioMatcher()
+        for nome in ("instrumentos", "localizacoes", "caracteristicas"):
+            getattr(vocab, nome).carregar(self.textos("vocab_" + nome))
+        return vocab
+
+    def _csr(self, nome: str) -> Dict[int, memoryview]:
+        off = self.secao(nome + "_off")
+        pos = self.secao(nome + "_pos")
+        return {i: pos[off[i] : off[i + 1]] for i in range(len(off) - 1) if off[i + 1] > off[i]}
+
+    def indice(self) -> "IndiceInvertido":
+        return IndiceInvertido.de_listas(self._csr("idx_inst"), self._csr("idx_loc"))
+
+    def colunas(self, perfis: "_PerfisSnapshot") -> "ColunasMusicos":
+        col = ColunasMusicos.__new__(ColunasMusicos)
+        col.perfis = perfis
+        col.n = self.n
+        col.ativo = np.ones(self.n, dtype=bool)
+        col.loc_id = self.coluna("loc_id", np.int32)
+        col.anos_globais_ok = self.coluna("anos_globais_ok", bool)
+        col.anos_globais = self.coluna("anos_globais", np.int32)
+        col.inst_dono = self.coluna("inst_dono", np.int32)
+        col.inst_ids = self.coluna("inst_ids", np.int32)
+        col.inst_anos_ok = self.coluna("inst_anos_ok", bool)
+        col.inst_anos = self.coluna("inst_anos", np.int32)
+        col.carac_dono = self.coluna("carac_dono", np.int32)
+        col.carac_ids = self.coluna("carac_ids", np.int32)
+        col._anos_por_inst = {}
+        return col
+
+
+_POR_LER = object()
+
+
+class _PerfisSnapshot:
+    """Lista de PerfilMusico de um snapshot; cada perfil é montado na primeira vez que é lido."""
+
+    def __init__(self, snap: Snapshot, vocab: VocabularioMatcher) -> None:
+        self.snap = snap
+        self.vocab = vocab
+        self._itens: List[Any] = [_POR_LER] * snap.n
+        self._lock = threading.Lock()
+        self._loc_id = snap.secao("loc_id")
+        self._anos_ok = snap.secao("anos_globais_ok")
+        self._anos = snap.secao("anos_globais")
+        self._inst_off = snap.secao("inst_off")
+        self._inst_ids = snap.secao("inst_ids")
+        self._inst_anos_ok = snap.secao("inst_anos_ok")
+        self._inst_anos = snap.secao("inst_anos")
+        self._carac_off = snap.secao("carac_off")
+        self._carac_ids = snap.secao("carac_ids")
+
+    def __len__(self) -> int:
+        return len(self._itens)
+
+    def __getitem__(self, i: int) -> Optional[PerfilMusico]:
+        perfil = self._itens[i]
+        if perfil is _POR_LER:
+            with self._lock:
+                perfil = self._itens[i]
+                if perfil is _POR_LER:
+                    perfil = self._itens[i] = self._ler(i)
+        return perfil
+
+    def __setitem__(self, i: int, perfil: Optional[PerfilMusico]) -> None:
+        self._itens[i] = perfil
+
+    def __iter__(self) -> Iterator[Optional[PerfilMusico]]:
+        return (self[i] for i in range(len(self._itens)))
+
+    def append(self, perfil: PerfilMusico) -> None:
+        self._itens.append(perfil)
+
+    def chaves(self) -> Iterator[Optional[str]]:
+        """Chave do id em cada posição, sem montar os perfis que ainda não foram lidos."""
+        for i, perfil in enumerate(self._itens):
+            if perfil is _POR_LER:
+                yield self.snap.texto("ids", i) or None
+            else:
+                yield _chave_id(perfil.id) if perfil is not None else None
+
+    def _ler(self, i: int) -> PerfilMusico:
+        termos_inst = self.vocab.instrumentos.termos
+        a, b = self._inst_off[i], self._inst_off[i + 1]
+        inst_ids = tuple(self._inst_ids[a:b])
+        inst_keys = tuple(termos_inst[k] if k >= 0 else "" for k in inst_ids)
+        anos_por_inst = {
+            inst_keys[j - a]: self._inst_anos[j] for j in range(a, b) if self._inst_anos_ok[j]
+        }
+
+        loc_id = self._loc_id[i]
+        c, d = self._carac_off[i], self._carac_off[i + 1]
+        carac_ids = tuple(self._carac_ids[c:d])
+        termos_carac = self.vocab.caracteristicas.termos
+
+        return PerfilMusico.de_campos(
+            dados=json.loads(self.snap.texto("dados", i)),
+            inst_keys=inst_keys,
+            inst_ids=inst_ids,
+            anos_por_inst=anos_por_inst,
+            anos_globais=self._anos[i] if self._anos_ok[i] else None,
+            localizacao=self.vocab.localizacoes.termos[loc_id] if loc_id >= 0 else "",
+            loc_id=loc_id,
+            caracteristicas=tuple(termos_carac[k] if k >= 0 else "" for k in carac_ids),
+            carac_ids=carac_ids,
+        )
+
+
+class MotorVetorial:
+    """Pesquisa de 1 músico sobre ColunasMusicos.
+
+    Aplica as constraints exatas/relaxadas como máscaras booleanas e calcula os pesos de
+    _pontuacao_1 num único passo vetorial; só os k melhores são materializados pelo caminho escalar.
+    """
+
+    def __init__(self, matcher: "Matcher") -> None:
+        self.m = matcher
+        self.col = matcher.colunas()
+
+    def _contagens_caracteristicas(self, desejadas_norm: List[str], limiar: float) -> Any:
+        col = self.col
+        vocab = self.m.vocab.caracteristicas
+        contagens = np.zeros(col.n, dtype=np.int64)
+        hits_por_entrada = np.zeros(len(col.carac_ids), dtype=np.int64)
+        for wanted in desejadas_norm:
+            hit = _vetor(vocab.similaridades_de(wanted))[col.carac_ids] >= limiar
+            hits_por_entrada += hit
+            tem = np.zeros(col.n, dtype=bool)
+            tem[col.carac_dono[hit]] = True
+            contagens += tem
+
+        # Sem entradas partilhadas entre desejadas, o guloso conta exatamente as desejadas com algum hit.
+        # Quando uma existente serve duas desejadas, repetimos o guloso escalar para esse músico.
+        for i in np.unique(col.carac_dono[hits_por_entrada >= 2]).tolist():
+            contagens[i] = self.m._caracteristicas_match(col.perfis[i], desejadas_norm, relax=limiar < 0.85)[0]
+        return contagens
+
+    def avaliar(self, prefs: Preferencias, orcamento: Optional[Orcamento] = None) -> Tuple[Any, Any, Any]:
+        """Devolve (mascara_exata, mascara_relaxada, score) com o score igual ao de _pontuacao_1 antes do round.
+
+        Com só o instrumento preenchido as outras constraints não se aplicam, tal como no caminho escalar.
+        Com `orcamento`, um pedido cancelado salta os critérios que faltam e as máscaras saem vazias.
+        """
+
+        def parar() -> bool:
+            return orcamento is not None and orcamento.interrompido()
+
+        col = self.col
+        n = col.n
+        exata = col.ativo.copy()
+        excluidas = self.m._posicoes_excluidas(prefs)
+        if excluidas:
+            exata[excluidas] = False
+        relaxada = exata.copy()
+        score = np.zeros(n, dtype=np.float64)
+        criterios = np.zeros(n, dtype=np.int64)
+
+        if prefs.instrumento and not parar():
+            alvo = _instrument_key(prefs.instrumento)
+            sims = _vetor(self.m.vocab.instrumentos.similaridades_para(alvo))
+            inst = col.max_por_musico(col.inst_dono, sims[col.inst_ids])
+            exata &= inst >= 0.95
+            relaxada &= inst >= 0.78
+            score += 4.0 * inst
+            criterios += np.round(inst, 3) > 0
+
+        if prefs.anos_experiencia is not None and not parar():
+            if prefs.instrumento:
+                key = _instrument_key(prefs.instrumento)
+                # -1 são as entradas sem nome; uma chave fora do vocabulário não tem anos em nenhum músico
+                inst_id = self.m.vocab.instrumentos.ids.get(key, -2) if key else -1
+                ok, anos = col.anos_instrumento(inst_id)
+            else:
+                ok, anos = col.anos_globais_ok, col.anos_globais
+            diff = np.abs(anos - prefs.anos_experiencia)
+            exata &= ok & (diff == 0)
+            relaxada &= ok & (diff <= 4)
+            d = np.where(diff == 0, 1.0, np.maximum(0.0, 1 - (diff / 4.0)))
+            score = np.where(ok, score + 2.5 * d, score + 0.5 * 0.2)
+            criterios += np.where(ok, d > 0, True)
+
+        if prefs.localizacao and not parar():
+            sims = _vetor(self.m._sims_localizacao(prefs.localizacao, prefs.raio_km))
+            r = sims[col.loc_id]
+            exata &= r >= 0.85
+            relaxada &= r >= 0.75
+            score += 2.5 * r
+            criterios += np.round(r, 3) > 0
+
+        if prefs.caracteristicas and not parar():
+            desejadas_norm = [_normalize(c) for c in prefs.caracteristicas if c]
+            total = len(desejadas_norm)
+            contagem_relax = self._contagens_caracteristicas(desejadas_norm, 0.75)
+            contagem_exata = self._contagens_caracteristicas(desejadas_norm, 0.85)
+            exata &= contagem_exata >= max(1, math.ceil(total * 0.8))
+            relaxada &= contagem_relax >= max(1, math.ceil(total * 0.6))
+            ratio = contagem_relax / total if total else np.zeros(n, dtype=np.float64)
+            score += 3.5 * ratio
+            criterios += np.round(ratio, 3) > 0
+
+        score = np.where(criterios >= 3, score + 0.5, score)
+        if orcamento is not None and not orcamento.completo:
+            exata[:] = False
+            relaxada[:] = False
+        return exata, relaxada, score
+
+    @staticmethod
+    def top_k(mascara: Any, score: Any, k: int) -> List[int]:
+        """Índices dos k melhores por (round(score, 3) desc, ordem de entrada), como o sort estável do CSP1Solver."""
+        idx = np.flatnonzero(mascara)
+        if k <= 0 or not len(idx):
+            return []
+        s = score[idx]
+        if len(idx) > k:
+            kth = s[np.argpartition(-s, k - 1)[k - 1]]
+            # margem para empates depois do round a 3 casas
+            idx = idx[s >= kth - 1e-3]
+        chaves = [(-round(float(score[i]), 3), i) for i in idx.tolist()]
+        chaves.sort()
+        return [i for _, i in chaves[:k]]
+
+
 class CSP1Solver:
     def __init__(self, matcher: Matcher) -> None:
         self.m = matcher
 
     def _build_constraints(
-        self, prefs: Preferencias, relax: bool, only_instrument: bool
+        self, prefs: Preferencias, only_instrument: bool, regimes: Dict[PerfilMusico, List[bool]]
     ) -> List[Constraint]:
+        """Constraints que avaliam os dois regimes de uma vez, com um só cálculo de cada ratio.
+
+        `regimes[musico]` fica com [cumpre as exatas, cumpre as relaxadas]; uma constraint só
+        rejeita o músico quando já nenhum dos regimes é possível.
+        """
         constraints: List[Constraint] = []
 
+        def marcar(mus: PerfilMusico, exato: bool, relax: bool) -> bool:
+            estado = regimes.get(mus)
+            if estado is None:
+                estado = regimes[mus] = [True, True]
+            estado[0] = estado[0] and exato
+            estado[1] = estado[1] and relax
+            return estado[0] or estado[1]
+
         def c_instrumento(assign: Dict[str, Any]) -> bool:
-            mus = assign.get("musico", {})
+            mus = assign["musico"]
             if not prefs.instrumento:
                 return True
-            return self.m._instrumento_match(mus, prefs.instrumento, relax=relax)
+            r = self.m._instrumento_score(mus, prefs.instrumento)
+            return marcar(mus, r >= 0.95, r >= 0.78)
 
         def c_localizacao(assign: Dict[str, Any]) -> bool:
-            mus = assign.get("musico", {})
+            mus = assign["musico"]
             if not prefs.localizacao:
                 return True
-            return self.m._localizacao_match(mus, prefs.localizacao, relax=relax)
+            r = self.m._localizacao_ratio(mus, prefs.localizacao, prefs.raio_km)
+            return marcar(mus, r >= 0.85, r >= 0.75)
 
         def c_caracs(assign: Dict[str, Any]) -> bool:
-            mus = assign.get("musico", {})
+            mus = assign["musico"]
             if not prefs.caracteristicas:
                 return True
-            match_count, total, _ = self.m._caracteristicas_match(mus, prefs.caracteristicas, relax=relax)
+            exatas, relaxadas, total = self.m._contagens_caracteristicas(mus, prefs.caracteristicas)
             minimo_exato = max(1, math.ceil(total * 0.8))
             minimo_relax = max(1, math.ceil(total * 0.6))
-            return match_count >= (minimo_relax if relax else minimo_exato)
+            return marcar(mus, exatas >= minimo_exato, relaxadas >= minimo_relax)
+
+        def c_anos(assign: Dict[str, Any]) -> bool:
+            mus = assign["musico"]
+            if prefs.anos_experiencia is None:
+                return True
+            anos = (
+                self.m._anos_por_instrumento(mus, prefs.instrumento)
+                if prefs.instrumento
+                else self.m._anos_globais(mus)
+            )
+            if anos is None:
+                return marcar(mus, False, False)
+            diff = abs(anos - prefs.anos_experiencia)
+            return marcar(mus, diff == 0, diff <= 4)
+
+        constraints.append(Constraint("instrumento", ("musico",), c_instrumento))
+        if not only_instrument:
+            constraints.append(Constraint("localizacao", ("musico",), c_localizacao))
+            constraints.append(Constraint("caracteristicas", ("musico",), c_caracs))
+            constraints.append(Constraint("anos", ("musico",), c_anos))
+
+        return constraints
+
+    # abaixo disto o custo de montar as colunas não compensa
+    MIN_VETORIAL = 256
+
+    def _run_csp(
+        self, prefs: Preferencias, only_instrument: bool, orcamento: Optional[Orcamento] = None
+    ) -> Tuple[List[PerfilMusico], List[PerfilMusico]]:
+        """Uma só pesquisa sobre os candidatos relaxados; devolve (exatos, relaxados) pela ordem do domínio.
+
+        Os candidatos exatos dos índices são um subconjunto dos relaxados, por isso os exatos
+        saem pela mesma ordem que teriam numa pesquisa só com as constraints exatas.
+        Com `orcamento`, pára quando o pedido é cancelado (e devolve só o que já viu).
+        """
+        csp = SimpleCSP()
+        dominio = self.m._candidatos(prefs, relax=True)
+        csp.add_variable(Variable("musico", dominio))
+        regimes: Dict[PerfilMusico, List[bool]] = {}
+        for c in self._build_constraints(prefs, only_instrument, regimes):
+            csp.add_constraint(c)
+
+        def ate_cancelar(_nome: str, valores: List[Any], _assign: Dict[str, Any]) -> Iterable[Any]:
+            for i, valor in enumerate(valores):
+                if orcamento.interrompido(i):
+                    return
+                yield valor
+
+        exatos: List[PerfilMusico] = []
+        relaxados: List[PerfilMusico] = []
+        ordem = ate_cancelar if orcamento is not None else None
+        for a in csp.solve(max_solutions=len(dominio), ordenar_valores=ordem):
+            mus = a["musico"]
+            exato, relax = regimes.get(mus, (True, True))
+            if exato:
+                exatos.append(mus)
+            if relax:
+                relaxados.append(mus)
+        return exatos, relaxados
+
+    def _scores(
+        self, musicos: List[PerfilMusico], prefs: Preferencias, orcamento: Optional[Orcamento] = None
+    ) -> Optional[List[float]]:
+        """O score de cada músico; None se o pedido for cancelado a meio."""
+        scores: List[float] = []
+        for i, m in enumerate(musicos):
+            if orcamento is not None and orcamento.interrompido(i):
+                return None
+            scores.append(self.m._pontuacao_1(m, prefs)["score_total"])
+        return scores
+
+    def _melhores(
+        self,
+        musicos: List[PerfilMusico],
+        prefs: Preferencias,
+        max_resultados: int,
+        orcamento: Optional[Orcamento] = None,
+    ) -> List[PerfilMusico]:
+        scores = self._scores(musicos, prefs, orcamento)
+        if scores is None:
+            return []
+        ranked = sorted(range(len(musicos)), key=scores.__getitem__, reverse=True)
+        return [musicos[i] for i in ranked[:max_resultados]]
+
+    def _solve_escalar(
+        self,
+        prefs: Preferencias,
+        only_instrument: bool,
+        max_resultados: int,
+        estatisticas: Optional[Estatisticas] = None,
+        orcamento: Optional[Orcamento] = None,
+    ) -> List[Tuple[PerfilMusico, bool]]:
+        with _fase(estatisticas, "csp"):
+            musicos_exatos, musicos_relax = self._run_csp(prefs, only_instrument, orcamento)
+        if estatisticas is not None:
+            estatisticas.dominio("exato", "musico", len(musicos_exatos))
+            estatisticas.dominio("relaxado", "musico", len(musicos_relax))
+        if orcamento is not None and orcamento.interrompido():
+            return []
+        if musicos_exatos:
+            with _fase(estatisticas, "exato.ordenar"):
+                return [(m, True) for m in self._melhores(musicos_exatos, prefs, max_resultados, orcamento)]
+
+        if estatisticas is not None:
+            estatisticas.relaxamento = True
+        with _fase(estatisticas, "relaxado.ordenar"):
+            return [(m, False) for m in self._melhores(musicos_relax, prefs, max_resultados, orcamento)]
+
+    def _solve_vetorial(
+        self,
+        prefs: Preferencias,
+        max_resultados: int,
+        estatisticas: Optional[Estatisticas] = None,
+        orcamento: Optional[Orcamento] = None,
+    ) -> List[Tuple[PerfilMusico, bool]]:
+        # as duas máscaras saem do mesmo passo, por isso aqui o relaxamento não custa outra pesquisa
+        with _fase(estatisticas, "avaliar"):
+            exata, relaxada, score = MotorVetorial(self.m).avaliar(prefs, orcamento)
+        if orcamento is not None and orcamento.interrompido():
+            return []
+        exato = bool(exata.any())
+        with _fase(estatisticas, "top_k"):
+            escolhidos = MotorVetorial.top_k(exata if exato else relaxada, score, max_resultados)
+        if estatisticas is not None:
+            estatisticas.relaxamento = not exato
+            estatisticas.dominio("exato", "musico", int(exata.sum()))
+            estatisticas.dominio("relaxado", "musico", int(relaxada.sum()))
+        return [(self.m.perfis[i], exato) for i in escolhidos]
+
+    def _resultado(self, mus: PerfilMusico, prefs: Preferencias, exato: bool) -> Dict[str, Any]:
+        det = self.m._pontuacao_1(mus, prefs)
+        score = det["score_total"]
+
+        anos_diff = None
+        if prefs.anos_experiencia is not None:
+            anos_cand = (
+                self.m._anos_por_instrumento(mus, prefs.instrumento)
+                if prefs.instrumento
+                else self.m._anos_globais(mus)
+            )
+            if anos_cand is not None:
+                anos_diff = abs(anos_cand - prefs.anos_experiencia)
+
+        local_ratio = None
+        if prefs.localizacao:
+            local_ratio = self.m._localizacao_ratio(mus, prefs.localizacao, prefs.raio_km)
+
+        inst_match = True
+        inst_nome = None
+        inst_anos = None
+        inst_score = None
+        if prefs.instrumento:
+            inst_score_raw = self.m._instrumento_score(mus, prefs.instrumento)
+            inst_match = inst_score_raw >= 0.78
+            inst_nome, inst_anos, inst_score = self.m._melhor_instrumento(mus, prefs.instrumento)
+
+        return {
+            "tipo": "musico",
+            "id": mus.id,
+            "nome": mus.dados.get("nome"),
+            "localizacao": mus.dados.get("localizacao"),
+            "score": score,
+            "exato": exato,
+            "anos_diff": anos_diff,
+            "localizacao_ratio": local_ratio,
+            "instrumento_match": inst_match,
+            "instrumento_score": inst_score,
+            "instrumento_escolhido": inst_nome,
+            "instrumento_anos": inst_anos,
+            "detalhes": det,
+            "instrumentos": mus.dados.get("instrumentos", []),
+            "caracteristicas": mus.dados.get("caracteristicas", []),
+        }
+
+    @staticmethod
+    def _so_instrumento(prefs: Preferencias) -> bool:
+        return (
+            bool(_normalize(prefs.instrumento or ""))
+            and prefs.anos_experiencia is None
+            and not prefs.localizacao
+            and not (prefs.caracteristicas or [])
+        )
+
+    def ranking(self, prefs: Preferencias, orcamento: Optional[Orcamento] = None) -> "RankingMusicos":
+        """Todos os que cumprem as constraints (exatas; senão relaxadas), para ler por páginas.
+
+        Com `orcamento` cancelado a meio, o ranking fica vazio (e o orçamento incompleto).
+        """
+        if np is not None and len(self.m) >= self.MIN_VETORIAL:
+            exata, relaxada, score = MotorVetorial(self.m).avaliar(prefs, orcamento)
+            exato = bool(exata.any())
+            # só os candidatos e os seus scores; os índices crescentes mantêm o desempate de top_k
+            idx = np.flatnonzero(exata if exato else relaxada)
+            score = score[idx]
+            todos = np.ones(len(idx), dtype=bool)
+
+            def ordenar(k: int) -> List[PerfilMusico]:
+                return [self.m.perfis[int(idx[j])] for j in MotorVetorial.top_k(todos, score, k)]
+
+            return RankingMusicos(self, prefs, exato, len(idx), ordenar)
+
+        exatos, relaxados = self._run_csp(prefs, self._so_instrumento(prefs), orcamento)
+        musicos = exatos or relaxados
+        # cada score é calculado uma vez; as páginas seguintes só tiram do heap os que faltam
+        # (empates pela ordem de entrada, como no sort estável de _melhores)
+        scores = self._scores(musicos, prefs, orcamento)
+        if scores is None or (orcamento is not None and not orcamento.completo):
+            musicos, scores = [], []
+        heap = [(-s, i) for i, s in enumerate(scores)]
+        heapq.heapify(heap)
+        ordenados: List[PerfilMusico] = []
+
+        def ordenar(k: int) -> List[PerfilMusico]:
+            while heap and len(ordenados) < k:
+                ordenados.append(musicos[heapq.heappop(heap)[1]])
+            return ordenados
+
+        return RankingMusicos(self, prefs, bool(exatos), len(musicos), ordenar)
+
+    def solve(
+        self,
+        prefs: Preferencias,
+        max_resultados: int,
+        estatisticas: Optional[Estatisticas] = None,
+        orcamento: Optional[Orcamento] = None,
+    ) -> List[Dict[str, Any]]:
+        """Os k melhores; com `orcamento`, um pedido cancelado pára entre os passos e a meio dos scores."""
+        only_instrument = self._so_instrumento(prefs)
+
+        # Os k melhores por score entre todos os que cumprem as constraints (exatas; senão relaxadas).
+        if np is not None and len(self.m) >= self.MIN_VETORIAL:
+            resultados = self._solve_vetorial(prefs, max_resultados, estatisticas, orcamento)
+        else:
+            resultados = self._solve_escalar(prefs, only_instrument, max_resultados, estatisticas, orcamento)
+
+        with _fase(estatisticas, "resultados"):
+            out = [self._resultado(mus, prefs, exato) for mus, exato in resultados]
+            out.sort(key=lambda item: (item["exato"], item["score"]), reverse=True)
+        return out
+
+
+class RankingMusicos:
+    """Resultados de uma pesquisa de 1 músico, lidos por páginas (ver CSP1Solver.ranking).
+
+    Guarda só os candidatos: a ordenação avança à medida que são pedidas páginas (cada vez pelo
+    menos para o dobro) e os dicts de resultado só são montados para a página pedida. `ordenar(k)`
+    devolve os k primeiros; não volta a calcular scores. A página que começa em 0 é igual ao que
+    CSP1Solver.solve devolve.
+    """
+
+    def __init__(
+        self,
+        solver: CSP1Solver,
+        prefs: Preferencias,
+        exato: bool,
+        total: int,
+        ordenar: Callable[[int], List[PerfilMusico]],
+    ) -> None:
+        self.solver = solver
+        self.prefs = prefs
+        self.exato = exato
+        self.total = total
+        self._ordenar = ordenar
+        self._ordenados: List[PerfilMusico] = []
+        self._lock = threading.Lock()
+
+    def pagina(self, inicio: int, n: int) -> List[Dict[str, Any]]:
+        fim = min(inicio + max(0, n), self.total)
+        with self._lock:
+            if fim > len(self._ordenados):
+                self._ordenados = self._ordenar(max(fim, 2 * len(self._ordenados)))
+            perfis = self._ordenados[inicio:fim]
+        out = [self.solver._resultado(mus, self.prefs, self.exato) for mus in perfis]
+        out.sort(key=lambda item: (item["exato"], item["score"]), reverse=True)
+        return out
+
+
+class TopK:
+    """Os k melhores itens por score, num min-heap limitado.
+
+    Em caso de empate fica o que chegou primeiro, como no sort estável que isto substitui.
+    """
+
+    def __init__(self, k: int) -> None:
+        self.k = k
+        self._heap: List[Tuple[float, int, Any]] = []
+        self._seq = 0
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def cheio(self) -> bool:
+        return len(self._heap) >= self.k
+
+    def limiar(self) -> float:
+        """Score do k-ésimo melhor (-inf enquanto houver lugar), em O(1)."""
+        return self._heap[0][0] if self.cheio() else -math.inf
+
+    def aceita(self, score: float) -> bool:
+        return self.k > 0 and (not self.cheio() or score > self._heap[0][0])
+
+    def inserir(self, score: float, item: Any, ordem: Optional[int] = None) -> None:
+        """Só deve ser chamado depois de aceita(score), para o chamador copiar o item apenas quando entra.
+
+        `ordem` (crescente) desempata; por omissão é a ordem de chegada.
+        """
+        self._seq += 1
+        entrada = (score, -(self._seq if ordem is None else ordem), item)
+        if self.cheio():
+            heapq.heapreplace(self._heap, entrada)
+        else:
+            heapq.heappush(self._heap, entrada)
+
+    def entradas(self) -> List[Tuple[float, int, Any]]:
+        """(score, ordem, item) do melhor para o pior."""
+        return [(score, -neg_ordem, item) for score, neg_ordem, item in sorted(self._heap, key=lambda e: (-e[0], -e[1]))]
+
+    def ordenados(self) -> List[Tuple[int, Any]]:
+        return [(score, item) for score, _ordem, item in self.entradas()]
+
+
+class _LimiarPartilhado:
+    """Melhor k-ésimo score conhecido entre processos; só sobe."""
+
+    def __init__(self, ctx: Any) -> None:
+        self._valor = ctx.Value("d", -math.inf, lock=False)
+        self._lock = ctx.Lock()
+
+    def valor(self) -> float:
+        return self._valor.value
+
+    def publicar(self, valor: float) -> None:
+        if valor <= self._valor.value:
+            return
+        with self._lock:
+            if valor > self._valor.value:
+                self._valor.value = valor
+
+
+class _ContadorPartilhado:
+    def __init__(self, ctx: Any, inicial: int = 0) -> None:
+        self._valor = ctx.Value("q", inicial)
+
+    def somar(self, n: int) -> int:
+        with self._valor.get_lock():
+            self._valor.value += n
+            return self._valor.value
+
+
+class _PesquisaBanda:
+    """Branch-and-bound de uma pesquisa de banda: domínios, scores por papel em cache e top-K."""
+
+    def __init__(
+        self,
+        solver: "BandCSPSolver",
+        base_prefs: Preferencias,
+        roles: List[str],
+        relax: bool,
+        max_solutions: int,
+        domains: Dict[str, List[PerfilMusico]],
+        pontuacoes: Optional[Dict[str, Dict[PerfilMusico, Tuple[float, Dict[str, float]]]]] = None,
+        estatisticas: Optional[Estatisticas] = None,
+    ) -> None:
+        self.solver = solver
+        self.m = solver.m
+        self.base_prefs = base_prefs
+        self.relax = relax
+        self.max_solutions = max_solutions
+        # nós expandidos, podas e cálculos do limite superior da última execução
+        self.nos = self.podas = self.limites = 0
+        self.domains = domains
+        self.viavel = all(self.domains.get(r) for r in roles)
+        if not self.viavel:
+            return
+
+        with _fase(estatisticas, f"{'relaxado' if relax else 'exato'}.scores"):
+            self._pontuar(roles, pontuacoes if pontuacoes is not None else {})
+
+    def _pontuar(self, roles: List[str], pontuacoes: Dict[str, Dict[PerfilMusico, Tuple[float, Dict[str, float]]]]) -> None:
+        solver = self.solver
+        base_prefs = self.base_prefs
+
+        self.roles_order = sorted(roles, key=lambda r: len(self.domains[r]))
+
+        # Preferências e scores de cada candidato por papel. O score não depende do regime, por isso
+        # `pontuacoes` é partilhado entre a pesquisa exata e a relaxada do mesmo pedido.
+        # As listas ficam já ordenadas por score (estável), que é a ordem em que o backtrack as percorre.
+        # Os scores de banda somam-se em milésimos inteiros (o score de cada papel já vem arredondado a 3 casas):
+        # a soma não depende da ordem e bandas com o mesmo score empatam mesmo, o que permite ao
+        # _AtribuicaoBanda dar exatamente as mesmas bandas que o backtrack.
+        role_prefs = {r: solver._prefs_para_role(base_prefs, r) for r in roles}
+        self.scored: Dict[str, List[Tuple[int, PerfilMusico, Dict[str, float]]]] = {}
+        self.score_cache: Dict[str, Dict[PerfilMusico, Tuple[int, Dict[str, float]]]] = {}
+        for r in roles:
+            lista = []
+            ja_pontuados = pontuacoes.setdefault(r, {})
+            for m in self.domains[r]:
+                pontuado = ja_pontuados.get(m)
+                if pontuado is None:
+                    pontuado = ja_pontuados[m] = solver._score_role(m, role_prefs[r])
+                s, det = pontuado
+                lista.append((int(round(s * 1000)), m, det))
+            lista.sort(key=lambda x: x[0], reverse=True)
+            self.scored[r] = lista
+            self.score_cache[r] = {m: (s, det) for s, m, det in lista}
+
+        self.bonus_localizacao = (
+            750 if base_prefs.localizacao and base_prefs.politica_localizacao_banda == "todos_igual" else 0
+        )
+
+    def current_upper_bound(self, current_score: int, remaining_roles: List[str], used_ids: set) -> float:
+        # Para cada papel, o melhor candidato ainda livre. used_ids tem no máximo len(roles) ids,
+        # por isso cada procura pára ao fim de poucas posições da lista ordenada.
+        ub = current_score
+        for rr in remaining_roles:
+            for s, m, _det in self.scored[rr]:
+                if m.id not in used_ids:
+                    ub += s
+                    break
+            else:
+                return -math.inf
+        return ub + self.bonus_localizacao
+
+    def band_score(self, assignment: Dict[str, PerfilMusico]) -> int:
+        """Score da banda em milésimos."""
+        total = 0
+        for role, mus in assignment.items():
+            total += self.score_cache[role][mus][0]
+
+        if self.bonus_localizacao:
+            base = self.base_prefs
+            ok_all = all(
+                self.m._localizacao_match(m, base.localizacao, relax=True, raio_km=base.raio_km)
+                for m in assignment.values()
+            )
+            if ok_all:
+                total += self.bonus_localizacao
+
+        return total
+
+    def executar(
+        self,
+        posicoes: Optional[Iterable[int]] = None,
+        limiar_global: Optional[_LimiarPartilhado] = None,
+        orcamento: Optional[Orcamento] = None,
+    ) -> TopK:
+        """Corre o backtrack; `posicoes` restringe o primeiro papel a essas posições da sua lista ordenada.
+
+        Cada banda leva como ordem (posição no primeiro papel, chegada), que é a ordem da pesquisa em série,
+        por isso os top-K de várias fatias podem ser juntados sem mudar os empates.
+        Com `orcamento`, pára quando o limite é atingido e devolve as melhores bandas encontradas até aí;
+        os nós e podas são somados ao orcamento em qualquer caso.
+        """
+        base_prefs = self.base_prefs
+        relax = self.relax
+        roles_order = self.roles_order
+        scored = self.scored
+        score_cache = self.score_cache
+        band_location_constraint = self.solver._band_location_constraint
+
+        best = TopK(self.max_solutions)
+        used_ids: set = set()
+        primeiras = sorted(set(posicoes)) if posicoes is not None else range(len(scored[roles_order[0]]))
+        estado = {"pos0": 0, "seq": 0, "nos": 0, "podas": 0, "limites": 0, "parar": False}
+        nos_iniciais = orcamento.nos if orcamento is not None else 0
+
+        def push_solution(score: int, assignment: Dict[str, PerfilMusico]) -> None:
+            # a cópia (e os detalhes por papel) só se fazem quando a banda entra no top-K
+            if not best.aceita(score):
+                return
+            estado["seq"] += 1
+            details = {role: score_cache[role][mus][1] for role, mus in assignment.items()}
+            best.inserir(score, (dict(assignment), details), ordem=(estado["pos0"] << 64) | estado["seq"])
+            if limiar_global is not None and best.cheio():
+                limiar_global.publicar(best.limiar())
+
+        def can_still_beat(current_score: int, remaining_roles: List[str]) -> bool:
+            global_ = limiar_global.valor() if limiar_global is not None else -math.inf
+            if not best.cheio() and global_ == -math.inf:
+                return True
+            estado["limites"] += 1
+            bound = self.current_upper_bound(current_score, remaining_roles, used_ids)
+            if best.cheio() and bound <= best.limiar():
+                return False
+            # Outro processo já tem k bandas com score >= global_; só empates podem ainda entrar
+            # (ganham as encontradas primeiro na ordem em série), por isso a comparação é estrita.
+            return bound >= global_
+
+        def backtrack(i: int, assignment: Dict[str, PerfilMusico], current_score_acc: int) -> None:
+            estado["nos"] += 1
+            if orcamento is not None and orcamento.esgotado(nos_iniciais + estado["nos"]):
+                estado["parar"] = True
+                return
+
+            if i >= len(roles_order):
+                if not band_location_constraint(assignment, base_prefs, relax=relax):
+                    return
+                push_solution(self.band_score(assignment), assignment)
+                return
+
+            remaining = roles_order[i:]
+            if not can_still_beat(current_score_acc, remaining):
+                estado["podas"] += 1
+                return
+
+            role = roles_order[i]
+            lista = scored[role]
+            for pos in primeiras if i == 0 else range(len(lista)):
+                s_ind, m, _det = lista[pos]
+                mid = m.id
+                if mid in used_ids:
+                    continue
+                if i == 0:
+                    estado["pos0"] = pos
+
+                assignment[role] = m
+                used_ids.add(mid)
+
+                if band_location_constraint(assignment, base_prefs, relax=relax):
+                    backtrack(i + 1, assignment, current_score_acc + s_ind)
+
+                used_ids.remove(mid)
+                assignment.pop(role, None)
+                if estado["parar"]:
+                    return
+
+        backtrack(0, {}, 0)
+        self.nos, self.podas, self.limites = estado["nos"], estado["podas"], estado["limites"]
+        if orcamento is not None:
+            orcamento.nos += estado["nos"]
+            orcamento.podas += estado["podas"]
+            if estado["parar"]:
+                orcamento.completo = False
+        return best
+
+    def executar_paralelo(self, workers: int, orcamento: Optional[Orcamento] = None) -> List[Tuple[int, Any]]:
+        """Divide o primeiro papel por `workers` processos que partilham o limiar do k-ésimo melhor.
+
+        O resultado é igual ao de executar(): cada fatia devolve o seu top-K com a ordem em série
+        e a junção ordena por (score desc, ordem). Com orçamento, o prazo e o contador de nós
+        são comuns a todas as fatias.
+        Os processos são criados por fork, com o estado da pesquisa herdado: só é seguro num processo
+        sem outras threads, por isso só o modo CLI (um pedido por processo) a usa; o servidor recusa
+        pedidos com "workers" > 1.
+        """
+        global _PESQUISA_ATIVA, _LIMIAR_ATIVO, _ORCAMENTO_ATIVO
+
+        ctx = multiprocessing.get_context("fork")
+        n_primeiro = len(self.scored[self.roles_order[0]])
+        # fatias intercaladas: todos os processos começam pelos candidatos com melhor score
+        n_fatias = min(n_primeiro, workers * 4)
+        fatias = [list(range(i, n_primeiro, n_fatias)) for i in range(n_fatias)]
+
+        orcamento_fatia = None
+        if orcamento is not None:
+            orcamento_fatia = Orcamento(max_nos=orcamento.max_nos)
+            orcamento_fatia.limite = orcamento.limite
+            orcamento_fatia.partilhado = _ContadorPartilhado(ctx, orcamento.nos)
+
+        _PESQUISA_ATIVA, _LIMIAR_ATIVO, _ORCAMENTO_ATIVO = self, _LimiarPartilhado(ctx), orcamento_fatia
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+                partes = list(pool.map(_pesquisar_fatia, fatias))
+        finally:
+            _PESQUISA_ATIVA, _LIMIAR_ATIVO, _ORCAMENTO_ATIVO = None, None, None
+
+        juntas = []
+        self.nos = self.podas = self.limites = 0
+        for entradas, nos, podas, limites, completo in partes:
+            juntas.extend(entradas)
+            self.nos += nos
+            self.podas += podas
+            self.limites += limites
+            if orcamento is not None:
+                orcamento.nos += nos
+                orcamento.podas += podas
+                orcamento.completo = orcamento.completo and completo
+        juntas.sort(key=lambda e: (-e[0], e[1]))
+
+        out: List[Tuple[int, Any]] = []
+        for score, _ordem, posicoes in juntas[: self.max_solutions]:
+            assignment = {role: self.scored[role][pos][1] for role, pos in posicoes.items()}
+            details = {role: self.score_cache[role][mus][1] for role, mus in assignment.items()}
+            out.append((score, (assignment, details)))
+        return out
+
+
+# Estado herdado pelos processos da pesquisa paralela (via fork).
+_PESQUISA_ATIVA: Optional[_PesquisaBanda] = None
+_LIMIAR_ATIVO: Optional[_LimiarPartilhado] = None
+_ORCAMENTO_ATIVO: Optional[Orcamento] = None
+
+
+def _pesquisar_fatia(posicoes: List[int]) -> Tuple[List[Tuple[int, int, Dict[str, int]]], int, int, int, bool]:
+    pesquisa = _PESQUISA_ATIVA
+    orcamento = Orcamento()
+    if _ORCAMENTO_ATIVO is not None:
+        orcamento.max_nos = _ORCAMENTO_ATIVO.max_nos
+        orcamento.limite = _ORCAMENTO_ATIVO.limite
+        orcamento.partilhado = _ORCAMENTO_ATIVO.partilhado
+    top = pesquisa.executar(posicoes, _LIMIAR_ATIVO, orcamento)
+    indices = {role: {m: pos for pos, (_s, m, _d) in enumerate(lista)} for role, lista in pesquisa.scored.items()}
+    # devolvemos posições em vez de perfis para não serializar os dados dos músicos
+    entradas = [
+        (score, ordem, {role: indices[role][mus] for role, mus in assignment.items()})
+        for score, ordem, (assignment, _details) in top.entradas()
+    ]
+    return entradas, pesquisa.nos, pesquisa.podas, pesquisa.limites, orcamento.completo
+
+
+def _hungaro(custo: List[List[Optional[int]]]) -> Optional[List[int]]:
+    """Atribuição de custo mínimo de n linhas a m >= n colunas (algoritmo húngaro, O(n²·m)).
+
+    Células a None são proibidas. Devolve a coluna de cada linha, ou None se não houver atribuição
+    só com células permitidas. Os custos são inteiros, por isso o mínimo é exato.
+    """
+    n = len(custo)
+    if n == 0:
+        return []
+    m = len(custo[0])
+    if m < n:
+        return None
+    maior = max(abs(c) for linha in custo for c in linha if c is not None)
+    # qualquer atribuição com uma célula proibida custa mais do que todas as que não têm nenhuma
+    proibido = (2 * n + 1) * (maior + 1)
+    a = [[proibido if c is None else c for c in linha] for linha in custo]
+
+    u = [0] * (n + 1)
+    v = [0] * (m + 1)
+    dono = [0] * (m + 1)  # linha (1..n) atribuída a cada coluna; a coluna 0 é auxiliar
+    caminho = [0] * (m + 1)
+    for i in range(1, n + 1):
+        dono[0] = i
+        j0 = 0
+        minv = [math.inf] * (m + 1)
+        usada = [False] * (m + 1)
+        while True:
+            usada[j0] = True
+            i0 = dono[j0]
+            linha = a[i0 - 1]
+            ui0 = u[i0]
+            delta = math.inf
+            j1 = 0
+            for j in range(1, m + 1):
+                if not usada[j]:
+                    cur = linha[j - 1] - ui0 - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur
+                        caminho[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in range(m + 1):
+                if usada[j]:
+                    u[dono[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if dono[j0] == 0:
+                break
+        while j0:
+            j1 = caminho[j0]
+            dono[j0] = dono[j1]
+            j0 = j1
+
+    atribuicao = [0] * n
+    for j in range(1, m + 1):
+        if dono[j]:
+            atribuicao[dono[j] - 1] = j - 1
+    if any(custo[i][atribuicao[i]] is None for i in range(n)):
+        return None
+    return atribuicao
+
+
+class _AtribuicaoBanda:
+    """Top-K bandas como problema de atribuição papéis × músicos (húngaro + Murty), para domínios grandes.
+
+    Os papéis só interagem por "músicos diferentes" e pela política de localização. Com "todos_igual"
+    e sem alvo, os candidatos são partidos pela localização do primeiro papel (com "mesma_regiao",
+    pelo distrito): dentro de cada parte a localização já não restringe nada e sobra uma atribuição
+    pura; com alvo basta filtrar os candidatos.
+
+    O custo de cada célula codifica (score, posição na lista do papel), por isso a melhor atribuição
+    de cada subproblema é a banda que o backtrack de _PesquisaBanda poria primeiro, empates incluídos,
+    e o resultado é o mesmo de executar().
+    """
+
+    def __init__(self, pesquisa: _PesquisaBanda) -> None:
+        self.pesquisa = pesquisa
+        self.roles = pesquisa.roles_order
+        self.ids = [[m.id for _s, m, _d in pesquisa.scored[r]] for r in self.roles]
+        self.scores = [[s for s, _m, _d in pesquisa.scored[r]] for r in self.roles]
+        # problemas de atribuição resolvidos na última execução
+        self.nos = 0
+
+    @staticmethod
+    def aplicavel(pesquisa: _PesquisaBanda) -> bool:
+        # papéis repetidos ou ids repetidos num domínio não cabem numa atribuição 1-1
+        roles = pesquisa.roles_order
+        if len(roles) < 2 or len(set(roles)) != len(roles):
+            return False
+        return all(len({m.id for m in pesquisa.domains[r]}) == len(pesquisa.domains[r]) for r in roles)
+
+    def _partes(self) -> List[Tuple[int, Tuple[int, ...], Callable[[], Optional[List[List[int]]]]]]:
+        """(limite do score, limite das posições, construir) de cada parte.
+
+        construir() devolve, para cada papel, as posições da sua lista ordenada que pode usar
+        (None se algum papel ficar sem candidatos). Cada lista fica com as primeiras (papéis - 1) + K:
+        um membro abaixo disso tem pelo menos K substitutos livres, com score maior ou igual e
+        posição anterior, por isso nenhuma banda que o use fica no top-K.
+        Os limites nunca ficam abaixo de nenhuma banda da parte, para as partes serem construídas
+        só quando podem ainda dar bandas ao top-K.
+        """
+        pesquisa = self.pesquisa
+        base = pesquisa.base_prefs
+        corte = len(self.roles) - 1 + pesquisa.max_solutions
+        listas = [pesquisa.scored[r] for r in self.roles]
+        melhor = sum(lista[0][0] for lista in listas)
+        primeiras = tuple(0 for _ in listas)
+
+        if base.politica_localizacao_banda == "mesma_regiao":
+            # uma parte por distrito (só o do alvo, se for conhecido); os membros sem distrito ficam de fora
+            geo = pesquisa.m.vocab.geo
+            por_regiao = []
+            for lista in listas:
+                grupos: Dict[int, List[int]] = {}
+                for pos, (_s, m, _d) in enumerate(lista):
+                    grupos.setdefault(geo.regiao(m.loc_id), []).append(pos)
+                por_regiao.append(grupos)
+            alvo = pesquisa.solver._regiao_alvo(base)
+            partes = []
+            for regiao in [alvo] if alvo >= 0 else [r for r in por_regiao[0] if r >= 0]:
+                parte = [grupos.get(regiao, [])[:corte] for grupos in por_regiao]
+                if all(parte):
+                    limite = sum(self.scores[i][p[0]] for i, p in enumerate(parte))
+                    partes.append((limite, tuple(p[0] for p in parte), lambda parte=parte: parte))
+            return partes
+
+        if base.politica_localizacao_banda != "todos_igual":
+            return [(melhor, primeiras, lambda: [list(range(min(corte, len(lista)))) for lista in listas])]
+
+        if base.localizacao:
+            def construir_alvo() -> Optional[List[List[int]]]:
+                parte = []
+                for lista in listas:
+                    posicoes = []
+                    for pos, (_s, m, _d) in enumerate(lista):
+                        if pesquisa.m._localizacao_match(m, base.localizacao, pesquisa.relax, base.raio_km):
+                            posicoes.append(pos)
+                            if len(posicoes) == corte:
+                                break
+                    if not posicoes:
+                        return None
+                    parte.append(posicoes)
+                return parte
+
+            return [(melhor, primeiras, construir_alvo)]
+
+        # sem alvo: uma parte por localização do membro do primeiro papel
+        localizacoes = pesquisa.m.vocab.localizacoes
+        limiar = 0.75 if pesquisa.relax else 0.85
+        por_loc = []
+        for lista in listas:
+            grupos: Dict[int, List[int]] = {}
+            for pos, (_s, m, _d) in enumerate(lista):
+                grupos.setdefault(m.loc_id, []).append(pos)
+            por_loc.append(grupos)
+
+        def construir_loc(loc: int, posicoes: List[int]) -> Optional[List[List[int]]]:
+            parte = [posicoes[:corte]]
+            for grupos in por_loc[1:]:
+                perto = [g for l, g in grupos.items() if localizacoes.similaridade(l, loc) >= limiar]
+                if not perto:
+                    return None
+                parte.append(list(itertools.islice(heapq.merge(*perto), corte)))
+            return parte
+
+        resto = melhor - listas[0][0][0]
+        return [
+            (listas[0][posicoes[0]][0] + resto, (posicoes[0],) + primeiras[1:], lambda l=loc, p=posicoes: construir_loc(l, p))
+            for loc, posicoes in por_loc[0].items()
+        ]
 
-        def c_anos(assign: Dict[str, Any]) -> bool:
-            mus = assign.get("musico", {})
-            if prefs.anos_experiencia is None:
-                return True
-            anos = (
-                self.m._anos_por_instrumento(mus, prefs.instrumento)
-                if prefs.instrumento
-                else self.m._anos_globais(mus)
-            )
-            if anos is None:
-                return False
-            if relax:
-                return abs(anos - prefs.anos_experiencia) <= 4
-            return anos == prefs.anos_experiencia
+    def _resolver(
+        self, parte: List[List[int]], fixos: Dict[int, int], proibidos: FrozenSet[Tuple[int, int]]
+    ) -> Optional[Tuple[int, ...]]:
+        """Melhor banda da parte com os papéis `fixos` (papel -> índice na parte) e sem os pares `proibidos`."""
+        self.nos += 1
+        k = len(parte)
+        base = max(len(p) for p in parte) + 1
+        desempate = [base ** (k - 1 - i) for i in range(k)]
+        peso = base ** k
 
-        constraints.append(Constraint("instrumento", ("musico",), c_instrumento))
-        if not only_instrument:
-            constraints.append(Constraint("localizacao", ("musico",), c_localizacao))
-            constraints.append(Constraint("caracteristicas", ("musico",), c_caracs))
-            constraints.append(Constraint("anos", ("musico",), c_anos))
+        usados = {self.ids[i][parte[i][j]] for i, j in fixos.items()}
+        livres = [i for i in range(k) if i not in fixos]
+        colunas: Dict[Any, int] = {}
+        celulas: List[List[Tuple[int, int, int]]] = []
+        for i in livres:
+            linha = []
+            for j, pos in enumerate(parte[i]):
+                mid = self.ids[i][pos]
+                if (i, j) in proibidos or mid in usados:
+                    continue
+                # menor custo = maior score e, no empate, posição anterior nos papéis de ordem anterior
+                linha.append((colunas.setdefault(mid, len(colunas)), -self.scores[i][pos] * peso + j * desempate[i], j))
+            if not linha:
+                return None
+            celulas.append(linha)
+        if len(colunas) < len(livres):
+            return None
 
-        return constraints
+        custo: List[List[Optional[int]]] = []
+        indice: List[Dict[int, int]] = []
+        for linha in celulas:
+            c: List[Optional[int]] = [None] * len(colunas)
+            for col, valor, _j in linha:
+                c[col] = valor
+            custo.append(c)
+            indice.append({col: j for col, _v, j in linha})
+        atribuicao = _hungaro(custo)
+        if atribuicao is None:
+            return None
 
-    def _run_csp(self, prefs: Preferencias, relax: bool, only_instrument: bool, max_resultados: int) -> List[Dict[str, Any]]:
-        csp = SimpleCSP()
-        csp.add_variable(Variable("musico", self.m.musicos))
-        for c in self._build_constraints(prefs, relax=relax, only_instrument=only_instrument):
-            csp.add_constraint(c)
-        assignments = csp.solve(max_solutions=max_resultados * 2)
-        return [a["musico"] for a in assignments]
+        solucao = [0] * k
+        for i, j in fixos.items():
+            solucao[i] = j
+        for linha, i in enumerate(livres):
+            solucao[i] = indice[linha][atribuicao[linha]]
+        return tuple(solucao)
 
-    def solve(self, prefs: Preferencias, max_resultados: int) -> List[Dict[str, Any]]:
-        only_instrument = (
-            bool(_normalize(prefs.instrumento or ""))
-            and prefs.anos_experiencia is None
-            and not prefs.localizacao
-            and not (prefs.caracteristicas or [])
-        )
+    def executar(self, orcamento: Optional[Orcamento] = None) -> List[Tuple[int, Any]]:
+        """As max_solutions melhores bandas, pela ordem de executar().
 
-        musicos_exatos = self._run_csp(prefs, relax=False, only_instrument=only_instrument, max_resultados=max_resultados)
-        resultados: List[Tuple[Dict[str, Any], bool]] = [(m, True) for m in musicos_exatos]
+        Murty sobre todas as partes ao mesmo tempo: cada parte entra na fila com os seus limites
+        e só é construída, e depois resolvida, quando esses limites chegam à frente da fila.
+        """
+        pesquisa = self.pesquisa
+        k = len(self.roles)
+        nos_iniciais = orcamento.nos if orcamento is not None else 0
+        self.nos = 0
+        parar = False
 
-        if not resultados:
-            musicos_relax = self._run_csp(prefs, relax=True, only_instrument=only_instrument, max_resultados=max_resultados)
-            resultados = [(m, False) for m in musicos_relax]
+        # entradas: (-score, posições, tipo, seq, dados); o tipo 0 é uma parte por construir, o 1 uma parte
+        # por resolver (com limites) e o 2 uma banda. No empate de score e posições sai primeiro o limite.
+        fila: List[Tuple[int, Tuple[int, ...], int, int, Any]] = []
+        seq = itertools.count()
+        for limite, posicoes, construir in self._partes():
+            heapq.heappush(fila, (-limite, posicoes, 0, next(seq), construir))
 
-        out: List[Dict[str, Any]] = []
-        for mus, exato in resultados[:max_resultados]:
-            det = self.m._pontuacao_1(mus, prefs)
-            score = det["score_total"]
-
-            anos_diff = None
-            if prefs.anos_experiencia is not None:
-                anos_cand = (
-                    self.m._anos_por_instrumento(mus, prefs.instrumento)
-                    if prefs.instrumento
-                    else self.m._anos_globais(mus)
-                )
-                if anos_cand is not None:
-                    anos_diff = abs(anos_cand - prefs.anos_experiencia)
+        def empurrar(parte: List[List[int]], fixos: Dict[int, int], proibidos: FrozenSet[Tuple[int, int]]) -> None:
+            nonlocal parar
+            solucao = self._resolver(parte, fixos, proibidos)
+            if orcamento is not None and orcamento.esgotado(nos_iniciais + self.nos):
+                parar = True
+            if solucao is None:
+                return
+            score = sum(self.scores[i][parte[i][j]] for i, j in enumerate(solucao))
+            posicoes = tuple(parte[i][j] for i, j in enumerate(solucao))
+            heapq.heappush(fila, (-score, posicoes, 2, next(seq), (parte, fixos, proibidos, solucao)))
 
-            local_ratio = None
-            if prefs.localizacao:
-                local_ratio = _safe_ratio(mus.get("localizacao", ""), prefs.localizacao)
+        out: List[Tuple[int, Any]] = []
+        while fila and len(out) < pesquisa.max_solutions and not parar:
+            neg_score, posicoes, tipo, _seq, dados = heapq.heappop(fila)
+            if tipo == 0:
+                parte = dados()
+                if parte is not None:
+                    limite = sum(self.scores[i][p[0]] for i, p in enumerate(parte))
+                    heapq.heappush(fila, (-limite, tuple(p[0] for p in parte), 1, next(seq), parte))
+                continue
+            if tipo == 1:
+                empurrar(dados, {}, frozenset())
+                continue
 
-            inst_match = True
-            inst_nome = None
-            inst_anos = None
-            inst_score = None
-            if prefs.instrumento:
-                inst_score_raw = self.m._instrumento_score(mus, prefs.instrumento)
-                inst_match = inst_score_raw >= 0.78
-                inst_nome, inst_anos, inst_score = self.m._melhor_instrumento(mus, prefs.instrumento)
+            assignment = {r: pesquisa.scored[r][pos][1] for r, pos in zip(self.roles, posicoes)}
+            details = {r: pesquisa.score_cache[r][m][1] for r, m in assignment.items()}
+            out.append((-neg_score + pesquisa.bonus_localizacao, (assignment, details)))
 
-            out.append(
-                {
-                    "tipo": "musico",
-                    "id": mus.get("id"),
-                    "nome": mus.get("nome"),
-                    "localizacao": mus.get("localizacao"),
-                    "score": score,
-                    "exato": exato,
-                    "anos_diff": anos_diff,
-                    "localizacao_ratio": local_ratio,
-                    "instrumento_match": inst_match,
-                    "instrumento_score": inst_score,
-                    "instrumento_escolhido": inst_nome,
-                    "instrumento_anos": inst_anos,
-                    "detalhes": det,
-                    "instrumentos": mus.get("instrumentos", []),
-                    "caracteristicas": mus.get("caracteristicas", []),
-                }
-            )
+            # partição de Murty: o resto do subproblema sem esta banda, em subproblemas disjuntos
+            parte, fixos, proibidos, solucao = dados
+            fixos = dict(fixos)
+            for i in range(k):
+                if i in fixos:
+                    continue
+                empurrar(parte, dict(fixos), proibidos | {(i, solucao[i])})
+                fixos[i] = solucao[i]
+                if parar:
+                    break
 
-        out.sort(key=lambda item: (item["exato"], item["score"]), reverse=True)
+        if orcamento is not None:
+            orcamento.nos += self.nos
+            if parar:
+                orcamento.completo = False
         return out
 
+
 class BandCSPSolver:
-    def __init__(self, matcher: Matcher) -> None:
+    # abaixo disto (candidatos do primeiro papel) não compensa lançar processos
+    MIN_CANDIDATOS_PARALELO = 32
+    # com domínios a partir deste tamanho (o menor de todos), a banda é resolvida como atribuição
+    MIN_CANDIDATOS_ATRIBUICAO = 200
+
+    def __init__(self, matcher: Matcher, workers: int = 0) -> None:
         self.m = matcher
+        self.workers = workers
 
-    def _prefs_para_role(self, base: Preferencias, role_instr: str) -> Preferencias:
+    @staticmethod
+    def _prefs_para_role(base: Preferencias, role_instr: str) -> Preferencias:
         """Cria Preferencias específicas para um papel, herdando defaults + overrides."""
         role = _instrument_key(role_instr)
         req = (base.requisitos_por_instrumento or {}).get(role, {}) or {}
@@ -425,57 +3057,193 @@ class BandCSPSolver:
         if loc is None:
             loc = base.localizacao
 
+        raio = _parse_raio(req.get("raio_km"))
+        if raio is None:
+            raio = base.raio_km
+
         return Preferencias(
             instrumento=role_instr,
             anos_experiencia=anos,
             localizacao=loc,
             caracteristicas=list(caracs or []),
+            raio_km=raio,
+            excluir_ids=base.excluir_ids,
         )
 
-    def _score_role(self, mus: Dict[str, Any], role_prefs: Preferencias) -> Tuple[float, Dict[str, float]]:
+    def _score_role(self, mus: PerfilMusico, role_prefs: Preferencias) -> Tuple[float, Dict[str, float]]:
         det = self.m._pontuacao_1(mus, role_prefs)
         return det["score_total"], det
 
-    def _role_ok(self, mus: Dict[str, Any], role_prefs: Preferencias, relax: bool) -> bool:
+    def _role_ok(self, mus: PerfilMusico, role_prefs: Preferencias, relax: bool) -> bool:
         return self.m._satisfaz_constraints_1(mus, role_prefs, relax=relax)
 
-    def _build_domains(self, roles: List[str], base_prefs: Preferencias, relax: bool) -> Dict[str, List[Dict[str, Any]]]:
-        domains: Dict[str, List[Dict[str, Any]]] = {}
+    def _build_domains(
+        self,
+        roles: List[str],
+        base_prefs: Preferencias,
+        relax: bool,
+        classes: Optional[Dict[str, Dict[PerfilMusico, Tuple[bool, bool]]]] = None,
+    ) -> Dict[str, List[PerfilMusico]]:
+        """Domínio de cada papel no regime pedido.
+
+        `classes` guarda, por papel, (cumpre as exatas, cumpre as relaxadas) de cada candidato já visto:
+        o domínio relaxado construído depois do exato só classifica os candidatos que faltam.
+        """
+        if classes is None:
+            classes = {}
+        domains: Dict[str, List[PerfilMusico]] = {}
         for role in roles:
             rp = self._prefs_para_role(base_prefs, role)
-            d = [m for m in self.m.musicos if self._role_ok(m, rp, relax=relax)]
+            vistos = classes.setdefault(role, {})
+            d: List[PerfilMusico] = []
+            for m in self.m._candidatos(rp, relax=relax):
+                classe = vistos.get(m)
+                if classe is None:
+                    classe = vistos[m] = self.m._classificar_1(m, rp)
+                if classe[1] if relax else classe[0]:
+                    d.append(m)
             domains[role] = d
         return domains
 
-    def _band_location_constraint(self, assignment: Dict[str, Dict[str, Any]], base_prefs: Preferencias, relax: bool) -> bool:
-        if base_prefs.politica_localizacao_banda != "todos_igual":
+    def _band_location_constraint(self, assignment: Dict[str, PerfilMusico], base_prefs: Preferencias, relax: bool) -> bool:
+        politica = base_prefs.politica_localizacao_banda
+        if politica not in ("todos_igual", "mesma_regiao"):
             return True
 
         members = list(assignment.values())
         if len(members) <= 1:
             return True
 
+        if politica == "mesma_regiao":
+            # todos no mesmo distrito: o do alvo, se o gazetteer o conhecer, senão o do primeiro membro
+            geo = self.m.vocab.geo
+            regiao = self._regiao_alvo(base_prefs)
+            if regiao < 0:
+                regiao = geo.regiao(members[0].loc_id)
+            return regiao >= 0 and all(geo.regiao(m.loc_id) == regiao for m in members)
+
         if base_prefs.localizacao:
             for m in members:
-                if not self.m._localizacao_match(m, base_prefs.localizacao, relax=relax):
+                if not self.m._localizacao_match(m, base_prefs.localizacao, relax, base_prefs.raio_km):
                     return False
             return True
-        ref = members[0].get("localizacao", "")
+        ref = members[0].loc_id
+        localizacoes = self.m.vocab.localizacoes
         for m in members[1:]:
-            if _safe_ratio(m.get("localizacao", ""), ref) < (0.75 if relax else 0.85):
+            if localizacoes.similaridade(m.loc_id, ref) < (0.75 if relax else 0.85):
                 return False
         return True
 
-    def solve(self, base_prefs: Preferencias, max_resultados: int = 5) -> List[Dict[str, Any]]:
+    def _regiao_alvo(self, base_prefs: Preferencias) -> int:
+        return self.m.vocab.geo.regiao_de(base_prefs.localizacao) if base_prefs.localizacao else -1
+
+    def como_csp(self, base_prefs: Preferencias, relax: bool = False) -> SimpleCSP:
+        """A formação de banda como CSP: uma variável por papel, com o domínio do papel.
+
+        As constraints são as do backtrack de _PesquisaBanda: músicos diferentes em papéis diferentes
+        e, com "todos_igual", todos na localização alvo ou, sem alvo, perto do membro do primeiro papel
+        (o de menor domínio); com "mesma_regiao", o mesmo para o distrito.
+        Serve para enumerar bandas que cumprem as constraints, sem score.
+        """
+        roles = list(dict.fromkeys(r for r in base_prefs.instrumentos_requeridos or [] if _normalize(r)))
+        domains = self._build_domains(roles, base_prefs, relax=relax)
+        csp = SimpleCSP()
+        for role in roles:
+            csp.add_variable(Variable(role, domains[role]))
+
+        for a, b in itertools.combinations(roles, 2):
+            csp.add_constraint(Constraint("diferentes", (a, b), lambda asg, a=a, b=b: asg[a].id != asg[b].id))
+
+        politica = base_prefs.politica_localizacao_banda
+        if politica not in ("todos_igual", "mesma_regiao") or len(roles) <= 1:
+            return csp
+
+        ref = min(roles, key=lambda r: len(domains[r]))
+        if politica == "mesma_regiao":
+            geo = self.m.vocab.geo
+            alvo = self._regiao_alvo(base_prefs)
+            for role in roles:
+                if alvo >= 0:
+                    csp.add_constraint(
+                        Constraint("regiao", (role,), lambda asg, r=role: geo.regiao(asg[r].loc_id) == alvo)
+                    )
+                elif role != ref:
+                    csp.add_constraint(
+                        Constraint(
+                            "mesma_regiao",
+                            (ref, role),
+                            lambda asg, r=role: geo.regiao(asg[ref].loc_id) >= 0
+                            and geo.regiao(asg[r].loc_id) == geo.regiao(asg[ref].loc_id),
+                        )
+                    )
+            return csp
+
+        if base_prefs.localizacao:
+            loc, raio = base_prefs.localizacao, base_prefs.raio_km
+            for role in roles:
+                csp.add_constraint(
+                    Constraint("localizacao", (role,), lambda asg, r=role: self.m._localizacao_match(asg[r], loc, relax, raio))
+                )
+            return csp
+
+        localizacoes = self.m.vocab.localizacoes
+        limiar = 0.75 if relax else 0.85
+        for role in roles:
+            if role != ref:
+                csp.add_constraint(
+                    Constraint(
+                        "mesma_localizacao",
+                        (ref, role),
+                        lambda asg, r=role: localizacoes.similaridade(asg[r].loc_id, asg[ref].loc_id) >= limiar,
+                    )
+                )
+        return csp
+
+    def solve(
+        self,
+        base_prefs: Preferencias,
+        max_resultados: int = 5,
+        orcamento: Optional[Orcamento] = None,
+        estatisticas: Optional[Estatisticas] = None,
+    ) -> List[Dict[str, Any]]:
         roles_in = base_prefs.instrumentos_requeridos or []
         roles = [r for r in roles_in if _normalize(r)]
         if not roles:
             return []
 
-        sols = self._solve_with_relax(base_prefs, roles, relax=False, max_solutions=max_resultados)
+        if orcamento is not None:
+            orcamento.iniciar()
 
-        if not sols:
-            sols = self._solve_with_relax(base_prefs, roles, relax=True, max_solutions=max_resultados)
+        # cada candidato é classificado e pontuado uma só vez por pedido: o relaxamento reaproveita
+        # o que a pesquisa exata já calculou e só repete o backtrack
+        classes: Dict[str, Dict[PerfilMusico, Tuple[bool, bool]]] = {}
+        pontuacoes: Dict[str, Dict[PerfilMusico, Tuple[float, Dict[str, float]]]] = {}
+
+        sols = self._solve_with_relax(
+            base_prefs,
+            roles,
+            relax=False,
+            max_solutions=max_resultados,
+            orcamento=orcamento,
+            estatisticas=estatisticas,
+            classes=classes,
+            pontuacoes=pontuacoes,
+        )
+
+        # sem orçamento não há relaxamento: as bandas encontradas até aqui são o melhor que temos
+        if not sols and (orcamento is None or orcamento.completo):
+            if estatisticas is not None:
+                estatisticas.relaxamento = True
+            sols = self._solve_with_relax(
+                base_prefs,
+                roles,
+                relax=True,
+                max_solutions=max_resultados,
+                orcamento=orcamento,
+                estatisticas=estatisticas,
+                classes=classes,
+                pontuacoes=pontuacoes,
+            )
 
         return sols
 
@@ -485,99 +3253,43 @@ class BandCSPSolver:
         roles: List[str],
         relax: bool,
         max_solutions: int,
+        orcamento: Optional[Orcamento] = None,
+        estatisticas: Optional[Estatisticas] = None,
+        classes: Optional[Dict[str, Dict[PerfilMusico, Tuple[bool, bool]]]] = None,
+        pontuacoes: Optional[Dict[str, Dict[PerfilMusico, Tuple[float, Dict[str, float]]]]] = None,
     ) -> List[Dict[str, Any]]:
-        domains = self._build_domains(roles, base_prefs, relax=relax)
-
-        for r in roles:
-            if not domains.get(r):
-                return []
-
-        roles_order = sorted(roles, key=lambda r: len(domains[r]))
-
-        best: List[Tuple[float, Dict[str, Dict[str, Any]], Dict[str, Dict[str, float]]]] = []
-        used_ids: set = set()
-
-        def current_upper_bound(remaining_roles: List[str]) -> float:
-            ub = 0.0
-            for rr in remaining_roles:
-                rp = self._prefs_para_role(base_prefs, rr)
-                best_score = 0.0
-                for m in domains[rr]:
-                    s, _ = self._score_role(m, rp)
-                    if s > best_score:
-                        best_score = s
-                ub += best_score
-            return ub
-
-        def band_score(assignment: Dict[str, Dict[str, Any]]) -> Tuple[float, Dict[str, Dict[str, float]]]:
-            total = 0.0
-            per_role_details: Dict[str, Dict[str, float]] = {}
-            for role, mus in assignment.items():
-                rp = self._prefs_para_role(base_prefs, role)
-                s, det = self._score_role(mus, rp)
-                total += s
-                per_role_details[role] = det
-
-            if base_prefs.localizacao and base_prefs.politica_localizacao_banda == "todos_igual":
-                ok_all = all(self.m._localizacao_match(m, base_prefs.localizacao, relax=True) for m in assignment.values())
-                if ok_all:
-                    total += 0.75
-
-            return total, per_role_details
-
-        def push_solution(score: float, assignment: Dict[str, Dict[str, Any]], details: Dict[str, Dict[str, float]]) -> None:
-            best.append((score, dict(assignment), dict(details)))
-            best.sort(key=lambda x: x[0], reverse=True)
-            if len(best) > max_solutions:
-                best.pop()
-
-        def can_still_beat(current_score: float, remaining_roles: List[str]) -> bool:
-            if len(best) < max_solutions:
-                return True
-            bound = current_score + current_upper_bound(remaining_roles)
-            return bound > best[-1][0]
-
-        def backtrack(i: int, assignment: Dict[str, Dict[str, Any]], current_score_acc: float) -> None:
-            if i >= len(roles_order):
-                if not self._band_location_constraint(assignment, base_prefs, relax=relax):
-                    return
-                total, per_role_details = band_score(assignment)
-                push_solution(total, assignment, per_role_details)
-                return
-
-            remaining = roles_order[i:]
-            if not can_still_beat(current_score_acc, remaining):
-                return
-
-            role = roles_order[i]
-            rp = self._prefs_para_role(base_prefs, role)
-
-            candidates = [m for m in domains[role] if m.get("id") not in used_ids]
-
-            scored_candidates: List[Tuple[float, Dict[str, Any], Dict[str, float]]] = []
-            for m in candidates:
-                s, det = self._score_role(m, rp)
-                scored_candidates.append((s, m, det))
-            scored_candidates.sort(key=lambda x: x[0], reverse=True)
-
-            for s_ind, m, _det in scored_candidates:
-                mid = m.get("id")
-                if mid in used_ids:
-                    continue
-
-                assignment[role] = m
-                used_ids.add(mid)
-
-                if self._band_location_constraint(assignment, base_prefs, relax=relax):
-                    backtrack(i + 1, assignment, current_score_acc + s_ind)
+        regime = "relaxado" if relax else "exato"
+        with _fase(estatisticas, f"{regime}.dominios"):
+            domains = self._build_domains(roles, base_prefs, relax=relax, classes=classes)
+        if estatisticas is not None:
+            for r in roles:
+                estatisticas.dominio(regime, r, len(domains[r]))
+        pesquisa = _PesquisaBanda(self, base_prefs, roles, relax, max_solutions, domains, pontuacoes, estatisticas)
+        if not pesquisa.viavel:
+            return []
 
-                used_ids.remove(mid)
-                assignment.pop(role, None)
+        n_primeiro = len(pesquisa.scored[pesquisa.roles_order[0]])
+        with _fase(estatisticas, f"{regime}.pesquisa"):
+            if n_primeiro >= self.MIN_CANDIDATOS_ATRIBUICAO and _AtribuicaoBanda.aplicavel(pesquisa):
+                atribuicao = _AtribuicaoBanda(pesquisa)
+                solucoes = atribuicao.executar(orcamento)
+                pesquisa.nos = atribuicao.nos
+            elif self.workers > 1 and n_primeiro >= self.MIN_CANDIDATOS_PARALELO:
+                solucoes = pesquisa.executar_paralelo(self.workers, orcamento)
+            else:
+                solucoes = pesquisa.executar(orcamento=orcamento).ordenados()
+        if estatisticas is not None:
+            estatisticas.nos += pesquisa.nos
+            estatisticas.podas += pesquisa.podas
+            estatisticas.limites += pesquisa.limites
 
-        backtrack(0, {}, 0.0)
+        with _fase(estatisticas, f"{regime}.resultados"):
+            return self._bandas(solucoes, base_prefs, relax)
 
+    def _bandas(self, solucoes: List[Tuple[int, Any]], base_prefs: Preferencias, relax: bool) -> List[Dict[str, Any]]:
+        roles_in = base_prefs.instrumentos_requeridos or []
         out: List[Dict[str, Any]] = []
-        for score, assign, per_role_details in best:
+        for score, (assign, per_role_details) in solucoes:
             membros: List[Dict[str, Any]] = []
             for role in roles_in: 
                 if role not in assign:
@@ -589,14 +3301,14 @@ class BandCSPSolver:
                 membros.append(
                     {
                         "papel": role,
-                        "id": mus.get("id"),
-                        "nome": mus.get("nome"),
-                        "localizacao": mus.get("localizacao"),
+                        "id": mus.id,
+                        "nome": mus.dados.get("nome"),
+                        "localizacao": mus.dados.get("localizacao"),
                         "instrumento_escolhido": inst_nome,
                         "instrumento_anos": inst_anos,
                         "instrumento_score": inst_score,
-                        "instrumentos": mus.get("instrumentos", []),
-                        "caracteristicas": mus.get("caracteristicas", []),
+                        "instrumentos": mus.dados.get("instrumentos", []),
+                        "caracteristicas": mus.dados.get("caracteristicas", []),
                         "detalhes": per_role_details.get(role, {}),
                     }
                 )
@@ -605,7 +3317,7 @@ class BandCSPSolver:
                 {
                     "tipo": "banda",
                     "exato": (not relax),
-                    "score": round(float(score), 3),
+                    "score": round(score / 1000, 3),
                     "instrumentos_requeridos": list(roles_in),
                     "politica_localizacao_banda": base_prefs.politica_localizacao_banda,
                     "localizacao_alvo": base_prefs.localizacao,
@@ -616,15 +3328,56 @@ class BandCSPSolver:
         return out
 
 class CSPMatcherFacade(Matcher):
-    def resolver(self, prefs: Preferencias, max_resultados: int = 5) -> List[Dict[str, Any]]:
-        # modo banda se existir instrumentos_requeridos ou "banda" no payload (aceitamos ambos)
+    def resolver(
+        self,
+        prefs: Preferencias,
+        max_resultados: int = 5,
+        workers: int = 0,
+        orcamento: Optional[Orcamento] = None,
+        estatisticas: Optional[Estatisticas] = None,
+    ) -> List[Dict[str, Any]]:
+        if estatisticas is not None:
+            estatisticas.iniciar(self.vocab)
+        try:
+            # modo banda se existir instrumentos_requeridos ou "banda" no payload (aceitamos ambos)
+            if prefs.instrumentos_requeridos:
+                if estatisticas is not None:
+                    estatisticas.modo = "banda"
+                band_solver = BandCSPSolver(self, workers=workers)
+                return band_solver.solve(
+                    prefs, max_resultados=max_resultados, orcamento=orcamento, estatisticas=estatisticas
+                )
+
+            # fallback: modo 1 músico (compatível)
+            if estatisticas is not None:
+                estatisticas.modo = "musico"
+            solver1 = CSP1Solver(self)
+            return solver1.solve(
+                prefs, max_resultados=max_resultados, estatisticas=estatisticas, orcamento=orcamento
+            )
+        finally:
+            if estatisticas is not None:
+                estatisticas.terminar(self.vocab)
+
+def _manter_viaveis(prefs: Preferencias) -> Callable[[Matcher, PerfilMusico], bool]:
+    """Filtro para Matcher.de_fluxo: só passa quem pode aparecer num resultado de `prefs`.
+
+    Os resultados exatos são um subconjunto dos relaxados, por isso basta cumprir as constraints
+    relaxadas (em modo banda, as de pelo menos um papel).
+    """
+    excluir = {_chave_id(v) for v in prefs.excluir_ids or []}
+    roles = [r for r in prefs.instrumentos_requeridos or [] if _normalize(r)]
+
+    def manter(matcher: Matcher, perfil: PerfilMusico) -> bool:
+        if excluir and _chave_id(perfil.id) in excluir:
+            return False
         if prefs.instrumentos_requeridos:
-            band_solver = BandCSPSolver(self)
-            return band_solver.solve(prefs, max_resultados=max_resultados)
+            solver = BandCSPSolver(matcher)
+            return any(solver._role_ok(perfil, solver._prefs_para_role(prefs, r), relax=True) for r in roles)
+        return matcher._satisfaz_constraints_1(perfil, prefs, relax=True)
+
+    return manter
 
-        # fallback: modo 1 músico (compatível)
-        solver1 = CSP1Solver(self)
-        return solver1.solve(prefs, max_resultados=max_resultados)
 
 def _preferencias_from_payload(pref_data: Dict[str, Any]) -> Preferencias:
     anos_pref = _parse_int(pref_data.get("anos_experiencia"))
@@ -647,21 +3400,782 @@ def _preferencias_from_payload(pref_data: Dict[str, Any]) -> Preferencias:
         anos_experiencia=anos_pref,
         localizacao=pref_data.get("localizacao"),
         caracteristicas=pref_data.get("caracteristicas") or [],
+        raio_km=_parse_raio(pref_data.get("raio_km")),
         instrumentos_requeridos=instrumentos_requeridos or [],
         requisitos_por_instrumento=requisitos_por_instrumento or {},
         politica_localizacao_banda=(politica_loc or "todos_igual"),
+        excluir_ids=pref_data.get("excluir_ids") or [],
     )
     return p
 
 
+def _orcamento_from_payload(dados: Optional[Dict[str, Any]], cancelado: Any = None) -> Optional[Orcamento]:
+    """{"prazo_ms": 500, "max_nos": 200000} -> Orcamento; None quando não há limites nem cancelamento."""
+    dados = dados or {}
+    prazo_ms = _parse_int(dados.get("prazo_ms"))
+    max_nos = _parse_int(dados.get("max_nos"))
+    if prazo_ms is None and max_nos is None and cancelado is None:
+        return None
+    return Orcamento(
+        prazo_s=(prazo_ms / 1000.0 if prazo_ms is not None else None), max_nos=max_nos, cancelado=cancelado
+    )
+
+
+def _chave_preferencias(
+    prefs: Preferencias, max_resultados: Any, caracteristicas: Optional[Vocabulario] = None
+) -> str:
+    """Forma canónica de uma pesquisa: duas pesquisas com a mesma chave têm os mesmos resultados.
+
+    Strings normalizadas e instrumentos pelo alias; em modo banda cada papel entra já com os
+    requisitos resolvidos e com a classe de igualdade do texto original (papéis repetidos contam).
+    As características vão ordenadas quando nenhuma existente em `caracteristicas` (o vocabulário
+    do corpus) serve a duas desejadas: aí as contagens não dependem da ordem. Senão o emparelhamento
+    guloso pode depender dela e a ordem mantém-se.
+    Os campos que só são ecoados na resposta são repostos por _reetiquetar().
+    """
+
+    def texto(valor: Optional[str]) -> Optional[str]:
+        return _normalize(valor) if valor else None
+
+    def caracs(lista: Optional[List[str]]) -> List[str]:
+        normalizadas = [_normalize(c) for c in lista or [] if c]
+        if caracteristicas is not None and not caracteristicas.expandir(tuple(normalizadas))[1]:
+            normalizadas.sort()
+        return normalizadas
+
+    chave: Dict[str, Any] = {
+        "max": max_resultados,
+        "localizacao": texto(prefs.localizacao),
+        "raio": prefs.raio_km,
+        "excluir": sorted({_chave_id(v) for v in prefs.excluir_ids or []}),
+    }
+    if prefs.instrumentos_requeridos:
+        classes: Dict[str, int] = {}
+        papeis = []
+        for role in prefs.instrumentos_requeridos:
+            if not _normalize(role):
+                continue
+            rp = BandCSPSolver._prefs_para_role(prefs, role)
+            papeis.append(
+                [
+                    _instrument_key(role),
+                    classes.setdefault(role, len(classes)),
+                    rp.anos_experiencia,
+                    texto(rp.localizacao),
+                    caracs(rp.caracteristicas),
+                    rp.raio_km,
+                ]
+            )
+        chave["banda"] = papeis
+        chave["politica"] = prefs.politica_localizacao_banda
+    else:
+        chave["instrumento"] = _instrument_key(prefs.instrumento) if prefs.instrumento else None
+        chave["anos"] = prefs.anos_experiencia
+        chave["caracteristicas"] = caracs(prefs.caracteristicas)
+    return json.dumps(chave, sort_keys=True, ensure_ascii=False)
+
+
+def _reetiquetar(resposta: Dict[str, Any], prefs: Preferencias) -> Dict[str, Any]:
+    """Cópia de uma resposta em cache com os campos ecoados (papéis, localização alvo) desta pesquisa."""
+    if not prefs.instrumentos_requeridos:
+        return dict(resposta)
+    roles_in = prefs.instrumentos_requeridos
+    papeis = [r for r in roles_in if _normalize(r)]
+    resultados = []
+    for banda in resposta["resultados"]:
+        membros = [dict(m, papel=papel) for m, papel in zip(banda["membros"], papeis)]
+        resultados.append(
+            dict(banda, membros=membros, instrumentos_requeridos=list(roles_in), localizacao_alvo=prefs.localizacao)
+        )
+    return dict(resposta, resultados=resultados)
+
+
+class CacheResultados:
+    """LRU de respostas por (chave canónica, versão do corpus), com TTL.
+
+    Qualquer alteração ao corpus muda Matcher.versao, por isso as entradas antigas deixam de ser
+    encontradas; na primeira consulta com a versão nova são todas descartadas.
+    """
+
+    def __init__(self, max_entradas: int = 256, ttl_s: float = 60.0) -> None:
+        self.max_entradas = max_entradas
+        self.ttl_s = ttl_s
+        self._entradas: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._versao: Optional[int] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _validar(self, versao: int) -> None:
+        if versao != self._versao:
+            self._entradas.clear()
+            self._versao = versao
+
+    def _antiga(self, versao: int) -> bool:
+        # pesquisas sobre um corpus já substituído não leem nem escrevem na época atual
+        return self._versao is not None and versao < self._versao
+
+    def obter(self, versao: int, chave: str) -> Any:
+        with self._lock:
+            if self._antiga(versao):
+                self.misses += 1
+                return None
+            self._validar(versao)
+            entrada = self._entradas.get(chave)
+            if entrada is None or entrada[0] < time.monotonic():
+                if entrada is not None:
+                    del self._entradas[chave]
+                self.misses += 1
+                return None
+            self._entradas.move_to_end(chave)
+            self.hits += 1
+            return entrada[1]
+
+    def guardar(self, versao: int, chave: str, resposta: Any) -> None:
+        if self.max_entradas <= 0:
+            return
+        with self._lock:
+            if self._antiga(versao):
+                return
+            self._validar(versao)
+            self._entradas[chave] = (time.monotonic() + self.ttl_s, resposta)
+            self._entradas.move_to_end(chave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def limpar(self) -> None:
+        with self._lock:
+            self._entradas.clear()
+
+    def info(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "tamanho": len(self._entradas),
+            "maximo": self.max_entradas,
+            "taxa_acerto": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+def _resposta_match(
+    matcher: CSPMatcherFacade,
+    preferencias: Preferencias,
+    max_resultados: int,
+    workers: int,
+    orcamento: Optional[Orcamento],
+    cache: Optional[CacheResultados] = None,
+    com_estatisticas: bool = False,
+) -> Dict[str, Any]:
+    if cache is not None:
+        versao = matcher.versao
+        chave = _chave_preferencias(preferencias, max_resultados, matcher.vocab.caracteristicas)
+        guardada = cache.obter(versao, chave)
+        if guardada is not None:
+            resposta = _reetiquetar(guardada, preferencias)
+            if com_estatisticas:
+                resposta["estatisticas"] = {"cache": True}
+            return resposta
+
+    estatisticas = Estatisticas() if com_estatisticas else None
+    resposta: Dict[str, Any] = {
+        "resultados": matcher.resolver(
+            preferencias, max_resultados=max_resultados, workers=workers, orcamento=orcamento, estatisticas=estatisticas
+        )
+    }
+    if orcamento is not None and orcamento.limitado:
+        resposta["pesquisa"] = orcamento.resumo()
+
+    # uma pesquisa cortada pelo orçamento depende do tempo: só guardamos resultados completos
+    if cache is not None and (orcamento is None or orcamento.completo):
+        cache.guardar(versao, chave, resposta)
+        resposta = dict(resposta)
+    if estatisticas is not None:
+        resposta["estatisticas"] = estatisticas.resumo()
+    return resposta
+
+
+def _resposta_pedido(
+    matcher: CSPMatcherFacade,
+    pedido: Dict[str, Any],
+    cache: Optional[CacheResultados] = None,
+    cancelado: Any = None,
+) -> Dict[str, Any]:
+    """Responde a {"preferencias": {...}} ou, em lote, a {"consultas": [{...}, ...]}.
+
+    Em lote, todas as consultas correm sobre o mesmo corpus indexado (e partilham as caches de
+    vocabulário e similaridade); consultas repetidas são calculadas uma só vez.
+    Com `cancelado` (um threading.Event), as pesquisas param quando ele é posto.
+    """
+    max_resultados = pedido.get("max_resultados", 10)
+    workers = _parse_int(pedido.get("workers")) or 0
+    com_estatisticas = bool(pedido.get("estatisticas"))
+
+    if pedido.get("consultas") is None:
+        preferencias = _preferencias_from_payload(pedido.get("preferencias", {}) or {})
+        orcamento = _orcamento_from_payload(pedido.get("orcamento"), cancelado)
+        return _resposta_match(matcher, preferencias, max_resultados, workers, orcamento, cache, com_estatisticas)
+
+    por_chave: Dict[str, Dict[str, Any]] = {}
+    consultas: List[Dict[str, Any]] = []
+    for pref_data in pedido.get("consultas") or []:
+        chave = json.dumps(pref_data, sort_keys=True, default=str)
+        if chave not in por_chave:
+            preferencias = _preferencias_from_payload(pref_data or {})
+            por_chave[chave] = _resposta_match(
+                matcher,
+                preferencias,
+                max_resultados,
+                workers,
+                _orcamento_from_payload(pedido.get("orcamento"), cancelado),
+                cache,
+                com_estatisticas,
+            )
+        consultas.append(por_chave[chave])
+    return {"consultas": consultas}
+
+
+def _manter_do_pedido(campos: Dict[str, Any]) -> Optional[Callable[[Matcher, PerfilMusico], bool]]:
+    """Filtro de Matcher.de_fluxo para as preferências (ou consultas) já lidas do pedido."""
+    if campos.get("consultas") is not None:
+        filtros = [_manter_viaveis(_preferencias_from_payload(p or {})) for p in campos.get("consultas") or []]
+        return lambda matcher, perfil: any(f(matcher, perfil) for f in filtros)
+    pref_data = campos.get("preferencias")
+    if isinstance(pref_data, dict):
+        return _manter_viaveis(_preferencias_from_payload(pref_data))
+    return None
+
+
+class _LeitoresEscritor:
+    """Várias pesquisas em simultâneo ou uma alteração ao índice; quem escreve tem prioridade."""
+
+    def __init__(self) -> None:
+        self._cond = threading.Condition()
+        self._leitores = 0
+        self._escritores = 0
+        self._a_escrever = False
+
+    @contextmanager
+    def leitura(self) -> Iterator[None]:
+        with self._cond:
+            while self._escritores:
+                self._cond.wait()
+            self._leitores += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._leitores -= 1
+                if not self._leitores:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def escrita(self) -> Iterator[None]:
+        with self._cond:
+            self._escritores += 1
+            while self._leitores or self._a_escrever:
+                self._cond.wait()
+            self._a_escrever = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._escritores -= 1
+                self._a_escrever = False
+                self._cond.notify_all()
+
+
+class _LeitorJSON:
+    """Lê um objeto JSON de topo aos bocados, sem ter o texto todo em memória.
+
+    membros() percorre as chaves do objeto; o valor de cada uma tem de ser consumido com valor()
+    ou, para listas, elemento a elemento com elementos().
+    """
+
+    BLOCO = 1 << 16
+
+    def __init__(self, fonte: Any) -> None:
+        self.fonte = fonte
+        self.buf = ""
+        self.pos = 0
+        self.fim = False
+        self._decoder = json.JSONDecoder()
+
+    def _ler_mais(self) -> None:
+        bloco = self.fonte.read(self.BLOCO)
+        if not bloco:
+            self.fim = True
+            return
+        self.buf = self.buf[self.pos :] + bloco
+        self.pos = 0
+
+    def espreitar(self) -> str:
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf) or self.fim:
+                return self.buf[self.pos : self.pos + 1]
+            self._ler_mais()
+
+    def _esperar(self, caracter: str) -> None:
+        if self.espreitar() != caracter:
+            raise ValueError(f"JSON inválido: esperava {caracter!r}")
+        self.pos += 1
+
+    def _separador(self, fecho: str) -> bool:
+        """Consome ',' (True: há mais) ou o fecho (False)."""
+        caracter = self.espreitar()
+        self.pos += 1
+        if caracter == ",":
+            return True
+        if caracter == fecho:
+            return False
+        raise ValueError(f"JSON inválido: esperava ',' ou {fecho!r}")
+
+    def valor(self) -> Any:
+        self.espreitar()
+        while True:
+            try:
+                valor, fim = self._decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.fim:
+                    raise
+            else:
+                # um número no fim do bloco pode continuar no bloco seguinte
+                if fim < len(self.buf) or self.fim:
+                    self.pos = fim
+                    return valor
+            self._ler_mais()
+
+    def membros(self) -> Iterator[str]:
+        self._esperar("{")
+        if self.espreitar() == "}":
+            self.pos += 1
+            return
+        while True:
+            chave = self.valor()
+            if not isinstance(chave, str):
+                raise ValueError("JSON inválido: chave que não é string")
+            self._esperar(":")
+            yield chave
+            if not self._separador("}"):
+                return
+
+    def elementos(self) -> Iterator[Any]:
+        if self.espreitar() != "[":
+            valor = self.valor()
+            yield from (valor or [])
+            return
+        self.pos += 1
+        if self.espreitar() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.valor()
+            if not self._separador("]"):
+                return
+
+
+def _ler_payload_fluxo(fonte: Any) -> Tuple[Dict[str, Any], Optional[CSPMatcherFacade]]:
+    """Lê o payload do CLI ({"preferencias", "musicos", ...}) músico a músico.
+
+    Com "preferencias" (ou "consultas") antes de "musicos", os perfis que não podem entrar em
+    nenhum resultado são descartados à chegada; caso contrário ficam todos.
+    """
+    leitor = _LeitorJSON(fonte)
+    campos: Dict[str, Any] = {}
+    matcher: Optional[CSPMatcherFacade] = None
+    for chave in leitor.membros():
+        if chave == "musicos":
+            matcher = CSPMatcherFacade.de_fluxo(leitor.elementos(), _manter_do_pedido(campos))
+        else:
+            campos[chave] = leitor.valor()
+    # como json.load: texto depois do objeto (que não seja espaço) é um erro
+    if leitor.espreitar():
+        raise ValueError("JSON inválido: dados a mais depois do objeto")
+    return campos, matcher
+
+
+def _escrever_resposta(resposta: Dict[str, Any], saida: Any) -> None:
+    """Escreve a resposta resultado a resultado (o mesmo texto que json.dump)."""
+    lista = "consultas" if "consultas" in resposta else "resultados"
+    saida.write(f'{{"{lista}": [')
+    for i, item in enumerate(resposta[lista]):
+        if i:
+            saida.write(", ")
+        saida.write(json.dumps(item, ensure_ascii=False))
+    saida.write("]")
+    for chave, valor in resposta.items():
+        if chave != lista:
+            saida.write(f", {json.dumps(chave)}: {json.dumps(valor, ensure_ascii=False)}")
+    saida.write("}")
+
+
+class ServidorMatcher:
+    """Mantém um CSPMatcherFacade quente e responde a pedidos JSON (um por linha).
+
+    O corpus é carregado uma vez ("carregar") e depois mantido com "atualizar"/"remover" por id,
+    por isso um "match" só precisa de trazer as preferências.
+    """
+
+    # operações que alteram o corpus: no modo stdio correm pela ordem em que chegam
+    OPS_ESCRITA = ("carregar", "atualizar", "remover")
+
+    # rankings guardados para os pedidos com "cursor"; uma alteração ao corpus invalida-os todos
+    MAX_CURSORES = 64
+    TTL_CURSOR_S = 600.0
+
+    def __init__(
+        self,
+        musicos: Optional[Iterable[Dict[str, Any]]] = None,
+        cache: Optional[CacheResultados] = None,
+    ) -> None:
+        self.matcher = CSPMatcherFacade(musicos or [])
+        self.lock = _LeitoresEscritor()
+        self.cache = cache if cache is not None else CacheResultados()
+        self.cursores = CacheResultados(self.MAX_CURSORES, self.TTL_CURSOR_S)
+
+    def carregar(self, musicos: Iterable[Dict[str, Any]]) -> int:
+        # troca atómica da referência: pedidos em curso terminam com o corpus antigo
+        self.matcher = CSPMatcherFacade(musicos)
+        self.cache.limpar()
+        return len(self.matcher)
+
+    def carregar_snapshot(self, caminho: str) -> int:
+        self.matcher = CSPMatcherFacade.de_snapshot(caminho)
+        self.cache.limpar()
+        return len(self.matcher)
+
+    def processar(self, pedido: Dict[str, Any], cancelado: Any = None) -> Dict[str, Any]:
+        op = pedido.get("op") or "match"
+
+        if op == "ping":
+            return {"ok": True}
+
+        if op == "estatisticas":
+            return {
+                "ok": True,
+                "total": len(self.matcher),
+                "similaridade_cache": similaridade_cache_info(),
+                "cache_resultados": self.cache.info(),
+            }
+
+        if op == "carregar":
+            if pedido.get("snapshot"):
+                total = self.carregar_snapshot(pedido["snapshot"])
+            else:
+                total = self.carregar(pedido.get("musicos") or [])
+            return {"ok": True, "total": total}
+
+        if op == "guardar_snapshot":
+            if not pedido.get("caminho"):
+                return {"erro": "guardar_snapshot precisa de 'caminho'"}
+            with self.lock.leitura():
+                total = guardar_snapshot(self.matcher, pedido["caminho"])
+            return {"ok": True, "total": total}
+
+        if op == "atualizar":
+            with self.lock.escrita():
+                alterados = self.matcher.atualizar(pedido.get("musicos") or [])
+                return {"ok": True, "alterados": alterados, "total": len(self.matcher)}
+
+        if op == "remover":
+            with self.lock.escrita():
+                removidos = self.matcher.remover(pedido.get("ids") or [])
+                return {"ok": True, "removidos": removidos, "total": len(self.matcher)}
+
+        if op == "match":
+            if (_parse_int(pedido.get("workers")) or 0) > 1:
+                # a pesquisa paralela faz fork, e aqui há as threads do _Despacho (e os seus locks)
+                return {"erro": "'workers' > 1 só é aceite no modo CLI, não no servidor"}
+            if pedido.get("cursor") is not None or pedido.get("paginar"):
+                return self.paginar(pedido, cancelado)
+            if pedido.get("musicos") is not None:
+                matcher = CSPMatcherFacade.de_fluxo(pedido.get("musicos") or [], _manter_do_pedido(pedido))
+                return _resposta_pedido(matcher, pedido, cancelado=cancelado)
+            with self.lock.leitura():
+                resposta = _resposta_pedido(self.matcher, pedido, self.cache, cancelado)
+                resposta["total"] = len(self.matcher)
+                return resposta
+
+        return {"erro": f"Operação desconhecida: {op}"}
+
+    def paginar(self, pedido: Dict[str, Any], cancelado: Any = None) -> Dict[str, Any]:
+        """Pesquisa de 1 músico por páginas de max_resultados.
+
+        {"paginar": true, "preferencias": {...}} devolve a primeira página e, se houver mais, um
+        "cursor" opaco; {"cursor": ...} devolve a página seguinte sem repetir a pesquisa. Com o
+        corpus alterado entretanto (ou o cursor expirado) a resposta tem "cursor_expirado".
+        Pesquisas de banda não são paginadas e respondem como um "match" normal.
+        """
+        n = _parse_int(pedido.get("max_resultados"))
+        n = 10 if n is None else n
+        with self.lock.leitura():
+            matcher = self.matcher
+            if pedido.get("cursor") is not None:
+                chave, _, inicio_txt = str(pedido["cursor"]).rpartition(".")
+                ranking = self.cursores.obter(matcher.versao, chave) if inicio_txt.isdigit() else None
+                if ranking is None:
+                    return {"erro": "cursor inválido ou expirado", "cursor_expirado": True}
+                inicio = int(inicio_txt)
+            else:
+                prefs = _preferencias_from_payload(pedido.get("preferencias", {}) or {})
+                if prefs.instrumentos_requeridos:
+                    resposta = _resposta_pedido(matcher, pedido, self.cache, cancelado)
+                    resposta["total"] = len(matcher)
+                    return resposta
+                orcamento = _orcamento_from_payload(None, cancelado)
+                ranking = CSP1Solver(matcher).ranking(prefs, orcamento)
+                chave = secrets.token_urlsafe(12)
+                # um ranking cortado pelo cancelamento não serve para as páginas seguintes
+                if orcamento is None or orcamento.completo:
+                    self.cursores.guardar(matcher.versao, chave, ranking)
+                inicio = 0
+
+            resultados = ranking.pagina(inicio, n)
+            resposta = {"resultados": resultados, "total": len(matcher), "total_resultados": ranking.total}
+            fim = inicio + len(resultados)
+            if fim < ranking.total:
+                resposta["cursor"] = f"{chave}.{fim}"
+            return resposta
+
+    def ler_pedido(self, linha: str) -> Dict[str, Any]:
+        pedido = json.loads(linha)
+        if not isinstance(pedido, dict):
+            raise ValueError("o pedido tem de ser um objeto JSON")
+        return pedido
+
+    def responder(self, pedido: Dict[str, Any], cancelado: Any = None) -> str:
+        try:
+            resposta = self.processar(pedido, cancelado)
+        except Exception as exc:  # o servidor nunca deve cair por causa de um pedido
+            resposta = {"erro": str(exc)}
+
+        if pedido.get("id") is not None:
+            resposta["id"] = pedido.get("id")
+        return json.dumps(resposta, ensure_ascii=False)
+
+    def processar_linha(self, linha: str) -> Optional[str]:
+        linha = linha.strip()
+        if not linha:
+            return None
+        try:
+            pedido = self.ler_pedido(linha)
+        except ValueError as exc:
+            return json.dumps({"erro": str(exc)}, ensure_ascii=False)
+        return self.responder(pedido)
+
+
+# maior linha (pedido) aceite no socket; chega para "atualizar" e para pesquisas em lote, e um
+# corpus inteiro carrega-se de um ficheiro ({"op": "carregar", "snapshot": caminho} ou --snapshot)
+_LIMITE_LINHA = 8 << 20
+
+
+class _Despacho:
+    """Distribui pelas threads de pesquisa os pedidos que chegam de uma ou mais ligações.
+
+    Há `workers` pesquisas em curso ao mesmo tempo, em threads: como partilham o GIL, isto só deixa
+    uma pesquisa curta avançar enquanto corre uma longa, não usa mais CPUs (para isso há vários
+    processos ai.py, um por worker do Node, e a pesquisa paralela de bandas). As outras esperam a
+    vez, até haver `fila` pedidos em curso. A partir daí os pedidos são recusados logo com {"ocupado": true}, para quem
+    os envia poder tentar mais tarde (ou noutro worker) em vez de esperar atrás de uma fila longa.
+    Um pedido com id pode ser cancelado com {"op": "cancelar", "alvo": id}: se ainda não começou,
+    já não corre; uma pesquisa a correr pára no próximo ponto de verificação do orçamento (nas de
+    1 músico, entre os passos e a cada 64 candidatos; nos processos da pesquisa paralela de bandas
+    só o prazo conta). Em ambos os casos a resposta é {"cancelado": true}.
+    """
+
+    def __init__(self, servidor: ServidorMatcher, workers: int, fila: int) -> None:
+        self.servidor = servidor
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.vagas = asyncio.Semaphore(workers)
+        self.fila = max(workers, fila)
+        # (ligação, id do pedido) -> Event posto quando o pedido é cancelado
+        self.em_curso: Dict[Tuple[object, Any], threading.Event] = {}
+        self.tarefas: Set["asyncio.Task[None]"] = set()
+
+    @staticmethod
+    def _json(resposta: Dict[str, Any], pedido: Dict[str, Any]) -> str:
+        if pedido.get("id") is not None:
+            resposta["id"] = pedido.get("id")
+        return json.dumps(resposta, ensure_ascii=False)
+
+    async def atender(
+        self,
+        ler: Callable[[], Awaitable[bytes]],
+        escrever: Callable[[str], None],
+        cancelar_ao_fechar: bool = False,
+    ) -> None:
+        """Lê pedidos (uma linha JSON cada) até ao fim da ligação e escreve as respostas por ordem de conclusão.
+
+        As operações que alteram o corpus correm antes de se ler a linha seguinte, por isso os
+        pedidos seguintes já veem o corpus novo.
+        """
+        loop = asyncio.get_running_loop()
+        ligacao = object()
+        while True:
+            raw = await ler()
+            if not raw:
+                break
+            linha = raw.decode("utf-8").strip()
+            if not linha:
+                continue
+            try:
+                pedido = self.servidor.ler_pedido(linha)
+            except ValueError as exc:
+                escrever(json.dumps({"erro": str(exc)}, ensure_ascii=False))
+                continue
+
+            op = pedido.get("op")
+            if op == "cancelar":
+                evento = self.em_curso.get((ligacao, pedido.get("alvo")))
+                if evento is not None:
+                    evento.set()
+                escrever(self._json({"ok": True, "cancelado": evento is not None}, pedido))
+            elif op in ServidorMatcher.OPS_ESCRITA:
+                escrever(await loop.run_in_executor(None, self.servidor.responder, pedido))
+            elif len(self.tarefas) >= self.fila:
+                escrever(self._json({"erro": "matcher ocupado", "ocupado": True}, pedido))
+            else:
+                tarefa = asyncio.create_task(self._pesquisar(pedido, escrever, ligacao))
+                self.tarefas.add(tarefa)
+                tarefa.add_done_callback(self.tarefas.discard)
+
+        # quem fechou a ligação já não vai ler as respostas
+        if cancelar_ao_fechar:
+            for (dona, _id), evento in list(self.em_curso.items()):
+                if dona is ligacao:
+                    evento.set()
+
+    async def _pesquisar(self, pedido: Dict[str, Any], escrever: Callable[[str], None], ligacao: object) -> None:
+        chave = (ligacao, pedido.get("id"))
+        evento = threading.Event()
+        if pedido.get("id") is not None:
+            self.em_curso[chave] = evento
+        try:
+            async with self.vagas:
+                resposta = None
+                if not evento.is_set():
+                    loop = asyncio.get_running_loop()
+                    resposta = await loop.run_in_executor(self.pool, self.servidor.responder, pedido, evento)
+        finally:
+            if self.em_curso.get(chave) is evento:
+                del self.em_curso[chave]
+        if evento.is_set():
+            resposta = self._json({"erro": "pedido cancelado", "cancelado": True}, pedido)
+        escrever(resposta)
+
+    async def concluir(self) -> None:
+        while self.tarefas:
+            await asyncio.gather(*self.tarefas)
+        self.pool.shutdown()
+
+
+def _servir_stdio(servidor: ServidorMatcher, workers: int, fila: int) -> None:
+    """Lê pedidos do stdin e escreve as respostas (com o mesmo id) no stdout, por ordem de conclusão."""
+
+    def escrever(resposta: str) -> None:
+        sys.stdout.write(resposta + "\n")
+        sys.stdout.flush()
+
+    async def principal() -> None:
+        loop = asyncio.get_running_loop()
+        despacho = _Despacho(servidor, workers, fila)
+        # o stdin pode ser um ficheiro (que o event loop não sabe vigiar), por isso é lido numa thread
+        await despacho.atender(lambda: loop.run_in_executor(None, sys.stdin.buffer.readline), escrever)
+        await despacho.concluir()
+
+    asyncio.run(principal())
+
+
+def _servir_socket(servidor: ServidorMatcher, caminho: str, workers: int, fila: int) -> None:
+    """Serve o mesmo protocolo num socket Unix; todas as ligações partilham as threads e a fila.
+
+    Os pedidos de uma ligação que fecha são cancelados.
+    """
+    if os.path.exists(caminho):
+        os.unlink(caminho)
+
+    async def principal() -> None:
+        despacho = _Despacho(servidor, workers, fila)
+
+        async def ligacao(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+            def escrever(resposta: str) -> None:
+                if not writer.is_closing():
+                    writer.write((resposta + "\n").encode("utf-8"))
+
+            async def ler() -> bytes:
+                try:
+                    return await reader.readline()
+                except ConnectionError:
+                    return b""
+                except ValueError:
+                    # linha maior do que _LIMITE_LINHA: o resto do pedido já não se consegue ler
+                    escrever(json.dumps({"erro": f"pedido maior do que {_LIMITE_LINHA} bytes"}, ensure_ascii=False))
+                    return b""
+
+            try:
+                await despacho.atender(ler, escrever, cancelar_ao_fechar=True)
+            finally:
+                writer.close()
+
+        srv = await asyncio.start_unix_server(ligacao, path=caminho, limit=_LIMITE_LINHA)
+        async with srv:
+            await srv.serve_forever()
+
+    asyncio.run(principal())
+
+
+if __name__ == "__main__" and "--servidor" in sys.argv[1:]:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Matcher SoundCircle em modo servidor (NDJSON).")
+    parser.add_argument("--servidor", action="store_true")
+    parser.add_argument("--socket", help="caminho de um socket Unix; por omissão usa stdin/stdout")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="pesquisas em curso ao mesmo tempo (threads com o GIL: concorrência, não mais CPUs)",
+    )
+    parser.add_argument(
+        "--fila",
+        type=int,
+        default=64,
+        help="pedidos em curso (a correr ou à espera) a partir dos quais o servidor responde 'ocupado'",
+    )
+    parser.add_argument("--snapshot", help="snapshot do corpus a abrir no arranque (ver guardar_snapshot)")
+    parser.add_argument("--cache", type=int, default=256, help="respostas guardadas em cache (0 desliga)")
+    parser.add_argument("--cache-ttl", type=float, default=60.0, help="segundos que uma resposta fica em cache")
+    parser.add_argument(
+        "--similaridade",
+        choices=sorted(MOTORES_SIMILARIDADE),
+        default=MOTOR_SIMILARIDADE,
+        help="motor de similaridade de strings (difflib é a referência)",
+    )
+    args = parser.parse_args()
+
+    MOTOR_SIMILARIDADE = args.similaridade
+
+    servidor = ServidorMatcher(cache=CacheResultados(args.cache, args.cache_ttl))
+    if args.snapshot:
+        servidor.carregar_snapshot(args.snapshot)
+    if args.socket:
+        _servir_socket(servidor, args.socket, max(1, args.workers), args.fila)
+    else:
+        _servir_stdio(servidor, max(1, args.workers), args.fila)
+    sys.exit(0)
+
+
 if __name__ == "__main__":
     payload = None
+    matcher = None
     try:
-        payload = json.load(sys.stdin)
+        payload, matcher = _ler_payload_fluxo(sys.stdin)
     except Exception:
-        payload = None
+        payload, matcher = None, None
 
-    if not payload:
+    if not payload and matcher is None:
         MUSICOS_EXEMPLO = [
             {
                 "id": 1,
@@ -716,12 +4230,6 @@ if __name__ == "__main__":
         print(json.dumps({"resultados": sugestoes}, ensure_ascii=False))
         sys.exit(0)
 
-    musicos = payload.get("musicos", [])
-    pref_data = payload.get("preferencias", {}) or {}
-    max_resultados = payload.get("max_resultados", 10)
-
-    preferencias = _preferencias_from_payload(pref_data)
-
-    matcher = CSPMatcherFacade(musicos)
-    sugestoes = matcher.resolver(preferencias, max_resultados=max_resultados)
-    json.dump({"resultados": sugestoes}, sys.stdout, ensure_ascii=False)
+    if matcher is None:
+        matcher = CSPMatcherFacade([])
+    _escrever_resposta(_resposta_pedido(matcher, payload), sys.stdout)
@@ -0,0 +1,393 @@
+"""Benchmark do matcher com um corpus sintético.
+
+Uso: python3 bench.py --musicos 1000,10000,100000 --consultas 50 --saida bench.json
+
+Cada tamanho corre num processo novo, para o pico de memória (RSS) ser só desse corpus.
+Com a mesma --seed o corpus e as consultas são iguais em todos os commits, por isso dois JSON
+de commits diferentes comparam-se cenário a cenário.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import multiprocessing
+import platform
+import random
+import sys
+import time
+import unicodedata
+from typing import Any, Dict, Iterator, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None  # type: ignore[assignment]
+
+import ai
+
+INSTRUMENTOS = ["Guitarra", "Baixo", "Bateria", "Piano", "Voz", "Saxofone", "Violino", "Teclado"]
+
+# nomes de papel que as pessoas escrevem no perfil em vez do instrumento
+ALCUNHAS = {"Guitarra": "Guitarrista", "Baixo": "Baixista", "Bateria": "Baterista", "Piano": "Pianista", "Voz": "Vocalista"}
+
+LOCALIZACOES = [
+    "Aveiro", "Beja", "Braga", "Bragança", "Castelo Branco", "Coimbra", "Évora", "Faro", "Guarda",
+    "Leiria", "Lisboa", "Portalegre", "Porto", "Santarém", "Setúbal", "Viana do Castelo", "Vila Real", "Viseu",
+]
+
+CARACTERISTICAS = [
+    "Pontual", "Criativo", "Rock", "Jazz", "Pop", "Improvisador", "Metal", "Blues",
+    "Funk", "Fado", "Compositor", "Experiência em palco",
+]
+
+NIVEIS = ["iniciante", "intermedio", "avancado"]
+
+# as cidades grandes aparecem mais vezes, como na base de dados real
+_PESOS_LOCALIZACAO = [3 if loc in ("Lisboa", "Porto", "Braga", "Coimbra") else 1 for loc in LOCALIZACOES]
+
+
+def _sem_acentos(texto: str) -> str:
+    return "".join(c for c in unicodedata.normalize("NFKD", texto) if not unicodedata.combining(c))
+
+
+def _com_gralha(rng: random.Random, texto: str) -> str:
+    """Uma gralha típica de quem escreve à pressa: sem acentos, letra trocada, a menos ou a mais."""
+    tipo = rng.randrange(5)
+    if tipo == 0:
+        return _sem_acentos(texto)
+    if tipo == 1:
+        return texto.lower() if rng.random() < 0.5 else texto.upper()
+    if len(texto) < 4:
+        return texto
+    i = rng.randrange(1, len(texto) - 1)
+    if tipo == 2:
+        return texto[:i] + texto[i + 1] + texto[i] + texto[i + 2 :]
+    if tipo == 3:
+        return texto[:i] + texto[i + 1 :]
+    return texto[:i] + texto[i] + texto[i:]
+
+
+def _talvez_gralha(rng: random.Random, texto: str, prob: float) -> str:
+    return _com_gralha(rng, texto) if rng.random() < prob else texto
+
+
+def musicos_sinteticos(n: int, seed: int = 42, gralhas: float = 0.1) -> Iterator[Dict[str, Any]]:
+    """Gera `n` perfis como os que o Node envia; `gralhas` é a fração de textos com erros."""
+    rng = random.Random(seed)
+    for i in range(n):
+        instrumentos = []
+        # a maioria toca um instrumento, alguns dois ou três
+        for nome in rng.sample(INSTRUMENTOS, rng.choices((1, 2, 3), weights=(6, 3, 1))[0]):
+            if nome in ALCUNHAS and rng.random() < 0.15:
+                nome = ALCUNHAS[nome]
+            instrumentos.append(
+                {
+                    "nome": _talvez_gralha(rng, nome, gralhas),
+                    "anos_experiencia": rng.randint(0, 20),
+                    "nivel": rng.choice(NIVEIS),
+                }
+            )
+        yield {
+            "id": i + 1,
+            "nome": f"Musico {i + 1}",
+            "localizacao": _talvez_gralha(rng, rng.choices(LOCALIZACOES, weights=_PESOS_LOCALIZACAO)[0], gralhas),
+            "caracteristicas": [_talvez_gralha(rng, c, gralhas / 2) for c in rng.sample(CARACTERISTICAS, rng.randint(0, 5))],
+            "instrumentos": instrumentos,
+            "anos_experiencia": min(inst["anos_experiencia"] for inst in instrumentos),
+        }
+
+
+def gerar_musicos(n: int, seed: int = 42) -> List[Dict[str, Any]]:
+    return list(musicos_sinteticos(n, seed=seed))
+
+
+# --- consultas ---------------------------------------------------------------------------------
+# "exato": textos limpos e poucas exigências, a maioria dos resultados passa nas constraints exatas.
+# "relaxado": gralhas, anos precisos e mais características; quase tudo vem do fallback relaxado.
+
+
+def _consulta_musico(rng: random.Random, regime: str) -> ai.Preferencias:
+    if regime == "exato":
+        return ai.Preferencias(
+            instrumento=rng.choice(INSTRUMENTOS),
+            localizacao=rng.choice(LOCALIZACOES),
+            caracteristicas=rng.sample(CARACTERISTICAS, rng.randint(0, 2)),
+        )
+    instrumento = rng.choice(INSTRUMENTOS)
+    return ai.Preferencias(
+        instrumento=_com_gralha(rng, ALCUNHAS.get(instrumento, instrumento)),
+        anos_experiencia=rng.randint(0, 20),
+        localizacao=_com_gralha(rng, rng.choice(LOCALIZACOES)),
+        caracteristicas=[_talvez_gralha(rng, c, 0.5) for c in rng.sample(CARACTERISTICAS, rng.randint(2, 3))],
+    )
+
+
+def _consulta_banda(rng: random.Random, regime: str, papeis: int) -> ai.Preferencias:
+    roles = rng.sample(INSTRUMENTOS, papeis)
+    if regime == "exato":
+        return ai.Preferencias(
+            localizacao=rng.choice(LOCALIZACOES),
+            caracteristicas=rng.sample(CARACTERISTICAS, 1),
+            instrumentos_requeridos=roles,
+        )
+    requisitos = {ai._normalize(r): {"anos_experiencia": rng.randint(2, 15)} for r in rng.sample(roles, max(1, papeis // 2))}
+    return ai.Preferencias(
+        localizacao=_com_gralha(rng, rng.choice(LOCALIZACOES)),
+        caracteristicas=[_talvez_gralha(rng, c, 0.5) for c in rng.sample(CARACTERISTICAS, 3)],
+        instrumentos_requeridos=[_talvez_gralha(rng, ALCUNHAS.get(r, r), 0.5) for r in roles],
+        requisitos_por_instrumento=requisitos,
+    )
+
+
+def _cenarios(rng: random.Random, args: argparse.Namespace) -> Dict[str, List[ai.Preferencias]]:
+    cenarios: Dict[str, List[ai.Preferencias]] = {}
+    for regime in ("exato", "relaxado"):
+        cenarios[f"musico_{regime}"] = [_consulta_musico(rng, regime) for _ in range(args.consultas)]
+    for papeis in range(1, args.max_papeis + 1):
+        for regime in ("exato", "relaxado"):
+            cenarios[f"banda_{papeis}_{regime}"] = [
+                _consulta_banda(rng, regime, papeis) for _ in range(args.consultas_banda)
+            ]
+    return cenarios
+
+
+# --- domínios de banda ---------------------------------------------------------------------------
+# Só a construção dos domínios de uma banda de 3 papéis (BandCSPSolver._build_domains), sem a pesquisa:
+# é onde a poda de candidatos pelos índices invertidos se vê, e onde uma regressão dela aparece.
+
+
+def _correr_dominios(
+    matcher: ai.CSPMatcherFacade, consultas: List[ai.Preferencias], relax: bool, args: argparse.Namespace
+) -> Dict[str, Any]:
+    solver = ai.BandCSPSolver(matcher)
+    papeis = [[r for r in prefs.instrumentos_requeridos or [] if ai._normalize(r)] for prefs in consultas]
+
+    for prefs, roles in list(zip(consultas, papeis))[: args.aquecimento]:
+        solver._build_domains(roles, prefs, relax=relax)
+
+    tempos: List[float] = []
+    tamanhos: List[int] = []
+    for _ in range(args.repeticoes):
+        for prefs, roles in zip(consultas, papeis):
+            inicio = time.perf_counter()
+            dominios = solver._build_domains(roles, prefs, relax=relax)
+            tempos.append((time.perf_counter() - inicio) * 1000.0)
+            tamanhos.extend(len(d) for d in dominios.values())
+
+    medida: Dict[str, Any] = {"consultas": len(tempos)}
+    medida.update(_latencias(tempos))
+    medida["dominio_medio"] = round(sum(tamanhos) / len(tamanhos), 1) if tamanhos else 0
+    return medida
+
+
+# --- SimpleCSP ---------------------------------------------------------------------------------
+# A formação de banda como CSP (BandCSPSolver.como_csp) sem localização alvo: com "todos_igual" fica
+# uma constraint binária "perto do primeiro papel", que é onde a propagação poda domínios.
+
+ESTRATEGIAS_CSP: Dict[str, Dict[str, bool]] = {
+    "cronologico": {},
+    "forward_checking": {"propagar": True},
+    "arco_consistencia": {"propagar": True, "arco_consistencia": True},
+}
+
+
+def _consulta_csp(rng: random.Random, papeis: int) -> ai.Preferencias:
+    return ai.Preferencias(
+        caracteristicas=rng.sample(CARACTERISTICAS, 1),
+        instrumentos_requeridos=rng.sample(INSTRUMENTOS, papeis),
+    )
+
+
+def _correr_csp(matcher: ai.CSPMatcherFacade, consultas: List[ai.Preferencias], args: argparse.Namespace) -> Dict[str, Any]:
+    solver = ai.BandCSPSolver(matcher)
+    # os domínios são construídos fora da medição: só conta a pesquisa
+    csps = [solver.como_csp(prefs) for prefs in consultas]
+    tamanhos = [len(v.domain) for csp in csps for v in csp.variables]
+    medida: Dict[str, Any] = {"dominio_medio": round(sum(tamanhos) / len(tamanhos), 1) if tamanhos else 0}
+
+    for nome, opcoes in ESTRATEGIAS_CSP.items():
+        tempos: List[float] = []
+        nos = verificacoes = solucoes = 0
+        for _ in range(args.repeticoes):
+            for csp in csps:
+                inicio = time.perf_counter()
+                encontradas = csp.solve(max_solutions=args.csp_solucoes, **opcoes)
+                tempos.append((time.perf_counter() - inicio) * 1000.0)
+                nos += csp.nos
+                verificacoes += csp.verificacoes
+                solucoes += len(encontradas)
+        estrategia: Dict[str, Any] = _latencias(tempos)
+        estrategia["nos_medios"] = round(nos / len(tempos), 1)
+        estrategia["verificacoes_medias"] = round(verificacoes / len(tempos), 1)
+        estrategia["solucoes_medias"] = round(solucoes / len(tempos), 1)
+        medida[nome] = estrategia
+    return medida
+
+
+# --- medição -----------------------------------------------------------------------------------
+
+
+def _percentil(ordenados: List[float], p: float) -> float:
+    """Percentil pelo método do rank mais próximo; `ordenados` não pode estar vazio."""
+    k = max(0, min(len(ordenados) - 1, math.ceil(p / 100.0 * len(ordenados)) - 1))
+    return ordenados[k]
+
+
+def _latencias(tempos_ms: List[float]) -> Dict[str, float]:
+    ordenados = sorted(tempos_ms)
+    return {
+        "p50_ms": round(_percentil(ordenados, 50), 3),
+        "p90_ms": round(_percentil(ordenados, 90), 3),
+        "p99_ms": round(_percentil(ordenados, 99), 3),
+        "max_ms": round(ordenados[-1], 3),
+    }
+
+
+def _pico_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux devolve KiB, macOS devolve bytes
+    return round(pico / (1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0), 1)
+
+
+def _correr_cenario(
+    matcher: ai.CSPMatcherFacade, consultas: List[ai.Preferencias], args: argparse.Namespace
+) -> Dict[str, Any]:
+    banda = bool(consultas[0].instrumentos_requeridos)
+    tempos: List[float] = []
+    resultados = exatos = incompletos = 0
+
+    # a primeira volta aquece caches (similaridade, colunas, anos por instrumento) e não conta
+    for prefs in consultas[: args.aquecimento]:
+        matcher.resolver(prefs, max_resultados=args.max_resultados)
+
+    inicio_total = time.perf_counter()
+    for _ in range(args.repeticoes):
+        for prefs in consultas:
+            orcamento = ai.Orcamento(prazo_s=args.prazo_ms / 1000.0) if banda else None
+            inicio = time.perf_counter()
+            sugestoes = matcher.resolver(prefs, max_resultados=args.max_resultados, orcamento=orcamento)
+            tempos.append((time.perf_counter() - inicio) * 1000.0)
+            resultados += len(sugestoes)
+            exatos += sum(1 for s in sugestoes if s.get("exato"))
+            if orcamento is not None and not orcamento.completo:
+                incompletos += 1
+    total_s = time.perf_counter() - inicio_total
+
+    medida: Dict[str, Any] = {"consultas": len(tempos)}
+    medida.update(_latencias(tempos))
+    medida["consultas_por_s"] = round(len(tempos) / total_s, 2) if total_s > 0 else None
+    medida["resultados_medios"] = round(resultados / len(tempos), 2)
+    # confirma o regime: fração dos resultados que passaram nas constraints exatas
+    medida["fracao_exatos"] = round(exatos / resultados, 3) if resultados else None
+    if banda:
+        medida["incompletos"] = incompletos
+    return medida
+
+
+def _correr(n: int, args: argparse.Namespace) -> Dict[str, Any]:
+    resultados: Dict[str, Any] = {"musicos": n, "rss_inicial_mb": _pico_rss_mb()}
+    ai.MOTOR_SIMILARIDADE = args.similaridade
+
+    inicio = time.perf_counter()
+    matcher = ai.CSPMatcherFacade(musicos_sinteticos(n, seed=args.seed, gralhas=args.gralhas))
+    # inclui a geração do corpus sintético; a construção sozinha, repetida, fica em "indice"
+    resultados["indice_ms"] = round((time.perf_counter() - inicio) * 1000.0, 1)
+    resultados["rss_indice_mb"] = _pico_rss_mb()
+
+    rng = random.Random(args.seed + 1)
+    cenarios: Dict[str, Any] = {}
+    for nome, consultas in _cenarios(rng, args).items():
+        if args.filtro and args.filtro not in nome:
+            continue
+        cenarios[nome] = _correr_cenario(matcher, consultas, args)
+
+    # gerador à parte, para não mudar as consultas dos outros cenários
+    rng_dominios = random.Random(args.seed + 3)
+    for regime in ("exato", "relaxado"):
+        nome = f"dominios_3_{regime}"
+        consultas = [_consulta_banda(rng_dominios, regime, 3) for _ in range(args.consultas_banda)]
+        if args.filtro and args.filtro not in nome:
+            continue
+        cenarios[nome] = _correr_dominios(matcher, consultas, regime == "relaxado", args)
+
+    # gerador à parte, para não mudar as consultas dos outros cenários
+    rng_csp = random.Random(args.seed + 2)
+    # com domínios de milhares de candidatos a pesquisa cronológica demora minutos
+    papeis_csp = [int(p) for p in args.csp_papeis.split(",") if p.strip()] if n <= args.csp_max_musicos else []
+    for papeis in papeis_csp:
+        nome = f"csp_banda_{papeis}"
+        consultas = [_consulta_csp(rng_csp, papeis) for _ in range(args.consultas_banda)]
+        if args.filtro and args.filtro not in nome:
+            continue
+        cenarios[nome] = _correr_csp(matcher, consultas, args)
+    resultados["cenarios"] = cenarios
+    resultados["pico_rss_mb"] = _pico_rss_mb()
+
+    # no fim, depois de medido o pico de RSS: as repetições precisam do corpus inteiro em memória
+    if args.repeticoes_indice:
+        del matcher
+        musicos = list(musicos_sinteticos(n, seed=args.seed, gralhas=args.gralhas))
+        tempos: List[float] = []
+        for _ in range(args.repeticoes_indice):
+            inicio = time.perf_counter()
+            ai.CSPMatcherFacade(musicos)
+            tempos.append((time.perf_counter() - inicio) * 1000.0)
+        resultados["indice"] = _latencias(tempos)
+    return resultados
+
+
+def _correr_isolado(n: int, args: argparse.Namespace) -> Dict[str, Any]:
+    # "spawn" garante um processo limpo: o pico de RSS de um tamanho não contamina o seguinte
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(_correr, (n, args))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--musicos", default="1000,10000,100000", help="tamanhos do corpus, separados por vírgulas")
+    parser.add_argument("--consultas", type=int, default=50, help="consultas de músico por regime")
+    parser.add_argument("--consultas-banda", type=int, default=10, help="consultas de banda por regime e nº de papéis")
+    parser.add_argument("--max-papeis", type=int, default=6, choices=range(1, len(INSTRUMENTOS) + 1), metavar="N")
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument(
+        "--repeticoes-indice", type=int, default=3, help="construções do índice medidas por tamanho (0 desliga)"
+    )
+    parser.add_argument("--aquecimento", type=int, default=5, help="consultas por cenário corridas antes de medir")
+    parser.add_argument("--max-resultados", type=int, default=10)
+    parser.add_argument("--prazo-ms", type=float, default=2000.0, help="prazo de cada pesquisa de banda")
+    parser.add_argument("--gralhas", type=float, default=0.1, help="fração de textos do corpus com gralhas")
+    parser.add_argument("--csp-papeis", default="2,3,4", help="papéis dos cenários SimpleCSP (vazio desliga)")
+    parser.add_argument("--csp-max-musicos", type=int, default=10000, help="maior corpus com cenários SimpleCSP")
+    parser.add_argument("--csp-solucoes", type=int, default=1000, help="soluções pedidas a cada CSP de banda")
+    parser.add_argument("--similaridade", choices=sorted(ai.MOTORES_SIMILARIDADE), default=ai.MOTOR_SIMILARIDADE)
+    parser.add_argument("--filtro", default="", help="corre só os cenários cujo nome contém este texto")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--mesmo-processo", action="store_true", help="não isola cada tamanho num processo")
+    parser.add_argument("--saida", help="ficheiro JSON de saída (por omissão, stdout)")
+    args = parser.parse_args()
+
+    tamanhos = [int(n) for n in args.musicos.split(",") if n.strip()]
+    correr = _correr if args.mesmo_processo else _correr_isolado
+    relatorio = {
+        "seed": args.seed,
+        "python": platform.python_version(),
+        "numpy": getattr(ai.np, "__version__", None),
+        "maquina": platform.machine(),
+        "parametros": {k: v for k, v in vars(args).items() if k not in ("saida", "musicos")},
+        "resultados": [correr(n, args) for n in tamanhos],
+    }
+
+    texto = json.dumps(relatorio, ensure_ascii=False, indent=2)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    else:
+        print(texto)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1290 @@
+"""Testes do matcher (pytest): os caminhos rápidos contra implementações de referência simples.
+
+Os corpora são sintéticos e gerados com seed, por isso cada falha é reproduzível.
+"""
+
+import itertools
+import json
+import random
+from array import array
+from difflib import SequenceMatcher
+
+import pytest
+
+import ai
+
+INSTRUMENTOS = ["Guitarra", "guitarra", "Guitarrista", "Baixo", "baixista", "Bateria", "Piano", "Voz", "Cantora", "Guitara"]
+LOCALIZACOES = ["Lisboa", "lisboa", "Lisbo", "Porto", "Pôrto", "Setúbal", "Setubal", "Braga", "Faro", "Vila Real", "", None]
+CARACTERISTICAS = ["Pontual", "pontual", "Criativo", "Criatvo", "Rock", "Rok", "Jazz", "Pop", "Metal", "Fado", None]
+
+
+def _musicos(rng, n):
+    musicos = []
+    for i in range(n):
+        instrumentos = [
+            {"nome": rng.choice(INSTRUMENTOS), "anos_experiencia": rng.choice([None, 0, 1, 2, 3, 5, 7, "3", "x"])}
+            for _ in range(rng.randint(0, 3))
+        ]
+        musicos.append(
+            {
+                "id": i + 1,
+                "nome": f"Musico {i}",
+                "localizacao": rng.choice(LOCALIZACOES),
+                "caracteristicas": [rng.choice(CARACTERISTICAS) for _ in range(rng.randint(0, 4))],
+                "instrumentos": instrumentos,
+                "anos_experiencia": rng.choice([None, 1, 3, 5, "2"]),
+            }
+        )
+    return musicos
+
+
+def _preferencias(rng):
+    dados = {}
+    if rng.random() < 0.7:
+        dados["instrumento"] = rng.choice(INSTRUMENTOS + ["Saxofone"])
+    if rng.random() < 0.5:
+        dados["anos_experiencia"] = rng.randint(0, 8)
+    if rng.random() < 0.5:
+        dados["localizacao"] = rng.choice([l for l in LOCALIZACOES if l] + ["Narnia"])
+    if rng.random() < 0.5:
+        dados["caracteristicas"] = rng.sample(["Pontual", "Rock", "Criativo", "Jazz", "Pop"], rng.randint(1, 3))
+    if rng.random() < 0.2:
+        dados["excluir_ids"] = [rng.randint(1, 5)]
+    return ai._preferencias_from_payload(dados)
+
+
+def _resolver(matcher, prefs, k, min_vetorial, monkeypatch):
+    monkeypatch.setattr(ai.CSP1Solver, "MIN_VETORIAL", min_vetorial)
+    return matcher.resolver(prefs, max_resultados=k)
+
+
+def _referencia_1(matcher, prefs, k):
+    """CSP1Solver.solve escrito da forma mais direta: cada regime num percurso próprio, por ordem de entrada.
+
+    Os exatos se houver algum, senão os relaxados; os k melhores pelo score (empates pela ordem
+    de entrada).
+    """
+    solver = ai.CSP1Solver(matcher)
+    fora = set(matcher._posicoes_excluidas(prefs))
+    ativos = [p for i, p in enumerate(matcher.perfis) if p is not None and i not in fora]
+    for relax in (False, True):
+        candidatos = [p for p in ativos if matcher._satisfaz_constraints_1(p, prefs, relax)]
+        if candidatos or relax:
+            break
+    ordenados = sorted(candidatos, key=lambda p: -matcher._pontuacao_1(p, prefs)["score_total"])
+    return [solver._resultado(p, prefs, not relax) for p in ordenados[:k]]
+
+
+# --- pesquisa de 1 músico: caminho vetorial, escalar e referência ------------------------------
+
+
+@pytest.mark.skipif(ai.np is None, reason="o caminho vetorial precisa de numpy")
+@pytest.mark.parametrize("n", [0, 12, 120, 255, 256, 400, 800])
+def test_vetorial_escalar_e_referencia_iguais(n, monkeypatch):
+    rng = random.Random(n)
+    matcher = ai.CSPMatcherFacade(_musicos(rng, n))
+    regimes = set()
+    for _ in range(30):
+        prefs = _preferencias(rng)
+        k = rng.choice([1, 3, 10, 50])
+        referencia = _referencia_1(matcher, prefs, k)
+        assert _resolver(matcher, prefs, k, 0, monkeypatch) == referencia
+        assert _resolver(matcher, prefs, k, 10**9, monkeypatch) == referencia
+        # sem forçar nada, o corte de MIN_VETORIAL escolhe o caminho pelo tamanho do corpus
+        assert _resolver(matcher, prefs, k, 256, monkeypatch) == referencia
+        regimes.add(referencia[0]["exato"] if referencia else None)
+    if n >= 120:
+        assert regimes == {True, False, None}
+
+
+@pytest.mark.skipif(ai.np is None, reason="o caminho vetorial precisa de numpy")
+@pytest.mark.parametrize("min_vetorial", [0, 10**9])
+def test_regimes_exato_relaxado_e_vazio(min_vetorial, monkeypatch):
+    musicos = [
+        {"id": 1, "nome": "A", "localizacao": "Lisboa", "instrumentos": [{"nome": "Guitarra", "anos_experiencia": 5}]},
+        {"id": 2, "nome": "B", "localizacao": "Lisbo", "instrumentos": [{"nome": "Guitarra", "anos_experiencia": 3}]},
+        {"id": 3, "nome": "C", "localizacao": "Porto", "instrumentos": [{"nome": "Bateria", "anos_experiencia": 5}]},
+    ]
+    matcher = ai.CSPMatcherFacade(musicos)
+
+    def ids(dados):
+        prefs = ai._preferencias_from_payload(dados)
+        out = _resolver(matcher, prefs, 10, min_vetorial, monkeypatch)
+        assert out == _referencia_1(matcher, prefs, 10)
+        return [(r["id"], r["exato"]) for r in out]
+
+    assert ids({"instrumento": "Guitarra", "localizacao": "Lisboa", "anos_experiencia": 5}) == [(1, True)]
+    # ninguém cumpre as exatas: só então entram os relaxados
+    assert ids({"instrumento": "Guitarra", "localizacao": "Lisboa", "anos_experiencia": 4}) == [(1, False), (2, False)]
+    assert ids({"instrumento": "Saxofone"}) == []
+    assert ids({"localizacao": "Narnia"}) == []
+    assert ids({"instrumento": "Guitara"}) == [(1, False), (2, False)]
+    assert ids({"instrumento": "Guitarra", "excluir_ids": [1]}) == [(2, True)]
+
+
+@pytest.mark.skipif(ai.np is None, reason="o caminho vetorial precisa de numpy")
+@pytest.mark.parametrize("n", [40, 300])
+def test_empates_pela_ordem_de_entrada(n, monkeypatch):
+    # todos com o mesmo score: os k primeiros pela ordem em que foram carregados
+    musicos = [
+        {"id": 1000 - i, "nome": f"M{i}", "localizacao": "Porto", "instrumentos": [{"nome": "Baixo", "anos_experiencia": 2}]}
+        for i in range(n)
+    ]
+    matcher = ai.CSPMatcherFacade(musicos)
+    prefs = ai._preferencias_from_payload({"instrumento": "Baixo", "localizacao": "Porto"})
+    esperados = [1000 - i for i in range(7)]
+    for min_vetorial in (0, 10**9):
+        out = _resolver(matcher, prefs, 7, min_vetorial, monkeypatch)
+        assert [r["id"] for r in out] == esperados
+        assert out == _referencia_1(matcher, prefs, 7)
+
+
+@pytest.mark.parametrize(
+    "min_vetorial",
+    [pytest.param(0, marks=pytest.mark.skipif(ai.np is None, reason="o caminho vetorial precisa de numpy")), 10**9],
+)
+def test_todas_as_paginas_iguais_a_solve(min_vetorial, monkeypatch):
+    rng = random.Random(60 + min_vetorial % 7)
+    matcher = ai.CSPMatcherFacade(_musicos(rng, 300))
+    monkeypatch.setattr(ai.CSP1Solver, "MIN_VETORIAL", min_vetorial)
+    pontuacoes = []
+    pontuacao = ai.Matcher._pontuacao_1
+    monkeypatch.setattr(ai.Matcher, "_pontuacao_1", lambda self, *a: pontuacoes.append(1) or pontuacao(self, *a))
+    totais = []
+    for _ in range(12):
+        prefs = _preferencias(rng)
+        ranking = ai.CSP1Solver(matcher).ranking(prefs)
+        totais.append(ranking.total)
+        pontuacoes.clear()
+        paginas, inicio = [], 0
+        while True:
+            pagina = ranking.pagina(inicio, rng.choice([1, 3, 7, 40]))
+            if not pagina:
+                break
+            paginas += pagina
+            inicio += len(pagina)
+        assert inicio == ranking.total
+        # depois de construído o ranking, cada score só volta a ser calculado para montar o resultado
+        assert len(pontuacoes) == ranking.total
+        assert paginas == ai.CSP1Solver(matcher).solve(prefs, ranking.total)
+    assert max(totais) > 40
+
+
+# --- exato e relaxado num só percurso -----------------------------------------------------------
+
+
+def _preferencias_banda(rng):
+    dados = {
+        "instrumentos_requeridos": rng.sample(["Bateria", "Baixo", "Guitarra", "Voz", "Piano"], rng.randint(1, 3)),
+        "politica_localizacao_banda": rng.choice(["todos_igual", "livre"]),
+    }
+    if rng.random() < 0.5:
+        dados["requisitos_por_instrumento"] = {
+            "bateria": {"anos_experiencia": rng.randint(0, 5)},
+            "baixo": {"caracteristicas": ["Rock"]},
+        }
+    if rng.random() < 0.5:
+        dados["anos_experiencia"] = rng.randint(0, 8)
+    if rng.random() < 0.5:
+        dados["localizacao"] = rng.choice([l for l in LOCALIZACOES if l])
+    if rng.random() < 0.5:
+        dados["caracteristicas"] = rng.sample(["Pontual", "Rock", "Criativo", "Jazz"], rng.randint(1, 2))
+    return ai._preferencias_from_payload(dados)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_classificacao_num_percurso_igual_aos_dois_regimes(seed):
+    rng = random.Random(100 + seed)
+    matcher = ai.CSPMatcherFacade(_musicos(rng, 80))
+    for _ in range(20):
+        prefs = _preferencias(rng)
+        for perfil in matcher.ativos():
+            assert matcher._classificar_1(perfil, prefs) == (
+                matcher._satisfaz_constraints_1(perfil, prefs, relax=False),
+                matcher._satisfaz_constraints_1(perfil, prefs, relax=True),
+            )
+            if prefs.caracteristicas:
+                exatas, _t, _r = matcher._caracteristicas_match(perfil, prefs.caracteristicas, relax=False)
+                relaxadas, total, _r = matcher._caracteristicas_match(perfil, prefs.caracteristicas, relax=True)
+                assert matcher._contagens_caracteristicas(perfil, prefs.caracteristicas) == (exatas, relaxadas, total)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_banda_num_percurso_igual_a_repetir_a_pesquisa(seed):
+    """BandCSPSolver.solve contra a forma antiga: a pesquisa exata e, sem bandas, outra relaxada do zero."""
+    rng = random.Random(200 + seed)
+    matcher = ai.CSPMatcherFacade(_musicos(rng, 40))
+    regimes = set()
+    for _ in range(15):
+        prefs = _preferencias_banda(rng)
+        k = rng.choice([1, 3, 10])
+        papeis = list(prefs.instrumentos_requeridos)
+        referencia = ai.BandCSPSolver(matcher)._solve_with_relax(prefs, papeis, relax=False, max_solutions=k)
+        if not referencia:
+            referencia = ai.BandCSPSolver(matcher)._solve_with_relax(prefs, papeis, relax=True, max_solutions=k)
+        assert matcher.resolver(prefs, max_resultados=k) == referencia
+        regimes.add(referencia[0]["exato"] if referencia else None)
+    assert False in regimes
+
+
+# --- motores de similaridade contra _safe_ratio ---------------------------------------------------
+
+PALAVRAS = [
+    "Guitarrista", "Baixista", "Bateria", "Acordeão", "Violoncelo", "Cavaquinho", "Saxofone", "Voz",
+    "Lisboa", "Pôrto", "Setúbal", "Évora", "Guimarães", "São João da Madeira", "Vila Nova de Gaia",
+    "Póvoa de Varzim", "Açores", "Oliveira de Azeméis", "Pontualidade", "Criatividade", "Improvisação",
+    "Coração", "Ritmo", "Fado", "Música Popular", "Hip-Hop", "Rock & Roll", "",
+]
+LIMIARES = (0.75, 0.78, 0.85, 0.95)
+
+
+def _gralha(rng, texto):
+    """Uma a três gralhas: apagar, trocar, inserir, transpor, ou acentos/maiúsculas diferentes."""
+    letras = "abcdefghijklmnopqrstuvwxyzáàâãçéêíóôõú "
+    for _ in range(rng.randint(1, 3)):
+        i = rng.randrange(len(texto) + 1)
+        tipo = rng.randrange(6)
+        if tipo == 0 and i < len(texto):
+            texto = texto[:i] + texto[i + 1 :]
+        elif tipo == 1 and i < len(texto):
+            texto = texto[:i] + rng.choice(letras) + texto[i + 1 :]
+        elif tipo == 2:
+            texto = texto[:i] + rng.choice(letras) + texto[i:]
+        elif tipo == 3 and i + 1 < len(texto):
+            texto = texto[:i] + texto[i + 1] + texto[i] + texto[i + 2 :]
+        elif tipo == 4:
+            texto = texto.upper() if rng.random() < 0.5 else texto.lower()
+        else:
+            texto = texto.replace("a", "ã").replace("c", "ç") if rng.random() < 0.5 else ai._normalize(texto)
+    return texto
+
+
+def _termos(rng, n):
+    termos = []
+    for _ in range(n):
+        sorte = rng.random()
+        if sorte < 0.6:
+            termos.append(_gralha(rng, rng.choice(PALAVRAS)))
+        elif sorte < 0.9:
+            termos.append(rng.choice(PALAVRAS))
+        else:
+            termos.append("".join(rng.choice("aeiouãçé srtnl") for _ in range(rng.randint(0, 12))))
+    return termos
+
+
+def _lcs_referencia(a, b):
+    linha = [0] * (len(b) + 1)
+    for ca in a:
+        anterior = 0
+        for j, cb in enumerate(b):
+            atual = linha[j + 1]
+            linha[j + 1] = anterior + 1 if ca == cb else max(linha[j + 1], linha[j])
+            anterior = atual
+    return linha[-1]
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_indel_contra_safe_ratio(seed):
+    """A Indel é 2·LCS/(|a|+|b|): igual ao _safe_ratio quando os blocos do difflib chegam ao LCS, nunca abaixo."""
+    rng = random.Random(300 + seed)
+    motor = ai.SimilaridadeIndel()
+    iguais = 0
+    for _ in range(150):
+        termo = rng.choice(_termos(rng, 3))
+        termos = [ai._normalize(t) for t in _termos(rng, 20)]
+        a = ai._normalize(termo)
+        for t, r in zip(termos, motor.vetor(a, termos, de=True)):
+            referencia = ai._safe_ratio(termo, t)
+            lcs = _lcs_referencia(a, t)
+            assert r == (2.0 * lcs / (len(a) + len(t)) if a and t else 0.0)
+            assert r >= referencia - 1e-12
+            blocos = sum(b.size for b in SequenceMatcher(None, a, t).get_matching_blocks())
+            if blocos == lcs:
+                assert r == pytest.approx(referencia, abs=1e-12)
+                iguais += 1
+    assert iguais > 0
+
+
+@pytest.mark.parametrize("com_numpy", [True, False])
+@pytest.mark.parametrize("seed", range(3))
+def test_prefiltro_nunca_rejeita_o_que_safe_ratio_aceita(seed, com_numpy, monkeypatch):
+    if com_numpy and ai.np is None:
+        pytest.skip("sem numpy")
+    if not com_numpy:
+        monkeypatch.setattr(ai, "np", None)
+    rng = random.Random(400 + seed)
+    motor = ai.SimilaridadePrefiltro()
+    termos_brutos = _termos(rng, 300)
+    termos = [ai._normalize(t) for t in termos_brutos]
+    aceites = {limiar: 0 for limiar in LIMIARES}
+    for _ in range(80):
+        termo = rng.choice(termos_brutos + _termos(rng, 5))
+        alvo = ai._normalize(termo)
+        for de in (True, False):
+            vetor = motor.vetor(alvo, termos, de=de)
+            for t, r in zip(termos_brutos, vetor):
+                referencia = ai._safe_ratio(termo, t) if de else ai._safe_ratio(t, termo)
+                for limiar in LIMIARES:
+                    if referencia >= limiar:
+                        aceites[limiar] += 1
+                        assert r == referencia
+                # abaixo do piso o prefiltro pode devolver 0.0, mas nunca um valor diferente
+                assert r in (0.0, referencia)
+    assert all(aceites.values())
+
+
+# --- características: bitsets contra o emparelhamento guloso --------------------------------------
+
+
+def _guloso(perfil, desejadas, relax):
+    """O emparelhamento de antes dos bitsets: cada desejada fica com a melhor existente ainda livre."""
+    limiar = 0.75 if relax else 0.85
+    usados = set()
+    for wanted in (ai._normalize(c) for c in desejadas if c):
+        melhor, melhor_idx = 0.0, None
+        for idx, existente in enumerate(perfil.caracteristicas):
+            r = ai._safe_ratio(wanted, existente)
+            if idx not in usados and r > melhor:
+                melhor, melhor_idx = r, idx
+        if melhor_idx is not None and melhor >= limiar:
+            usados.add(melhor_idx)
+    return len(usados)
+
+
+def _contagens(matcher, perfil, desejadas):
+    total = len([c for c in desejadas if c])
+    exatas = matcher._caracteristicas_match(perfil, desejadas, relax=False)
+    relaxadas = matcher._caracteristicas_match(perfil, desejadas, relax=True)
+    assert exatas[1] == relaxadas[1] == total
+    assert matcher._contagens_caracteristicas(perfil, desejadas) == (exatas[0], relaxadas[0], total)
+    assert (exatas[0], relaxadas[0]) == (_guloso(perfil, desejadas, False), _guloso(perfil, desejadas, True))
+    return exatas[0], relaxadas[0]
+
+
+def test_caracteristicas_casos():
+    assert ai._safe_ratio("Rock", "Rockes") == pytest.approx(0.8)
+    musicos = [
+        {"id": 1, "caracteristicas": ["Rock"]},
+        {"id": 2, "caracteristicas": ["Rock", "rock"]},
+        {"id": 3, "caracteristicas": ["Criativo"]},
+        {"id": 4, "caracteristicas": ["Rockes", "Jazz"]},
+        {"id": 5, "caracteristicas": ["Rok", "Rock"]},
+        {"id": 6, "caracteristicas": []},
+    ]
+    matcher = ai.CSPMatcherFacade(musicos)
+    perfil = {p.id: p for p in matcher.ativos()}
+
+    # desejadas repetidas: cada uma precisa da sua existente
+    assert _contagens(matcher, perfil[1], ["Rock", "Rock"]) == (1, 1)
+    assert _contagens(matcher, perfil[2], ["Rock", "Rock"]) == (2, 2)
+    # uma existente que serve duas desejadas só conta uma vez
+    assert _contagens(matcher, perfil[3], ["Criativo", "Criatvo"]) == (1, 1)
+    # sinónimos: "Rockes" (0.8) só chega ao limiar relaxado, "Rok" (0.857) chega aos dois
+    assert _contagens(matcher, perfil[4], ["Rock"]) == (0, 1)
+    assert _contagens(matcher, perfil[4], ["Rock", "Jazz"]) == (1, 2)
+    assert _contagens(matcher, perfil[5], ["Rock", "Rok"]) == (2, 2)
+    assert _contagens(matcher, perfil[5], ["Rok", "Rock"]) == (2, 2)
+    # desejadas fora do vocabulário: sem match, ou com match por semelhança a um termo que existe
+    assert _contagens(matcher, perfil[4], ["Xilofonista"]) == (0, 0)
+    assert _contagens(matcher, perfil[4], ["Jaz"]) == (1, 1)
+    assert _contagens(matcher, perfil[6], ["Rock", ""]) == (0, 0)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_caracteristicas_bitsets_iguais_ao_guloso(seed):
+    rng = random.Random(500 + seed)
+    termos = ["Rock", "rock", "Rok", "Rockes", "Jazz", "Jaz", "Pontual", "Pontualidade", "Criativo", "Criatvo", "Fado", ""]
+    musicos = [{"id": i, "caracteristicas": [rng.choice(termos) for _ in range(rng.randint(0, 6))]} for i in range(60)]
+    matcher = ai.CSPMatcherFacade(musicos)
+    caminhos = set()
+    for _ in range(40):
+        desejadas = [rng.choice(termos + ["Xilofonista", "Criatividade"]) for _ in range(rng.randint(1, 5))]
+        _mascaras, partilhados = matcher.vocab.caracteristicas.expandir(
+            tuple(ai._normalize(c) for c in desejadas if c)
+        )
+        for perfil in matcher.ativos():
+            _contagens(matcher, perfil, desejadas)
+            caminhos.add(bool(perfil.carac_bits & partilhados))
+    # passam tanto pelo atalho dos bitsets como pelo guloso
+    assert caminhos == {True, False}
+
+
+# --- modo servidor -------------------------------------------------------------------------------
+
+
+def test_servidor_responde_com_a_mesma_forma_que_o_cli():
+    """O Event de cancelamento do servidor não pode mudar a resposta (p.ex. com um bloco "pesquisa")."""
+    import threading
+
+    rng = random.Random(600)
+    musicos = _musicos(rng, 50)
+    servidor = ai.ServidorMatcher(musicos, cache=ai.CacheResultados(0))
+    matcher = ai.CSPMatcherFacade(musicos)
+    pedidos = [
+        {"op": "match", "preferencias": {"instrumento": "Guitarra"}},
+        {"op": "match", "preferencias": {"instrumentos_requeridos": ["Guitarra", "Baixo"]}},
+        {"op": "match", "consultas": [{"instrumento": "Voz"}, {"instrumentos_requeridos": ["Bateria"]}]},
+    ]
+    for pedido in pedidos:
+        resposta = servidor.processar(pedido, threading.Event())
+        resposta.pop("total", None)
+        assert resposta == ai._resposta_pedido(matcher, pedido)
+
+    com_prazo = {"op": "match", "preferencias": {"instrumentos_requeridos": ["Voz"]}, "orcamento": {"prazo_ms": 5000}}
+    assert servidor.processar(com_prazo, threading.Event())["pesquisa"]["completo"] is True
+
+
+# --- banda: atribuição (húngaro + Murty) contra o backtrack -------------------------------------
+
+CIDADES = ["Lisboa", "Sintra", "Amadora", "Porto", "Vila Nova de Gaia", "Braga", "Faro", "Lisbo"]
+
+
+def _musicos_banda(rng, n, n_baixo=None):
+    """Perfis com poucos valores diferentes, para haver muitos empates de score.
+
+    Com `n_baixo`, só os primeiros `n_baixo` tocam baixo: o domínio do baixo fica com esse tamanho
+    nas pesquisas sem localização alvo.
+    """
+    musicos = []
+    for i in range(n):
+        if n_baixo is None:
+            nomes = rng.sample(["Guitarra", "Baixo", "Bateria", "Voz"], rng.randint(1, 2))
+        elif i < n_baixo:
+            nomes = ["Baixo"]
+        else:
+            nomes = rng.sample(["Guitarra", "Bateria"], rng.randint(1, 2))
+        musicos.append(
+            {
+                "id": i + 1,
+                "nome": f"Musico {i}",
+                "localizacao": rng.choice(CIDADES),
+                "caracteristicas": rng.sample(["Rock", "Jazz", "Pontual"], rng.randint(0, 2)),
+                "instrumentos": [{"nome": nome, "anos_experiencia": rng.choice([2, 3, 5])} for nome in nomes],
+            }
+        )
+    return musicos
+
+
+def _preferencias_atribuicao(rng, papeis=None):
+    dados = {
+        "instrumentos_requeridos": papeis or rng.sample(["Guitarra", "Baixo", "Bateria", "Voz"], rng.randint(2, 3)),
+        "politica_localizacao_banda": rng.choice(["todos_igual", "mesma_regiao", "livre"]),
+    }
+    if rng.random() < 0.4:
+        dados["localizacao"] = rng.choice(CIDADES)
+    if rng.random() < 0.5:
+        dados["caracteristicas"] = rng.sample(["Rock", "Jazz", "Pontual"], rng.randint(1, 2))
+    if rng.random() < 0.3:
+        dados["anos_experiencia"] = rng.choice([2, 3, 5])
+    return ai._preferencias_from_payload(dados)
+
+
+def _backtrack_e_atribuicao(matcher, prefs, relax, k):
+    """As bandas do backtrack de _PesquisaBanda e as de _AtribuicaoBanda, com os mesmos domínios."""
+    solver = ai.BandCSPSolver(matcher)
+    roles = [r for r in prefs.instrumentos_requeridos if ai._normalize(r)]
+    domains = solver._build_domains(roles, prefs, relax=relax)
+    pontuacoes = {}
+    backtrack = ai._PesquisaBanda(solver, prefs, roles, relax, k, domains, pontuacoes)
+    atribuicao = ai._PesquisaBanda(solver, prefs, roles, relax, k, domains, pontuacoes)
+    if not backtrack.viavel or not ai._AtribuicaoBanda.aplicavel(atribuicao):
+        return None
+    esperado = solver._bandas(backtrack.executar().ordenados(), prefs, relax)
+    return esperado, solver._bandas(ai._AtribuicaoBanda(atribuicao).executar(), prefs, relax)
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_atribuicao_igual_ao_backtrack(seed):
+    rng = random.Random(700 + seed)
+    matcher = ai.CSPMatcherFacade(_musicos_banda(rng, 45))
+    vistos = {"politicas": set(), "empates": 0, "varias": 0}
+    for _ in range(25):
+        prefs = _preferencias_atribuicao(rng)
+        for relax in (False, True):
+            k = rng.choice([1, 2, 5, 12])
+            par = _backtrack_e_atribuicao(matcher, prefs, relax, k)
+            if par is None:
+                continue
+            esperado, obtido = par
+            assert obtido == esperado
+            if esperado:
+                vistos["politicas"].add(prefs.politica_localizacao_banda)
+                scores = [b["score"] for b in esperado]
+                vistos["empates"] += len(scores) != len(set(scores))
+                vistos["varias"] += len(esperado) > 1
+    assert vistos["politicas"] == {"todos_igual", "mesma_regiao", "livre"}
+    assert vistos["empates"] and vistos["varias"]
+
+
+@pytest.mark.parametrize("n_baixo", [199, 201])
+def test_atribuicao_no_corte_de_200(n_baixo, monkeypatch):
+    """solve() à volta de MIN_CANDIDATOS_ATRIBUICAO: o mesmo resultado que só com o backtrack."""
+    assert ai.BandCSPSolver.MIN_CANDIDATOS_ATRIBUICAO == 200
+    rng = random.Random(800 + n_baixo)
+    matcher = ai.CSPMatcherFacade(_musicos_banda(rng, n_baixo + 600, n_baixo=n_baixo))
+
+    usadas = []
+    executar = ai._AtribuicaoBanda.executar
+
+    def espiar(self, orcamento=None):
+        usadas.append(len(self.ids[0]))
+        return executar(self, orcamento)
+
+    monkeypatch.setattr(ai._AtribuicaoBanda, "executar", espiar)
+    for politica in ("todos_igual", "mesma_regiao", "livre"):
+        # sem anos, os scores empatam todos; ninguém tem 4 anos, por isso com 4 tudo vem do relaxamento,
+        # com scores diferentes e os mesmos domínios
+        for anos in (None, 4):
+            prefs = ai._preferencias_from_payload(
+                {
+                    "instrumentos_requeridos": ["Baixo", "Guitarra", "Bateria"],
+                    "politica_localizacao_banda": politica,
+                    "anos_experiencia": anos,
+                }
+            )
+            k = 4
+            obtido = matcher.resolver(prefs, max_resultados=k)
+            with monkeypatch.context() as m:
+                m.setattr(ai.BandCSPSolver, "MIN_CANDIDATOS_ATRIBUICAO", 10**9)
+                esperado = matcher.resolver(prefs, max_resultados=k)
+            assert len(obtido) == k and obtido[0]["exato"] is (anos is None)
+            assert obtido == esperado
+    # o primeiro papel (o menor domínio) é o baixo
+    assert usadas == ([] if n_baixo < 200 else [n_baixo] * 6)
+
+
+# --- snapshot binário -----------------------------------------------------------------------------
+
+
+def _iguais_ao_construido(carregado, musicos, rng, monkeypatch):
+    """Pesquisas de 1 músico (pelos dois caminhos) e de banda iguais às de um matcher construído de novo."""
+    novo = ai.CSPMatcherFacade(musicos)
+    assert len(carregado) == len(novo)
+    caminhos = (0, 10**9) if ai.np is not None else (10**9,)
+    for _ in range(15):
+        prefs = _preferencias(rng)
+        for min_vetorial in caminhos:
+            monkeypatch.setattr(ai.CSP1Solver, "MIN_VETORIAL", min_vetorial)
+            assert carregado.resolver(prefs, max_resultados=8) == novo.resolver(prefs, max_resultados=8)
+        banda = _preferencias_banda(rng)
+        assert carregado.resolver(banda, max_resultados=3) == novo.resolver(banda, max_resultados=3)
+
+
+@pytest.mark.parametrize("seed", range(2))
+def test_snapshot_ida_e_volta(seed, tmp_path, monkeypatch):
+    rng = random.Random(900 + seed)
+    musicos = _musicos(rng, 150)
+    caminho = str(tmp_path / "corpus.snap")
+    assert ai.guardar_snapshot(ai.CSPMatcherFacade(musicos), caminho) == 150
+    carregado = ai.CSPMatcherFacade.de_snapshot(caminho)
+    _iguais_ao_construido(carregado, musicos, rng, monkeypatch)
+
+    # alterações por cima do snapshot: as posições e a ordem ficam como num matcher incremental
+    por_id = {m["id"]: m for m in musicos}
+    for ronda in range(3):
+        novos = _musicos(rng, 20)
+        for i, m in enumerate(novos):
+            m["id"] = rng.choice(list(por_id)) if i % 2 else 1000 * (ronda + 1) + i
+        removidos = rng.sample(list(por_id), 10)
+        carregado.atualizar(novos)
+        carregado.remover(removidos)
+        for m in novos:
+            por_id[m["id"]] = m
+        for chave in removidos:
+            por_id.pop(chave, None)
+        _iguais_ao_construido(carregado, list(por_id.values()), rng, monkeypatch)
+
+    # e um snapshot de um matcher com posições vazias volta a dar o mesmo
+    assert ai.guardar_snapshot(carregado, caminho) == len(por_id)
+    _iguais_ao_construido(ai.CSPMatcherFacade.de_snapshot(caminho), list(por_id.values()), rng, monkeypatch)
+
+
+def test_snapshot_truncado_ou_corrompido(tmp_path):
+    caminho = tmp_path / "corpus.snap"
+    ai.guardar_snapshot(ai.CSPMatcherFacade(_musicos(random.Random(950), 40)), str(caminho))
+    bom = caminho.read_bytes()
+    snap = ai.Snapshot(str(caminho))
+    fim_dados = max(
+        snap._base + offset + contagem * array(formato).itemsize
+        for formato, offset, contagem in snap.cabecalho["secoes"].values()
+    )
+    del snap
+
+    def abrir(dados):
+        caminho.write_bytes(dados)
+        with pytest.raises(ValueError, match="snapshot"):
+            ai.CSPMatcherFacade.de_snapshot(str(caminho))
+
+    for corte in sorted({0, 4, 8, 12, 16, 40, fim_dados // 2, fim_dados - 1} | set(range(0, fim_dados, 97))):
+        abrir(bom[:corte])
+    abrir(b"XXSNAP01" + bom[8:])
+    # cabeçalho com lixo, ou com o tamanho errado
+    abrir(bom[:16] + bom[16:40].replace(b'"', b"\xff") + bom[40:])
+    abrir(bom[:8] + (len(bom) * 2).to_bytes(8, "little") + bom[16:])
+    abrir(bom.replace(b'"idx_loc_pos"', b'"idx_loc_xxx"', 1))
+
+    # no servidor, um snapshot estragado é um erro do pedido e o corpus anterior fica
+    servidor = ai.ServidorMatcher([{"id": 1, "instrumentos": [{"nome": "Voz"}]}])
+    resposta = servidor.processar_linha(json.dumps({"op": "carregar", "snapshot": str(caminho)}))
+    assert "snapshot" in json.loads(resposta)["erro"]
+    assert len(servidor.matcher) == 1
+
+
+# --- cache de resultados --------------------------------------------------------------------------
+
+
+def test_cache_chave_canonica():
+    matcher = ai.CSPMatcherFacade(_musicos(random.Random(1000), 80))
+    vocab = matcher.vocab.caracteristicas
+
+    def chave(dados, k=10):
+        return ai._chave_preferencias(ai._preferencias_from_payload(dados), k, vocab)
+
+    base = {
+        "instrumento": "Guitarra",
+        "localizacao": "Lisboa",
+        "caracteristicas": ["Rock", "Pontual", "Jazz"],
+        "raio_km": 30,
+        "excluir_ids": [3, 1],
+    }
+    for igual in (
+        {**base, "caracteristicas": ["Pontual", "jazz", "ROCK"]},
+        {**base, "instrumento": "guitarra", "localizacao": "LISBOA"},
+        {**base, "excluir_ids": ["1", 3, 3]},
+    ):
+        assert chave(igual) == chave(base)
+    for diferente in (
+        {**base, "raio_km": 10},
+        {**base, "raio_km": None},
+        {**base, "excluir_ids": [1]},
+        {**base, "excluir_ids": []},
+        {**base, "caracteristicas": ["Rock", "Pontual"]},
+        {**base, "caracteristicas": ["Rock", "Pontual", "Jazz", "Jazz"]},
+    ):
+        assert chave(diferente) != chave(base)
+    assert chave(base, k=5) != chave(base)
+    # "Rok" serve a "Rock" e a "Rok": o guloso pode depender da ordem, por isso a ordem conta
+    assert chave({"caracteristicas": ["Rock", "Rok"]}) != chave({"caracteristicas": ["Rok", "Rock"]})
+
+
+def _match(servidor, preferencias, **campos):
+    pedido = {"op": "match", "preferencias": preferencias, **campos}
+    resposta = servidor.processar(pedido)
+    resposta.pop("total", None)
+    assert resposta == ai._resposta_pedido(servidor.matcher, pedido)
+    return resposta
+
+
+def test_cache_acertos_e_falhas():
+    musicos = _musicos(random.Random(1001), 80)
+    servidor = ai.ServidorMatcher(musicos, cache=ai.CacheResultados())
+    cache = servidor.cache
+
+    def acerta(preferencias, **campos):
+        antes = cache.hits
+        _match(servidor, preferencias, **campos)
+        return cache.hits > antes
+
+    base = {"instrumento": "Guitarra", "caracteristicas": ["Rock", "Pontual"], "raio_km": 30, "localizacao": "Lisboa"}
+    assert not acerta(base)
+    assert acerta({**base, "caracteristicas": ["PONTUAL", "rock"], "instrumento": "guitarra"})
+    assert not acerta({**base, "raio_km": 50})
+    assert not acerta({**base, "excluir_ids": [1]})
+    assert not acerta(base, max_resultados=3)
+    assert acerta(base)
+
+    # a banda em cache responde com os papéis escritos como neste pedido
+    banda = {"instrumentos_requeridos": ["Guitarra", "Baixo"], "politica_localizacao_banda": "livre"}
+    assert not acerta(banda)
+    assert acerta({**banda, "instrumentos_requeridos": ["guitarra", "BAIXO"]})
+
+    # qualquer alteração ao corpus muda a versão; reenviar um perfil igual não muda
+    servidor.processar({"op": "atualizar", "musicos": [musicos[0]]})
+    assert acerta(base)
+    servidor.processar({"op": "atualizar", "musicos": [dict(musicos[0], localizacao="Braga")]})
+    assert not acerta(base) and acerta(base)
+    servidor.processar({"op": "remover", "ids": [musicos[1]["id"]]})
+    assert not acerta(base) and acerta(base)
+    servidor.processar({"op": "remover", "ids": ["nao-existe"]})
+    assert acerta(base)
+
+
+def test_cache_expira_pelo_ttl(monkeypatch):
+    agora = [1000.0]
+    monkeypatch.setattr(ai.time, "monotonic", lambda: agora[0])
+    cache = ai.CacheResultados(max_entradas=2, ttl_s=60.0)
+    cache.guardar(1, "a", {"resultados": []})
+    agora[0] += 59.0
+    assert cache.obter(1, "a") == {"resultados": []}
+    agora[0] += 2.0
+    assert cache.obter(1, "a") is None
+    assert cache.info()["tamanho"] == 0
+    # LRU: a mais antiga sai quando se passa do máximo
+    for chave in "bcd":
+        cache.guardar(1, chave, chave)
+    assert [cache.obter(1, c) for c in "bcd"] == [None, "c", "d"]
+
+
+def test_cache_nao_guarda_pesquisas_canceladas():
+    import threading
+
+    musicos = _musicos_banda(random.Random(1002), 60)
+    servidor = ai.ServidorMatcher(musicos, cache=ai.CacheResultados())
+    pedido = {
+        "op": "match",
+        # com 50 bandas o backtrack passa dos 64 nós, onde o cancelamento é visto
+        "max_resultados": 50,
+        "preferencias": {"instrumentos_requeridos": ["Guitarra", "Baixo", "Voz"]},
+        # um prazo que nunca chega a acabar, só para a resposta dizer se a pesquisa foi completa
+        "orcamento": {"prazo_ms": 600000},
+    }
+    cancelado = threading.Event()
+    cancelado.set()
+    cortada = servidor.processar(pedido, cancelado)
+    assert cortada["pesquisa"]["completo"] is False
+    assert servidor.cache.info()["tamanho"] == 0
+
+    completa = servidor.processar(pedido, threading.Event())
+    completa.pop("total")
+    assert completa == ai._resposta_pedido(servidor.matcher, pedido)
+    assert completa["pesquisa"]["completo"] is True and len(completa["resultados"]) == 50
+    assert servidor.cache.info() | {"taxa_acerto": None} == {
+        "hits": 0, "misses": 2, "tamanho": 1, "maximo": 256, "taxa_acerto": None,
+    }
+
+
+class _CanceladoNaConsulta:
+    """Um Event que o cliente põe entre a (n-1)-ésima e a n-ésima vez que a pesquisa o consulta."""
+
+    def __init__(self, n):
+        self.n = n
+        self.consultas = 0
+
+    def is_set(self):
+        self.consultas += 1
+        return self.consultas >= self.n
+
+
+@pytest.mark.parametrize(
+    "min_vetorial",
+    [pytest.param(0, marks=pytest.mark.skipif(ai.np is None, reason="o caminho vetorial precisa de numpy")), 10**9],
+)
+def test_pesquisa_de_1_musico_cancelavel(min_vetorial, monkeypatch):
+    import threading
+
+    monkeypatch.setattr(ai.CSP1Solver, "MIN_VETORIAL", min_vetorial)
+    servidor = ai.ServidorMatcher(_musicos(random.Random(1004), 600), cache=ai.CacheResultados())
+    pontuacoes = []
+    pontuacao = ai.Matcher._pontuacao_1
+    monkeypatch.setattr(ai.Matcher, "_pontuacao_1", lambda self, *a: pontuacoes.append(1) or pontuacao(self, *a))
+    pedido = {
+        "op": "match",
+        "max_resultados": 5,
+        "preferencias": {"instrumento": "Guitarra", "caracteristicas": ["Rock"]},
+        "orcamento": {"prazo_ms": 600000},
+    }
+    paginado = {**pedido, "paginar": True}
+
+    for p in (pedido, paginado):
+        # sem cancelar: quantas vezes a pesquisa consulta o Event, e quantos scores calcula
+        nunca = _CanceladoNaConsulta(10**9)
+        pontuacoes.clear()
+        completa = servidor.processar(p, nunca)
+        assert completa["resultados"]
+        consultas, pontuadas = nunca.consultas, len(pontuacoes)
+        # os passos do caminho vetorial, ou a pesquisa e a ordenação a cada 64 candidatos no escalar
+        assert consultas >= (2 if ai.CSP1Solver.MIN_VETORIAL == 0 else 5)
+        servidor.cache.limpar()
+        servidor.cursores.limpar()
+
+        for n in sorted({1, 2, consultas // 2, consultas}):
+            pontuacoes.clear()
+            cortada = servidor.processar(p, _CanceladoNaConsulta(n))
+            assert cortada["resultados"] == [] and "cursor" not in cortada
+            assert cortada.get("pesquisa", {"completo": False})["completo"] is False
+            assert len(pontuacoes) < pontuadas
+            assert servidor.cache.info()["tamanho"] == servidor.cursores.info()["tamanho"] == 0
+
+        depois = servidor.processar(p, threading.Event())
+        assert ("cursor" in depois) == ("cursor" in completa)
+        depois.pop("cursor", None)
+        completa.pop("cursor", None)
+        assert depois == completa
+
+
+# --- pesquisa de banda paralela -------------------------------------------------------------------
+
+
+@pytest.mark.parametrize("seed", range(2))
+def test_banda_paralela_igual_a_serie(seed, monkeypatch):
+    # abaixo do corte da atribuição, para ser mesmo o backtrack repartido por processos
+    monkeypatch.setattr(ai.BandCSPSolver, "MIN_CANDIDATOS_PARALELO", 4)
+    rng = random.Random(1100 + seed)
+    matcher = ai.CSPMatcherFacade(_musicos_banda(rng, 120))
+    paralelas = []
+    executar_paralelo = ai._PesquisaBanda.executar_paralelo
+
+    def espiar(self, workers, orcamento=None):
+        paralelas.append(workers)
+        return executar_paralelo(self, workers, orcamento)
+
+    monkeypatch.setattr(ai._PesquisaBanda, "executar_paralelo", espiar)
+    for _ in range(6):
+        prefs = _preferencias_atribuicao(rng)
+        k = rng.choice([1, 5, 20])
+        serie = matcher.resolver(prefs, max_resultados=k)
+        assert matcher.resolver(prefs, max_resultados=k, workers=3) == serie
+        orcamento = ai.Orcamento(max_nos=10**9)
+        assert matcher.resolver(prefs, max_resultados=k, workers=2, orcamento=orcamento) == serie
+        assert orcamento.completo
+    assert paralelas
+
+
+def test_servidor_recusa_workers():
+    servidor = ai.ServidorMatcher(_musicos_banda(random.Random(1110), 20))
+    pedido = {"op": "match", "workers": 2, "preferencias": {"instrumentos_requeridos": ["Guitarra", "Baixo"]}}
+    assert "workers" in servidor.processar(pedido)["erro"]
+    assert "resultados" in servidor.processar(dict(pedido, workers=1))
+
+
+# --- vocabulário incremental ----------------------------------------------------------------------
+
+
+@pytest.mark.parametrize("com_numpy", [True, False])
+@pytest.mark.parametrize("motor", sorted(ai.MOTORES_SIMILARIDADE))
+def test_termos_novos_estendem_os_vetores(motor, com_numpy, monkeypatch):
+    if com_numpy and ai.np is None:
+        pytest.skip("sem numpy")
+    if not com_numpy:
+        monkeypatch.setattr(ai, "np", None)
+    rng = random.Random(1200)
+    termos = list(dict.fromkeys(ai._normalize(t) for t in _termos(rng, 80) if t))
+    consultas = [ai._normalize(t) for t in _termos(rng, 20)]
+    vocab = ai.Vocabulario(motor)
+    for t in termos[:10]:
+        vocab.internar(t)
+    for c in consultas:
+        vocab.similaridades_de(c)
+        vocab.similaridades_para(c)
+    calculados = vocab.calculados
+
+    for t in termos[10:]:
+        vocab.internar(t)
+        for c in rng.sample(consultas, 3):
+            vocab.similaridades_de(c)
+            vocab.similaridades_para(c)
+    # nenhum vetor foi calculado de novo, e todos dão o mesmo que num vocabulário carregado de uma vez
+    assert vocab.calculados == calculados
+    novo = ai.Vocabulario(motor)
+    novo.carregar(list(vocab.termos))
+    for c in consultas:
+        assert vocab.similaridades_de(c) == novo.similaridades_de(c)
+        assert vocab.similaridades_para(c) == novo.similaridades_para(c)
+
+
+def _grafias_novas(rng, musico):
+    """O mesmo músico com localização, características e instrumentos escritos de outra maneira."""
+    musico = dict(musico, localizacao=_gralha(rng, rng.choice(CIDADES)))
+    musico["caracteristicas"] = [_gralha(rng, c) if c else c for c in musico["caracteristicas"]]
+    musico["instrumentos"] = [dict(i, nome=_gralha(rng, i["nome"])) for i in musico["instrumentos"]]
+    return musico
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_atualizar_e_pesquisar_igual_a_construir_de_novo(seed, monkeypatch):
+    rng = random.Random(1210 + seed)
+    musicos = _musicos(rng, 60)
+    matcher = ai.CSPMatcherFacade(musicos)
+    por_id = {m["id"]: m for m in musicos}
+    # só pesquisas de 1 músico: os vetores delas são dos termos pedidos, e não dos termos dos músicos
+    # encontrados (como na banda "todos_igual" sem alvo), que podem ser novos
+    fixas = [_preferencias(rng) for _ in range(8)]
+    termos = len(matcher.vocab.localizacoes) + len(matcher.vocab.caracteristicas)
+
+    for ronda in range(6):
+        for prefs in fixas:
+            matcher.resolver(prefs, max_resultados=5)
+        calculados = matcher.vocab.vetores_calculados()
+
+        novos = [_grafias_novas(rng, m) for m in _musicos(rng, 6)]
+        for i, m in enumerate(novos):
+            m["id"] = rng.choice(list(por_id)) if i % 3 == 0 else 1000 + 10 * ronda + i
+        matcher.atualizar(novos)
+        por_id.update((m["id"], m) for m in novos)
+
+        # as mesmas pesquisas depois de termos novos não recalculam nenhum vetor de similaridade
+        for prefs in fixas:
+            matcher.resolver(prefs, max_resultados=5)
+        assert matcher.vocab.vetores_calculados() == calculados
+        _iguais_ao_construido(matcher, list(por_id.values()), rng, monkeypatch)
+    assert len(matcher.vocab.localizacoes) + len(matcher.vocab.caracteristicas) > termos
+
+
+# --- leitura do payload do CLI em fluxo -----------------------------------------------------------
+
+
+class _AosBocados:
+    """Fonte de texto que devolve blocos de tamanhos ao acaso, como um pipe."""
+
+    def __init__(self, texto, rng, maximo):
+        self.texto, self.pos, self.rng, self.maximo = texto, 0, rng, maximo
+
+    def read(self, n):
+        tamanho = min(n, self.rng.randint(1, self.maximo))
+        bloco = self.texto[self.pos : self.pos + tamanho]
+        self.pos += len(bloco)
+        return bloco
+
+
+def _payload(rng, musicos_primeiro):
+    musicos = _musicos(rng, 40)
+    # textos com aspas, barras, escapes e caracteres fora do ASCII (incluindo fora do BMP)
+    for m in musicos[:8]:
+        m["nome"] = rng.choice(['Zé "Baixo" Tó', "Inês\\Sá", "Ação\n\ttab", "🎸 João", "\u0000ctrl", "São Tomé"])
+        m["caracteristicas"] = m["caracteristicas"] + ["Açúcar é “bom”"]
+    campos = {"max_resultados": rng.choice([3, 10]), "preferencias": _preferencias_payload(rng)}
+    if musicos_primeiro:
+        return {"musicos": musicos, **campos}
+    return {**campos, "musicos": musicos, "outro": [1.5e3, -2, None, True, {"a": []}]}
+
+
+def _preferencias_payload(rng):
+    dados = {"instrumento": rng.choice(["Guitarra", "Bateria", "Voz"])}
+    if rng.random() < 0.5:
+        dados["localizacao"] = rng.choice(["Lisboa", "Pôrto"])
+    if rng.random() < 0.5:
+        dados = {"instrumentos_requeridos": ["Guitarra", "Baixo"], "caracteristicas": ["Rock"]}
+    return dados
+
+
+@pytest.mark.parametrize("musicos_primeiro", [True, False])
+@pytest.mark.parametrize("seed", range(3))
+def test_payload_em_fluxo_igual_a_json_load(seed, musicos_primeiro):
+    rng = random.Random(1300 + seed)
+    filtrados = 0
+    for _ in range(4):
+        payload = _payload(rng, musicos_primeiro)
+        esperado = ai._resposta_pedido(ai.CSPMatcherFacade(payload["musicos"]), payload)
+        for ascii_ in (True, False):
+            texto = json.dumps(payload, ensure_ascii=ascii_, indent=rng.choice([None, 1]))
+            for maximo in (1, 17, 1 << 16):
+                campos, matcher = ai._ler_payload_fluxo(_AosBocados(texto, rng, maximo))
+                assert campos == {k: v for k, v in payload.items() if k != "musicos"}
+                assert ai._resposta_pedido(matcher, campos) == esperado
+                if musicos_primeiro:
+                    assert [p.dados for p in matcher.ativos()] == payload["musicos"]
+                else:
+                    # com as preferências primeiro, só ficam os músicos que podem aparecer num resultado
+                    filtrados += len(payload["musicos"]) - len(matcher)
+    assert musicos_primeiro or filtrados
+
+
+def _invalido(ler, texto):
+    """Se `ler` recusa o texto com ValueError (json.JSONDecodeError é um ValueError)."""
+    try:
+        ler(texto)
+    except ValueError:
+        return True
+    return False
+
+
+def test_payload_em_fluxo_invalido_como_json_load():
+    rng = random.Random(1310)
+    texto = json.dumps(_payload(rng, False), ensure_ascii=False)
+
+    def fluxo(t):
+        return ai._ler_payload_fluxo(_AosBocados(t, rng, 40))
+
+    invalidos = [
+        texto[:corte] for corte in sorted({1, 2, 10, len(texto) - 1} | set(range(0, len(texto), 53)))
+    ] + [
+        texto + "x",
+        texto + " {}",
+        texto.replace(":", "", 1),
+        texto.replace("]", ",]", 1),
+        texto.replace('"', "'", 2),
+        texto.replace('"preferencias"', "preferencias", 1),
+        texto.replace("[", "[1 2", 1),
+        '{"musicos": [{"id": 1}, ]}',
+        '{"musicos": [{"id": 1} {"id": 2}]}',
+        '{"preferencias": {"instrumento": "Gui\\xarra"}}',
+        '{"preferencias": "sem fim}',
+        "",
+        "   ",
+    ]
+    for invalido in invalidos:
+        assert _invalido(json.loads, invalido)
+        assert _invalido(fluxo, invalido)
+    assert not _invalido(fluxo, texto + " \n\t")
+
+
+def test_cli_com_payload_invalido_faz_o_mesmo_que_antes():
+    """O CLI antigo (json.load) respondia ao payload inválido com o exemplo embutido, tal como a um vazio."""
+    import subprocess
+    import sys
+
+    def cli(entrada):
+        return subprocess.run(
+            [sys.executable, ai.__file__], input=entrada, capture_output=True, text=True, check=True
+        ).stdout
+
+    exemplo = cli("")
+    assert "resultados" in json.loads(exemplo)
+    assert cli('{"preferencias": {"instrumento": "Voz"}, "musicos": [{"id": 1}') == exemplo
+    assert cli('{"musicos": []} lixo') == exemplo
+    payload = {"preferencias": {"instrumento": "Voz"}, "musicos": [{"id": 1, "instrumentos": [{"nome": "Voz"}]}]}
+    assert json.loads(cli(json.dumps(payload))) == ai._resposta_pedido(ai.CSPMatcherFacade(payload["musicos"]), payload)
+
+
+# --- SimpleCSP: propagação e MRV contra o backtracking cronológico ------------------------------
+
+
+def _csp_aleatorio(rng):
+    csp = ai.SimpleCSP()
+    nomes = [f"v{i}" for i in range(rng.randint(1, 4))]
+    for nome in nomes:
+        csp.add_variable(ai.Variable(nome, rng.sample(range(6), rng.randint(0, 5))))
+    for i in range(rng.randint(0, 6)):
+        # às vezes com uma variável que não existe ou repetida, que a constraint ignora / vê uma vez
+        vs = tuple(rng.choice(nomes + ["fora"] if rng.random() < 0.1 else nomes) for _ in range(rng.randint(1, 3)))
+        permitidos = {t for t in itertools.product(range(6), repeat=len(vs)) if rng.random() < 0.6}
+        csp.add_constraint(
+            ai.Constraint(f"c{i}", vs, lambda asg, vs=vs, ok=permitidos: tuple(asg[v] for v in vs) in ok)
+        )
+    return csp
+
+
+def _todas(csp):
+    """Força bruta: todas as atribuições que cumprem as constraints sobre variáveis existentes."""
+    nomes = [v.name for v in csp.variables]
+    ativas = [c for c in csp.constraints if all(v in nomes for v in c.variables)]
+    solucoes = set()
+    for valores in itertools.product(*(v.domain for v in csp.variables)):
+        asg = dict(zip(nomes, valores))
+        if all(c.func(asg) for c in ativas):
+            solucoes.add(frozenset(asg.items()))
+    return solucoes
+
+
+ESTRATEGIAS = [{}, {"propagar": True}, {"propagar": True, "arco_consistencia": True}]
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_propagacao_igual_ao_cronologico(seed):
+    rng = random.Random(1400 + seed)
+    com_solucoes = 0
+    for _ in range(300):
+        csp = _csp_aleatorio(rng)
+        todas = _todas(csp)
+        com_solucoes += bool(todas)
+        for opcoes in ESTRATEGIAS:
+            solucoes = csp.solve(max_solutions=10**6, **opcoes)
+            assert len(solucoes) == len(todas)
+            assert {frozenset(s.items()) for s in solucoes} == todas
+            # com um limite, as primeiras k de qualquer estratégia são soluções
+            k = rng.randint(0, 3)
+            parciais = csp.solve(max_solutions=k, **opcoes)
+            assert len(parciais) == min(k, len(todas))
+            assert {frozenset(s.items()) for s in parciais} <= todas
+    assert com_solucoes > 50
+
+
+def _bandas_csp(matcher, prefs, relax, opcoes):
+    csp = ai.BandCSPSolver(matcher).como_csp(prefs, relax=relax)
+    return {tuple(sorted((papel, m.id) for papel, m in s.items())) for s in csp.solve(max_solutions=10**6, **opcoes)}
+
+
+def _bandas_pesquisa(matcher, prefs, relax):
+    solver = ai.BandCSPSolver(matcher)
+    roles = list(dict.fromkeys(r for r in prefs.instrumentos_requeridos if ai._normalize(r)))
+    pesquisa = ai._PesquisaBanda(solver, prefs, roles, relax, 10**6, solver._build_domains(roles, prefs, relax))
+    if not pesquisa.viavel:
+        return set()
+    return {tuple(sorted((papel, m.id) for papel, m in asg.items())) for _o, (asg, _d) in pesquisa.executar().ordenados()}
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_como_csp_enumera_as_bandas_da_pesquisa(seed):
+    rng = random.Random(1410 + seed)
+    matcher = ai.CSPMatcherFacade(_musicos_banda(rng, 30))
+    vistas = set()
+    for _ in range(8):
+        base = {"instrumentos_requeridos": rng.sample(["Guitarra", "Baixo", "Bateria", "Voz"], rng.randint(2, 3))}
+        if rng.random() < 0.5:
+            base["caracteristicas"] = rng.sample(["Rock", "Jazz", "Pontual"], 1)
+        for politica in ("todos_igual", "mesma_regiao", "livre"):
+            for alvo in (None, rng.choice(CIDADES)):
+                prefs = ai._preferencias_from_payload(
+                    dict(base, politica_localizacao_banda=politica, localizacao=alvo)
+                )
+                for relax in (False, True):
+                    esperadas = _bandas_pesquisa(matcher, prefs, relax)
+                    for opcoes in ESTRATEGIAS:
+                        assert _bandas_csp(matcher, prefs, relax, opcoes) == esperadas
+                    if esperadas:
+                        vistas.add((politica, alvo is not None))
+    assert len(vistas) == 6
+
+
+# --- gazetteer: concelhos, distâncias e mesma_regiao -----------------------------------------------
+
+
+def _linhas_concelhos():
+    import csv
+
+    with open(ai.Gazetteer.CAMINHO, encoding="utf-8", newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def test_concelhos_completos():
+    linhas = _linhas_concelhos()
+    assert len(linhas) == 308
+    assert len({linha["distrito"] for linha in linhas}) == 20
+    gaz = ai.Gazetteer.ler()
+    assert len(gaz.nomes) == 308
+    # os nomes repetidos (Lagoa, Calheta) distinguem-se por "concelho, distrito"
+    for i, linha in enumerate(linhas):
+        assert gaz.resolver(ai._normalize(f"{linha['concelho']}, {linha['distrito']}")) == i
+        assert gaz.nomes_regioes[gaz.regioes[i]] == linha["distrito"]
+
+
+def test_distancia_haversine():
+    gaz = ai.Gazetteer.ler()
+    lisboa, porto = gaz.ids["lisboa"], gaz.ids["porto"]
+    assert 270 < ai._distancia_km(*gaz.coordenadas[lisboa], *gaz.coordenadas[porto]) < 280
+    assert ai._distancia_km(*gaz.coordenadas[lisboa], *gaz.coordenadas[lisboa]) == 0
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_perto_igual_a_forca_bruta(seed):
+    rng = random.Random(1500 + seed)
+    reais = ai.Gazetteer.ler()
+    # pontos à volta das arestas das células e a latitudes altas, onde as células ficam estreitas
+    pontos = [
+        (f"p{i}", rng.choice("abc"), rng.choice([rng.uniform(30, 70), rng.randint(60, 140) / 2 + rng.uniform(-1e-3, 1e-3)]),
+         rng.choice([rng.uniform(-35, 5), rng.randint(-70, 10) / 2 + rng.uniform(-1e-3, 1e-3)]))
+        for i in range(400)
+    ]
+    for gaz in (reais, ai.Gazetteer(pontos)):
+        for _ in range(60):
+            i = rng.randrange(len(gaz.nomes))
+            raio = rng.choice([0.5, 5, 20, 55.6, 60, 150, 400])
+            lat, lon = gaz.coordenadas[i]
+            esperado = {
+                j: ai._distancia_km(lat, lon, *c) for j, c in enumerate(gaz.coordenadas)
+                if ai._distancia_km(lat, lon, *c) <= raio
+            }
+            obtido = gaz.perto(i, raio)
+            assert len(obtido) == len(esperado)
+            assert dict(obtido) == pytest.approx(esperado)
+            assert i in esperado
+
+
+@pytest.mark.parametrize(
+    "termo, concelho, distrito",
+    [
+        ("Amadora", "amadora", "Lisboa"),
+        ("Amadorra", "amadora", "Lisboa"),
+        ("AMADORA, Lisboa", "amadora", "Lisboa"),
+        ("Setubal", "setubal", "Setúbal"),
+        ("Évora", "evora", "Évora"),
+        ("Evra", "evora", "Évora"),
+        ("Sao Joao da Pesqueira", "sao joao da pesqueira", "Viseu"),
+        ("São João da Pesquera", "sao joao da pesqueira", "Viseu"),
+        ("Freixo de Espada-à-Cinta", "freixo de espada a cinta", "Bragança"),
+        ("Guimaraes, Braga", "guimaraes", "Braga"),
+        ("Guimarães,Braga", "guimaraes", "Braga"),
+        ("Lagoa", "lagoa", "Faro"),
+        ("Lagoa, Faro", "lagoa", "Faro"),
+        ("Lagoa, Açores", "lagoa", "Açores"),
+        ("Lagoaa, Acores", "lagoa", "Açores"),
+        ("Calheta", "calheta", "Madeira"),
+        ("Calheta, Açores", "calheta", "Açores"),
+        ("Calheta, Madeira", "calheta", "Madeira"),
+        ("Rua Direita, Porto", "porto", "Porto"),
+    ],
+)
+def test_resolver_gralhas_acentos_e_distrito(termo, concelho, distrito):
+    gaz = ai.Gazetteer.ler()
+    i = gaz.resolver(ai._normalize(termo))
+    assert i >= 0 and gaz.nomes[i] == concelho
+    assert gaz.nomes_regioes[gaz.regioes[i]] == distrito
+
+
+@pytest.mark.parametrize("termo", ["Atlântida", "Xyzzy", "", "Madrid"])
+def test_resolver_desconhecidos(termo):
+    assert ai.Gazetteer.ler().resolver(ai._normalize(termo)) == -1
+
+
+# localização do músico -> distrito, escrito à mão (None: o gazetteer não a conhece)
+LOCAIS_REGIAO = {
+    "Lisboa": "Lisboa",
+    "Sintra": "Lisboa",
+    "Amadora, Lisboa": "Lisboa",
+    "Porto": "Porto",
+    "Matosinhos": "Porto",
+    "Maia": "Porto",
+    "Guimarães": "Braga",
+    "Braga": "Braga",
+    "Lagoa": "Faro",
+    "Faro": "Faro",
+    "Lagoa, Açores": "Açores",
+    "Ponta Delgada": "Açores",
+    "Calheta, Madeira": "Madeira",
+    "Funchal": "Madeira",
+    "Atlântida": None,
+}
+
+
+def _bandas_na_mesma_regiao(matcher, prefs, relax):
+    """Por força bruta sobre os domínios: as bandas com todos os membros num só distrito conhecido."""
+    solver = ai.BandCSPSolver(matcher)
+    roles = list(dict.fromkeys(r for r in prefs.instrumentos_requeridos if ai._normalize(r)))
+    domains = solver._build_domains(roles, prefs, relax)
+    alvo = LOCAIS_REGIAO.get(prefs.localizacao)
+    out = set()
+    for membros in itertools.product(*(domains[r] for r in roles)):
+        if len({m.id for m in membros}) < len(membros):
+            continue
+        regioes = {LOCAIS_REGIAO[m.dados["localizacao"]] for m in membros}
+        if len(regioes) == 1 and None not in regioes and (alvo is None or regioes == {alvo}):
+            out.add(tuple(sorted((papel, m.id) for papel, m in zip(roles, membros))))
+    return out
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_mesma_regiao_no_backtrack_na_atribuicao_e_no_csp(seed):
+    rng = random.Random(1600 + seed)
+    musicos = _musicos_banda(rng, 60)
+    for m in musicos:
+        m["localizacao"] = rng.choice(list(LOCAIS_REGIAO))
+    matcher = ai.CSPMatcherFacade(musicos)
+    vistos = set()
+    for _ in range(4):
+        papeis = rng.sample(["Guitarra", "Baixo", "Bateria", "Voz"], rng.randint(2, 3))
+        # com raio_km, os domínios passam a ter músicos de outros distritos perto do alvo (Braga a ~50 km
+        # do Porto): só a constraint de região os separa
+        for alvo, raio in itertools.product((None, "Porto", "Lagoa, Açores", "Calheta, Madeira", "Atlântida"), (None, 60)):
+            prefs = ai._preferencias_from_payload(
+                {
+                    "instrumentos_requeridos": papeis,
+                    "politica_localizacao_banda": "mesma_regiao",
+                    "localizacao": alvo,
+                    "raio_km": raio,
+                }
+            )
+            for relax in (False, True):
+                esperadas = _bandas_na_mesma_regiao(matcher, prefs, relax)
+                assert _bandas_pesquisa(matcher, prefs, relax) == esperadas
+                for opcoes in ESTRATEGIAS:
+                    assert _bandas_csp(matcher, prefs, relax, opcoes) == esperadas
+                # com K acima do número de bandas, o top-K são todas
+                k = rng.choice([1, 3, 8, len(esperadas) + 1])
+                par = _backtrack_e_atribuicao(matcher, prefs, relax, k)
+                if par is not None:
+                    assert par[1] == par[0]
+                    obtidas = {tuple(sorted((membro["papel"], membro["id"]) for membro in banda["membros"])) for banda in par[1]}
+                    assert obtidas == esperadas if k > len(esperadas) else obtidas <= esperadas
+                if esperadas:
+                    vistos.add(alvo)
+    assert None in vistos and len(vistos) >= 3
@@ -1,100 +1,8 @@
-const path = require('path');
-const { spawn } = require('child_process');
-const User = require('../models/userModel');
+const matcherPool = require('../services/matcherPool');
+require('../services/matcherIndex');
 
-const runQuery = (fn, ...args) =>
-  new Promise((resolve, reject) => {
-    fn(...args, (err, result) => {
-      if (err) reject(err);
-      else resolve(result);
-    });
-  });
-
-const parseInstrumentos = (raw) => {
-  if (!raw) return [];
-  return raw
-    .split('||')
-    .map((item) => {
-      const [nome, anos, nivel] = item.split('::');
-      const parsed = Number(anos);
-      const anosNum =
-        Number.isFinite(parsed) && `${anos ?? ''}`.trim() !== '' ? parsed : null;
-      return {
-        nome: (nome || '').trim(),
-        anos_experiencia: anosNum,
-        nivel: (nivel || '').trim(),
-      };
-    })
-    .filter((inst) => inst.nome);
-};
-
-const parseCaracteristicas = (raw) => {
-  if (!raw) return [];
-  return raw.split('||').filter(Boolean);
-};
-
-const buildMusicians = (rows, ignoreUserId) =>
-  rows
-    .filter((row) => !ignoreUserId || Number(row.id) !== Number(ignoreUserId))
-    .filter((row) => (row.tipo || '').toLowerCase() !== 'banda')
-    .map((row) => {
-      const instrumentos = parseInstrumentos(row.instrumentos_raw);
-      const anosList = instrumentos
-        .map((i) => i.anos_experiencia)
-        .filter((val) => Number.isFinite(val));
-      const anos_experiencia =
-        anosList.length > 0 ? Math.min(...anosList) : null;
-      return {
-        id: row.id,
-        nome: row.nome,
-        localizacao: row.localizacao,
-        instrumentos,
-        caracteristicas: parseCaracteristicas(row.caracteristicas_raw),
-        anos_experiencia,
-      };
-    });
-
-const runPythonMatcher = (musicos, preferencias) =>
-  new Promise((resolve, reject) => {
-    const pythonBin = process.env.PYTHON_BIN || 'python3';
-    const scriptPath = path.join(__dirname, '..', '..', 'ai', 'ai.py');
-
-    const child = spawn(pythonBin, [scriptPath], {
-      stdio: ['pipe', 'pipe', 'pipe'],
-    });
-
-    let stdout = '';
-    let stderr = '';
-
-    child.stdout.on('data', (data) => {
-      stdout += data.toString();
-    });
-    child.stderr.on('data', (data) => {
-      stderr += data.toString();
-    });
-
-    child.on('close', (code) => {
-      if (code !== 0) {
-        return reject(new Error(stderr || `Python matcher saiu com código ${code}`));
-      }
-      try {
-        const parsed = JSON.parse(stdout);
-        if (parsed && parsed.resultados) return resolve(parsed.resultados);
-        return reject(new Error('Resposta inválida do matcher'));
-      } catch (err) {
-        return reject(new Error(`Falha a ler saída do matcher: ${err.message}`));
-      }
-    });
-
-    child.stdin.write(
-      JSON.stringify({
-        musicos,
-        preferencias,
-        max_resultados: 10,
-      })
-    );
-    child.stdin.end();
-  });
+const runPythonMatcher = (preferencias, signal, paginacao) =>
+  matcherPool.match(preferencias, 10, { signal, ...paginacao });
 
 const canonicalizeInstrument = (raw) => {
   const trimmed = typeof raw === 'string' ? raw.trim() : '';
@@ -122,23 +30,29 @@ exports.match = async (req, res) => {
     instrumento,
     anosExperiencia,
     localizacao,
+    raioKm,
     caracteristicas,
     userId,
     instrumentos_requeridos,
     banda,
     requisitos_por_instrumento,
     politica_localizacao_banda,
+    paginar,
+    cursor,
   } = req.body || {};
 
-  try {
-    const rows = await runQuery(User.getAllWithDetails);
-    const musicos = buildMusicians(rows, userId);
+  // com paginar (ou o cursor devolvido antes), a resposta traz nextCursor para pedir a página seguinte
+  const paginado = Boolean(paginar || cursor);
 
-    if (!musicos.length) {
-      return res.status(200).json({ matches: [], message: 'Ainda não existem músicos suficientes na base de dados.' });
-    }
+  // se o cliente fechar a ligação antes da resposta, a pesquisa é cancelada no matcher
+  const abort = new AbortController();
+  res.on('close', () => {
+    if (!res.writableEnded) abort.abort();
+  });
 
+  try {
     const parsedYears = Number(anosExperiencia);
+    const parsedRadius = Number(raioKm);
     const instrumentosReqRaw =
       instrumentos_requeridos ||
       (banda && (banda.instrumentos || banda.instrumentos_requeridos)) ||
@@ -158,13 +72,25 @@ exports.match = async (req, res) => {
           ? parsedYears
           : null,
       localizacao: localizacao || null,
+      // com raio (km), a localização conta pela distância ao concelho em vez do texto
+      raio_km: Number.isFinite(parsedRadius) && parsedRadius > 0 ? parsedRadius : null,
       caracteristicas: Array.isArray(caracteristicas) ? caracteristicas : [],
       instrumentos_requeridos: instrumentos_reqs,
       requisitos_por_instrumento: requisitosPorInstrumento,
       politica_localizacao_banda: politicaBanda,
+      excluir_ids: userId ? [userId] : [],
     };
 
-    const resultados = await runPythonMatcher(musicos, preferencias);
+    const {
+      resultados,
+      total,
+      total_resultados: totalResultados,
+      cursor: nextCursor,
+    } = await runPythonMatcher(preferencias, abort.signal, { paginar: paginado, cursor });
+
+    if (!total) {
+      return res.status(200).json({ matches: [], message: 'Ainda não existem músicos suficientes na base de dados.' });
+    }
 
     const onlyInstrument =
       !!preferencias.instrumento &&
@@ -231,7 +157,8 @@ exports.match = async (req, res) => {
           (r.localizacao_ratio ?? 0) >= 0.7;
         return instOk && anosOk && locOk;
       })
-      .slice(0, 5);
+      // paginado, cada página mostra todos os semelhantes que trouxe
+      .slice(0, paginado ? undefined : 5);
 
     let matches = [...exatos, ...similares];
 
@@ -248,10 +175,13 @@ exports.match = async (req, res) => {
       };
     });
 
+    const paginacao = paginado ? { nextCursor: nextCursor || null, totalMatches: totalResultados ?? null } : {};
+
     if (enrichedMatches.length === 0) {
       return res.status(200).json({
         matches: [],
         message: 'Não encontrei nada com essas características, tenta relaxar as tuas exigências.',
+        ...paginacao,
       });
     }
 
@@ -259,8 +189,20 @@ exports.match = async (req, res) => {
       matches: enrichedMatches,
       exactCount: onlyInstrument ? enrichedMatches.length : exatos.length,
       similarCount: onlyInstrument ? 0 : similares.length,
+      ...paginacao,
     });
   } catch (err) {
+    if (err.code === 'MATCHER_CANCELADO') return undefined;
+    if (err.code === 'MATCHER_OCUPADO') {
+      res.set('Retry-After', '1');
+      return res.status(503).json({ error: 'O motor AI está ocupado, tenta outra vez daqui a pouco.' });
+    }
+    if (err.code === 'MATCHER_CURSOR') {
+      return res.status(410).json({ error: 'Estes resultados já não estão disponíveis, repete a pesquisa.' });
+    }
+    if (err.code === 'MATCHER_TIMEOUT') {
+      return res.status(504).json({ error: 'O motor AI demorou demasiado a responder.', detail: err.message });
+    }
     console.error('Erro no matcher AI:', err.message);
     return res.status(500).json({ error: 'Não foi possível gerar sugestões com o motor AI', detail: err.message });
   }
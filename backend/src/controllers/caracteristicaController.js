@@ -1,4 +1,5 @@
 const Caracteristica = require('../models/caracteristicaModel');
+const matcherIndex = require('../services/matcherIndex');
 
 exports.getAll = (req, res) => {
   Caracteristica.getAll((err, rows) => {
@@ -55,6 +56,7 @@ exports.update = (req, res) => {
     if (result.affectedRows === 0)
       return res.status(404).json({ message: 'Característica não encontrada' });
 
+    matcherIndex.catalogChanged();
     res.json({ message: 'Característica atualizada com sucesso' });
   });
 };
@@ -65,6 +67,7 @@ exports.delete = (req, res) => {
   Caracteristica.delete(id, (err) => {
     if (err) return res.status(500).json({ error: err.message });
 
+    matcherIndex.catalogChanged();
     res.json({ message: 'Característica eliminada com sucesso' });
   });
 };
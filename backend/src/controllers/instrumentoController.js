@@ -1,4 +1,5 @@
 const Instrumento = require('../models/instrumentoModel');
+const matcherIndex = require('../services/matcherIndex');
 
 exports.getAll = (req, res) => {
   Instrumento.getAll((err, rows) => {
@@ -46,6 +47,7 @@ exports.update = (req, res) => {
     if (result.affectedRows === 0) {
       return res.status(404).json({ message: 'Instrumento não encontrado' });
     }
+    matcherIndex.catalogChanged();
     res.json({ message: 'Instrumento atualizado com sucesso' });
   });
 };
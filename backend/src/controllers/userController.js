@@ -4,6 +4,7 @@ const bcrypt = require('bcrypt');
 const User = require('../models/userModel');
 const Instrumento = require('../models/instrumentoModel');
 const UserInst = require('../models/userInstModel');
+const matcherIndex = require('../services/matcherIndex');
 
 const VALID_LEVELS = ['iniciante', 'intermedio', 'avancado', 'profissional'];
 
@@ -175,6 +176,7 @@ exports.create = async (req, res) => {
         } catch (linkErr) {
           console.error('Erro ao ligar instrumento ao user:', linkErr);
         }
+        matcherIndex.userChanged(result.insertId);
         res.status(201).json({ id: result.insertId, nome, email, tipo });
       }
     );
@@ -223,6 +225,7 @@ exports.update = (req, res) => {
       } catch (linkErr) {
         console.error('Erro ao atualizar instrumento do user:', linkErr);
       }
+      matcherIndex.userChanged(id);
       res.json({ message: 'User atualizado com sucesso' });
     }
   );
@@ -325,6 +328,7 @@ exports.delete = (req, res) => {
     if (result.affectedRows === 0) {
       return res.status(404).json({ message: 'User não encontrado' });
     }
+    matcherIndex.userRemoved(id);
     res.json({ message: 'User eliminado com sucesso' });
   });
 };
@@ -1,4 +1,5 @@
 const UserInst = require('../models/userInstModel');
+const matcherIndex = require('../services/matcherIndex');
 
 const normalizeYears = (value) => {
   if (value === undefined || value === null || value === '') return null;
@@ -30,6 +31,7 @@ const create = (req, res) => {
     { user_id, instrumento_id, nivel, anos_experiencia: normalizeYears(anosPayload) },
     (err) => {
       if (err) return res.status(500).json({ error: err.message });
+      matcherIndex.userChanged(user_id);
       res.status(201).json({ message: 'Registo criado com sucesso' });
     }
   );
@@ -46,6 +48,7 @@ const update = (req, res) => {
     normalizeYears(anosPayload),
     (err) => {
       if (err) return res.status(500).json({ error: err.message });
+      matcherIndex.userChanged(user_id);
       res.json({ message: 'Nível atualizado com sucesso' });
     }
   );
@@ -55,6 +58,7 @@ const deleteUserInst = (req, res) => {
   const { user_id, instrumento_id } = req.params;
   UserInst.delete(user_id, instrumento_id, (err) => {
     if (err) return res.status(500).json({ error: err.message });
+    matcherIndex.userChanged(user_id);
     res.json({ message: 'Registo eliminado com sucesso' });
   });
 };
@@ -1,4 +1,5 @@
 const UserCar = require('../models/usercarModel');
+const matcherIndex = require('../services/matcherIndex');
 
 exports.getAll = (req, res) => {
   UserCar.getAll((err, rows) => {
@@ -37,6 +38,7 @@ exports.create = (req, res) => {
 
   UserCar.create({ user_id, caracteristica_id, valor }, (err) => {
     if (err) return res.status(500).json({ error: err.message });
+    matcherIndex.userChanged(user_id);
 
     res.status(201).json({
       message: 'Característica associada ao utilizador com sucesso',
@@ -54,6 +56,7 @@ exports.update = (req, res) => {
     if (result.affectedRows === 0)
       return res.status(404).json({ message: 'Registo não encontrado' });
 
+    matcherIndex.userChanged(user_id);
     res.json({ message: 'Valor atualizado com sucesso' });
   });
 };
@@ -63,6 +66,7 @@ exports.delete = (req, res) => {
 
   UserCar.delete(user_id, caracteristica_id, (err) => {
     if (err) return res.status(500).json({ error: err.message });
+    matcherIndex.userChanged(user_id);
 
     res.json({ message: 'Registo eliminado com sucesso' });
   });
@@ -80,11 +84,13 @@ exports.replaceForUser = (req, res) => {
     if (err) return res.status(500).json({ error: err.message });
 
     if (!caracteristicaIds.length) {
+      matcherIndex.userChanged(user_id);
       return res.json({ message: 'Características atualizadas com sucesso' });
     }
 
     UserCar.bulkInsert(user_id, caracteristicaIds, (insertErr) => {
       if (insertErr) return res.status(500).json({ error: insertErr.message });
+      matcherIndex.userChanged(user_id);
       res.json({ message: 'Características atualizadas com sucesso' });
     });
   });
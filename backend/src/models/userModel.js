@@ -1,5 +1,27 @@
 const db = require('../config/db');
 
+// Utilizadores com instrumentos e características agregados em `::`/`||` (usado pelo matcher).
+const detailsQuery = (where) =>
+  `SELECT
+     u.id,
+     u.nome,
+     u.email,
+     u.tipo,
+     u.sexo,
+     u.descricao,
+     u.foto_url,
+     u.data_nascimento,
+     u.localizacao,
+     GROUP_CONCAT(DISTINCT CONCAT_WS('::', i.nome, IFNULL(ui.anos_experiencia, ''), IFNULL(ui.nivel, '')) SEPARATOR '||') AS instrumentos_raw,
+     GROUP_CONCAT(DISTINCT c.nome ORDER BY c.nome SEPARATOR '||') AS caracteristicas_raw
+   FROM User u
+   LEFT JOIN User_inst ui ON ui.user_id = u.id
+   LEFT JOIN Instrumento i ON i.id = ui.instrumento_id
+   LEFT JOIN UserCar uc ON uc.user_id = u.id
+   LEFT JOIN Caracteristica c ON c.id = uc.caracteristica_id
+   ${where}
+   GROUP BY u.id, u.nome, u.email, u.tipo, u.sexo, u.descricao, u.foto_url, u.data_nascimento, u.localizacao`;
+
 const User = {
   getAll: (callback) => {
     db.query(
@@ -36,27 +58,11 @@ const User = {
   },
 
   getAllWithDetails: (callback) => {
-    db.query(
-      `SELECT
-         u.id,
-         u.nome,
-         u.email,
-         u.tipo,
-         u.sexo,
-         u.descricao,
-         u.foto_url,
-         u.data_nascimento,
-         u.localizacao,
-         GROUP_CONCAT(DISTINCT CONCAT_WS('::', i.nome, IFNULL(ui.anos_experiencia, ''), IFNULL(ui.nivel, '')) SEPARATOR '||') AS instrumentos_raw,
-         GROUP_CONCAT(DISTINCT c.nome ORDER BY c.nome SEPARATOR '||') AS caracteristicas_raw
-       FROM User u
-       LEFT JOIN User_inst ui ON ui.user_id = u.id
-       LEFT JOIN Instrumento i ON i.id = ui.instrumento_id
-       LEFT JOIN UserCar uc ON uc.user_id = u.id
-       LEFT JOIN Caracteristica c ON c.id = uc.caracteristica_id
-       GROUP BY u.id, u.nome, u.email, u.tipo, u.sexo, u.descricao, u.foto_url, u.data_nascimento, u.localizacao`,
-      callback
-    );
+    db.query(detailsQuery(''), callback);
+  },
+
+  getByIdWithDetails: (id, callback) => {
+    db.query(detailsQuery('WHERE u.id = ?'), [id], callback);
   },
 
   create: (data, callback) => {
@@ -0,0 +1,89 @@
+const User = require('../models/userModel');
+const matcherPool = require('./matcherPool');
+
+const runQuery = (fn, ...args) =>
+  new Promise((resolve, reject) => {
+    fn(...args, (err, result) => {
+      if (err) reject(err);
+      else resolve(result);
+    });
+  });
+
+const parseInstrumentos = (raw) => {
+  if (!raw) return [];
+  return raw
+    .split('||')
+    .map((item) => {
+      const [nome, anos, nivel] = item.split('::');
+      const parsed = Number(anos);
+      const anosNum =
+        Number.isFinite(parsed) && `${anos ?? ''}`.trim() !== '' ? parsed : null;
+      return {
+        nome: (nome || '').trim(),
+        anos_experiencia: anosNum,
+        nivel: (nivel || '').trim(),
+      };
+    })
+    .filter((inst) => inst.nome);
+};
+
+const parseCaracteristicas = (raw) => {
+  if (!raw) return [];
+  return raw.split('||').filter(Boolean);
+};
+
+// Bandas não entram no índice de músicos.
+const buildMusician = (row) => {
+  if ((row.tipo || '').toLowerCase() === 'banda') return null;
+  const instrumentos = parseInstrumentos(row.instrumentos_raw);
+  const anosList = instrumentos
+    .map((i) => i.anos_experiencia)
+    .filter((val) => Number.isFinite(val));
+  const anos_experiencia =
+    anosList.length > 0 ? Math.min(...anosList) : null;
+  return {
+    id: row.id,
+    nome: row.nome,
+    localizacao: row.localizacao,
+    instrumentos,
+    caracteristicas: parseCaracteristicas(row.caracteristicas_raw),
+    anos_experiencia,
+  };
+};
+
+const loadAll = async () => {
+  const rows = await runQuery(User.getAllWithDetails);
+  return rows.map(buildMusician).filter(Boolean);
+};
+
+matcherPool.setLoader(loadAll);
+
+// Volta a ler um utilizador e envia o perfil (ou a remoção) ao matcher.
+// Os controllers chamam isto depois de gravar e não esperam pelo resultado.
+const userChanged = (userId) => {
+  if (!userId) return Promise.resolve();
+  return runQuery(User.getByIdWithDetails, userId)
+    .then((rows) => {
+      const musico = rows.length ? buildMusician(rows[0]) : null;
+      if (musico) return matcherPool.broadcast({ op: 'atualizar', musicos: [musico] });
+      return matcherPool.broadcast({ op: 'remover', ids: [userId] });
+    })
+    .catch((err) => console.error('Falha ao atualizar o índice do matcher:', err.message));
+};
+
+const userRemoved = (userId) =>
+  matcherPool
+    .broadcast({ op: 'remover', ids: [userId] })
+    .catch((err) => console.error('Falha ao atualizar o índice do matcher:', err.message));
+
+// Mudar o nome de um instrumento ou característica afeta muitos perfis: recarrega tudo.
+const catalogChanged = () =>
+  matcherPool
+    .reloadAll()
+    .catch((err) => console.error('Falha ao recarregar o matcher:', err.message));
+
+module.exports = {
+  catalogChanged,
+  userChanged,
+  userRemoved,
+};
@@ -0,0 +1,230 @@
+const path = require('path');
+const readline = require('readline');
+const { spawn } = require('child_process');
+
+const SCRIPT_PATH = path.join(__dirname, '..', '..', 'ai', 'ai.py');
+
+const parsePositiveInt = (raw, fallback) => {
+  const parsed = Number(raw);
+  return Number.isInteger(parsed) && parsed > 0 ? parsed : fallback;
+};
+
+// Erros com code: MATCHER_OCUPADO (o worker tem a fila cheia), MATCHER_TIMEOUT, MATCHER_CANCELADO
+// e MATCHER_CURSOR (cursor de paginação inválido ou expirado).
+const matcherError = (message, code) => Object.assign(new Error(message), { code });
+
+// Devolve (Promise) a lista completa de músicos; é registado pelo matcherIndex.
+let loader = null;
+
+// Um worker é um processo `ai.py --servidor` que fica vivo entre pedidos.
+// Os pedidos seguem como JSON (um por linha) com um id, e as respostas voltam com o mesmo id.
+// Cada worker tem o seu índice de músicos: é carregado quando arranca e depois só recebe
+// as alterações (atualizar/remover) por utilizador.
+class MatcherWorker {
+  constructor() {
+    this.pending = new Map();
+    this.nextId = 1;
+    this.child = null;
+    this.ready = null;
+    this.backlog = null;
+  }
+
+  start() {
+    const pythonBin = process.env.PYTHON_BIN || 'python3';
+    const child = spawn(pythonBin, [SCRIPT_PATH, '--servidor'], {
+      stdio: ['pipe', 'pipe', 'pipe'],
+    });
+
+    const lines = readline.createInterface({ input: child.stdout });
+    lines.on('line', (line) => this.handleLine(line));
+
+    let stderr = '';
+    child.stderr.on('data', (data) => {
+      stderr = (stderr + data.toString()).slice(-4000);
+    });
+
+    child.on('close', (code) => {
+      if (this.child === child) this.child = null;
+      const err = new Error(stderr || `Python matcher saiu com código ${code}`);
+      for (const { reject } of this.pending.values()) reject(err);
+      this.pending.clear();
+    });
+
+    child.stdin.on('error', () => {});
+    this.child = child;
+    this.reload();
+  }
+
+  // Enquanto a carga completa não é enviada, as alterações ficam em espera e seguem logo a seguir,
+  // para nunca serem apagadas por uma lista lida antes delas.
+  reload() {
+    this.backlog = [];
+    this.ready = Promise.resolve(loader ? loader() : [])
+      .then((musicos) => this.send({ op: 'carregar', musicos }))
+      .catch((err) => console.error('Falha ao carregar músicos no matcher:', err.message))
+      .then(() => {
+        const backlog = this.backlog;
+        this.backlog = null;
+        return Promise.all(backlog.map((message) => this.send(message)));
+      })
+      .catch((err) => console.error('Falha ao atualizar o matcher:', err.message));
+    return this.ready;
+  }
+
+  notify(message) {
+    if (!this.child) return null;
+    if (this.backlog) {
+      this.backlog.push(message);
+      return this.ready;
+    }
+    return this.send(message);
+  }
+
+  handleLine(line) {
+    let parsed;
+    try {
+      parsed = JSON.parse(line);
+    } catch (err) {
+      console.error('Resposta inválida do matcher:', line.slice(0, 200));
+      return;
+    }
+
+    const entry = this.pending.get(parsed.id);
+    if (!entry) return;
+    this.pending.delete(parsed.id);
+
+    if (parsed.ocupado) return entry.reject(matcherError(parsed.erro, 'MATCHER_OCUPADO'));
+    if (parsed.cursor_expirado) return entry.reject(matcherError(parsed.erro, 'MATCHER_CURSOR'));
+    if (parsed.erro) return entry.reject(new Error(parsed.erro));
+    return entry.resolve(parsed);
+  }
+
+  // Com timeoutMs ou signal (AbortSignal), o pedido pode ser abandonado antes da resposta.
+  send(message, { timeoutMs, signal } = {}) {
+    if (!this.child) this.start();
+    const id = this.nextId++;
+    return new Promise((resolve, reject) => {
+      if (signal && signal.aborted) {
+        reject(matcherError('Pedido cancelado', 'MATCHER_CANCELADO'));
+        return;
+      }
+
+      let timer = null;
+      const onAbort = () => this.cancel(id, matcherError('Pedido cancelado', 'MATCHER_CANCELADO'));
+      const cleanup = () => {
+        clearTimeout(timer);
+        if (signal) signal.removeEventListener('abort', onAbort);
+      };
+      this.pending.set(id, {
+        resolve: (value) => {
+          cleanup();
+          resolve(value);
+        },
+        reject: (err) => {
+          cleanup();
+          reject(err);
+        },
+      });
+
+      if (timeoutMs) {
+        timer = setTimeout(
+          () => this.cancel(id, matcherError(`O matcher não respondeu em ${timeoutMs} ms`, 'MATCHER_TIMEOUT')),
+          timeoutMs
+        );
+      }
+      if (signal) signal.addEventListener('abort', onAbort, { once: true });
+      this.child.stdin.write(`${JSON.stringify({ ...message, id })}\n`);
+    });
+  }
+
+  // Desiste de um pedido: falha já do lado do Node e avisa o worker, que deixa de gastar tempo com ele.
+  // A resposta que ainda chegar (com "cancelado") já não tem ninguém à espera e é ignorada.
+  cancel(id, err) {
+    const entry = this.pending.get(id);
+    if (!entry) return;
+    this.pending.delete(id);
+    entry.reject(err);
+    if (this.child) {
+      this.child.stdin.write(`${JSON.stringify({ op: 'cancelar', alvo: id, id: this.nextId++ })}\n`);
+    }
+  }
+
+  get load() {
+    return this.pending.size;
+  }
+}
+
+const workers = Array.from(
+  { length: parsePositiveInt(process.env.AI_WORKERS, 2) },
+  () => new MatcherWorker()
+);
+
+// Prazo da pesquisa de bandas; ao fim dele o matcher devolve as melhores bandas encontradas.
+const PRAZO_MS = parsePositiveInt(process.env.AI_PRAZO_MS, 2000);
+
+// Ao fim de AI_TIMEOUT_MS sem resposta o pedido falha (MATCHER_TIMEOUT) e é cancelado no worker.
+const TIMEOUT_MS = parsePositiveInt(process.env.AI_TIMEOUT_MS, PRAZO_MS * 3);
+
+// Com AI_ESTATISTICAS=1 o matcher devolve tempos e contadores de cada pesquisa;
+// as que passam de AI_LENTO_MS ficam no log para se perceber onde foi gasto o tempo.
+const ESTATISTICAS = process.env.AI_ESTATISTICAS === '1';
+const LENTO_MS = parsePositiveInt(process.env.AI_LENTO_MS, 500);
+
+const pickWorker = () =>
+  workers.reduce((best, worker) => (worker.load < best.load ? worker : best), workers[0]);
+
+const setLoader = (fn) => {
+  loader = fn;
+};
+
+// Envia uma alteração do índice a todos os workers que já arrancaram (os outros carregam tudo ao arrancar).
+const broadcast = (message) =>
+  Promise.all(workers.map((worker) => worker.notify(message)).filter(Boolean));
+
+const reloadAll = () =>
+  Promise.all(workers.filter((worker) => worker.child).map((worker) => worker.reload()));
+
+// O ranking de uma pesquisa paginada fica no worker que a fez, por isso o cursor devolvido
+// é "<índice do worker>.<cursor do matcher>" e a página seguinte vai para esse worker.
+const workerDoCursor = (cursor) => {
+  const texto = String(cursor);
+  const ponto = texto.indexOf('.');
+  const worker = ponto > 0 ? workers[Number(texto.slice(0, ponto))] : null;
+  if (!worker) throw matcherError('Cursor inválido', 'MATCHER_CURSOR');
+  return { worker, cursorMatcher: texto.slice(ponto + 1) };
+};
+
+// Devolve { resultados, total }, onde total é o número de músicos no índice.
+// Abortar o signal (p.ex. quando o cliente HTTP desiste) cancela a pesquisa no worker.
+// Com paginar (ou um cursor) a resposta traz também total_resultados e, se houver mais páginas, cursor.
+const match = async (preferencias, maxResultados = 10, { signal, paginar = false, cursor = null } = {}) => {
+  const { worker, cursorMatcher } = cursor ? workerDoCursor(cursor) : { worker: pickWorker(), cursorMatcher: null };
+  if (!worker.child) worker.start();
+  await worker.ready;
+  const paginacao = cursorMatcher ? { cursor: cursorMatcher } : paginar ? { paginar: true } : {};
+  const resposta = await worker.send(
+    {
+      op: 'match',
+      preferencias,
+      max_resultados: maxResultados,
+      orcamento: { prazo_ms: PRAZO_MS },
+      estatisticas: ESTATISTICAS,
+      ...paginacao,
+    },
+    { timeoutMs: TIMEOUT_MS, signal }
+  );
+  if (!resposta || !resposta.resultados) throw new Error('Resposta inválida do matcher');
+  if (resposta.cursor) resposta.cursor = `${workers.indexOf(worker)}.${resposta.cursor}`;
+  const { estatisticas } = resposta;
+  if (estatisticas && estatisticas.total_ms >= LENTO_MS) {
+    console.warn('Pesquisa lenta no matcher:', JSON.stringify(estatisticas));
+  }
+  return resposta;
+};
+
+module.exports = {
+  broadcast,
+  match,
+  reloadAll,
+  setLoader,
+};
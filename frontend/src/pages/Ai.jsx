@@ -145,13 +145,14 @@ function Ai() {
         (async () => {
             try {
                 setLoadingMatch(true);
-                const data = await AiAPI.matchMusicos({
+                const pedido = {
                     instrumento: prefs.instrumento,
                     anosExperiencia: prefs.anosExperiencia,
                     localizacao: prefs.localizacao,
                     caracteristicas: prefs.caracteristicas,
                     userId: prefs.userId,
-                });
+                };
+                const data = await AiAPI.matchMusicos({ ...pedido, paginar: true });
                 const matches = data?.matches || [];
                 const noResultsMessage =
                     (!matches.length && data?.message) ||
@@ -166,6 +167,9 @@ function Ai() {
                     texto: noResultsMessage || formatted.intro,
                     listItems: formatted.listItems,
                     matches: matches.map((m) => ({ id: m.id, nome: m.nome })),
+                    pedido,
+                    prefs,
+                    cursor: data?.nextCursor || null,
                 };
                 setMessages((prev) => [...prev, respostaAI]);
             } catch (error) {
@@ -185,6 +189,44 @@ function Ai() {
         })();
     };
 
+    // Pede a página seguinte de uma pesquisa já feita, com o cursor que veio na resposta anterior.
+    const handleMore = (index) => {
+        const anterior = messages[index];
+        if (loadingMatch || !anterior?.cursor) return;
+        const semCursor = (prev) => prev.map((msg, i) => (i === index ? { ...msg, cursor: null } : msg));
+
+        (async () => {
+            try {
+                setLoadingMatch(true);
+                const data = await AiAPI.matchMusicos({ ...anterior.pedido, cursor: anterior.cursor });
+                const matches = data?.matches || [];
+                const respostaAI = {
+                    remetente: "ai",
+                    texto: matches.length ? "Mais perfis para o teu pedido:" : "Não encontrei mais perfis para este pedido.",
+                    listItems: formatResponse(matches, anterior.prefs).listItems,
+                    matches: matches.map((m) => ({ id: m.id, nome: m.nome })),
+                    pedido: anterior.pedido,
+                    prefs: anterior.prefs,
+                    cursor: data?.nextCursor || null,
+                };
+                setMessages((prev) => [...semCursor(prev), respostaAI]);
+            } catch (error) {
+                const respostaAI = {
+                    remetente: "ai",
+                    texto: error.message || "Não consegui carregar mais sugestões agora. Tenta mais tarde.",
+                    matches: [],
+                    listItems: [],
+                };
+                setMessages((prev) => [...semCursor(prev), respostaAI]);
+            } finally {
+                setLoadingMatch(false);
+                setTimeout(() => {
+                    chatEndRef.current?.scrollIntoView({ behavior: "smooth" });
+                }, 50);
+            }
+        })();
+    };
+
     return (
         <>
             <main className={styles.aiPage}>
@@ -220,6 +262,16 @@ function Ai() {
                                         ))}
                                     </ul>
                                 )}
+                                {msg.cursor && (
+                                    <button
+                                        type="button"
+                                        className={styles.moreButton}
+                                        onClick={() => handleMore(i)}
+                                        disabled={loadingMatch}
+                                    >
+                                        {loadingMatch ? "A procurar..." : "Mostrar mais"}
+                                    </button>
+                                )}
                             </div>
                         ))}
                         <div ref={chatEndRef} />